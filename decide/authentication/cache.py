@@ -0,0 +1,88 @@
+'''
+Users of the tokens, as returned by GetUserView, for the views that check
+the user of every request: { "id", "username", "first_name", "last_name",
+"email", "is_staff" }
+
+The users are kept for TOKEN_CACHE_TTL seconds in the django cache
+TOKEN_CACHE (an alias of CACHES), shared by all the processes, or if it's
+None in an LRU of TOKEN_CACHE_SIZE tokens in each process. A token is
+forgotten when it's deleted (logout) or its user is saved. With the shared
+cache all the processes forget it at once, without it only this process
+does, and the others accept the old user until it expires in their LRU.
+'''
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authtoken.models import Token
+
+from .serializers import UserSerializer
+
+
+_users = OrderedDict()
+_lock = threading.Lock()
+
+
+def cache_key(key):
+    return 'token-user:{}'.format(key)
+
+
+def shared():
+    if settings.TOKEN_CACHE is None:
+        return None
+    return caches[settings.TOKEN_CACHE]
+
+
+def db_user(key):
+    tk = Token.objects.select_related('user').filter(key=key).first()
+    if tk is None:
+        return None
+    return UserSerializer(tk.user, many=False).data
+
+
+def token_user(key):
+    '''
+    User of the token key, None if there's no such token
+    '''
+    if not key or not isinstance(key, str):
+        return None
+
+    cache = shared()
+    if cache:
+        # no local copy, so the tokens forgotten in other processes aren't
+        # accepted here
+        user = cache.get(cache_key(key))
+        if user is None:
+            user = db_user(key)
+            if user is not None:
+                cache.set(cache_key(key), user, settings.TOKEN_CACHE_TTL)
+        return user
+
+    now = time.monotonic()
+    with _lock:
+        entry = _users.get(key, None)
+        if entry is not None and entry[0] > now:
+            _users.move_to_end(key)
+            return entry[1]
+
+    user = db_user(key)
+    if user is None:
+        return None
+    with _lock:
+        _users[key] = (now + settings.TOKEN_CACHE_TTL, user)
+        _users.move_to_end(key)
+        while len(_users) > settings.TOKEN_CACHE_SIZE:
+            _users.popitem(last=False)
+    return user
+
+
+def forget(*keys):
+    with _lock:
+        for key in keys:
+            _users.pop(key, None)
+    cache = shared()
+    if cache:
+        cache.delete_many([cache_key(key) for key in keys])
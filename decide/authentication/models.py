@@ -1,3 +1,17 @@
-from django.db import models
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
 
-# Create your models here.
+from .cache import forget
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance, **kwargs):
+    forget(instance.key)
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, **kwargs):
+    # a user may have changed is_staff, see authentication.cache
+    forget(*Token.objects.filter(user_id=instance.pk).values_list('key', flat=True))
@@ -1,10 +1,13 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from rest_framework.test import APIClient
 from rest_framework.test import APITestCase
 
 from django.contrib.auth.models import User
+from django.core.cache import caches
 from rest_framework.authtoken.models import Token
 
+from authentication import cache
+from authentication.cache import token_user
 from base import mods
 
 
@@ -85,6 +88,47 @@ class AuthTestCase(APITestCase):
 
         self.assertEqual(Token.objects.filter(user__username='voter1').count(), 0)
 
+    def check_token_cache(self):
+        data = {'username': 'voter1', 'password': '123'}
+        response = self.client.post('/authentication/login/', data, format='json')
+        token = response.json()
+
+        user = token_user(token['token'])
+        self.assertEqual(user['username'], 'voter1')
+        self.assertFalse(user['is_staff'])
+        with self.assertNumQueries(0):
+            self.assertEqual(token_user(token['token']), user)
+            self.assertEqual(mods.get_user(token['token']), user)
+        self.assertIsNone(token_user('invented'))
+
+        # saving the user forgets its tokens
+        u = User.objects.get(username='voter1')
+        u.is_staff = True
+        u.save()
+        self.assertTrue(token_user(token['token'])['is_staff'])
+
+        response = self.client.post('/authentication/logout/', token, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(token_user(token['token']))
+        self.assertEqual(mods.get_user(token['token']), {})
+
+    def test_token_cache(self):
+        self.check_token_cache()
+
+    @override_settings(TOKEN_CACHE='default')
+    def test_token_cache_shared(self):
+        self.check_token_cache()
+
+        # the users aren't kept in this process, the logout in another one
+        # is seen at once
+        data = {'username': 'voter1', 'password': '123'}
+        token = self.client.post('/authentication/login/', data, format='json').json()
+        self.assertEqual(token_user(token['token'])['username'], 'voter1')
+        self.assertNotIn(token['token'], cache._users)
+        caches['default'].delete(cache.cache_key(token['token']))
+        Token.objects.filter(key=token['token']).update(user=User.objects.get(username='admin'))
+        self.assertEqual(token_user(token['token'])['username'], 'admin')
+
     def test_register_bad_permissions(self):
         data = {'username': 'voter1', 'password': '123'}
         response = self.client.post('/authentication/login/', data, format='json')
@@ -8,17 +8,19 @@ from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import User
 from django.db import IntegrityError
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.core.exceptions import ObjectDoesNotExist
 
-from .serializers import UserSerializer
+from .cache import token_user
 
 
 class GetUserView(APIView):
     def post(self, request):
-        key = request.data.get('token', '')
-        tk = get_object_or_404(Token, key=key)
-        return Response(UserSerializer(tk.user, many=False).data)
+        user = token_user(request.data.get('token', ''))
+        if user is None:
+            raise Http404
+        return Response(user)
 
 
 class LogoutView(APIView):
@@ -26,6 +28,7 @@ class LogoutView(APIView):
         key = request.data.get('token', '')
         try:
             tk = Token.objects.get(key=key)
+            # the token is forgotten by the cache when it's deleted
             tk.delete()
         except ObjectDoesNotExist:
             pass
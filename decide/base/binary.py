@@ -0,0 +1,156 @@
+'''
+Compact binary format for lists of ciphertexts
+
+JSON sends each big integer as decimal text, that's more than twice the
+size of the number and slow to parse. In this format the numbers are
+fixed width big-endian bytes, at least KEYBITS bits each:
+
+    b'DCB1' | header length (4 bytes) | header (json) | numbers
+
+The header has the other fields of the message, the width of each number,
+the number of msgs and the arity, 1 for ints and 2 for (a, b) pairs.
+
+>>> loads(dumps([[1, 2], [3, 4]], bits=16))
+[[1, 2], [3, 4]]
+>>> loads(dumps({'msgs': [5, 6], 'pk': None}, bits=16))
+{'pk': None, 'msgs': [5, 6]}
+'''
+
+import json
+import struct
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+
+
+MEDIA_TYPE = 'application/x-decide-binary'
+MAGIC = b'DCB1'
+
+
+def is_number(n):
+    return isinstance(n, int) and not isinstance(n, bool) and n >= 0
+
+
+def arity(msgs):
+    '''
+    1 for a list of ints, 2 for a list of pairs of ints, None if the msgs
+    can't be sent as numbers
+    '''
+    if all(is_number(m) for m in msgs):
+        return 1
+    if all(isinstance(m, (list, tuple)) and len(m) == 2 and
+           is_number(m[0]) and is_number(m[1]) for m in msgs):
+        return 2
+    return None
+
+
+def pack(header, body=b''):
+    header = json.dumps(header).encode('utf-8')
+    return b''.join((MAGIC, struct.pack('>I', len(header)), header, body))
+
+
+def unpack(content):
+    '''
+    The header and a view of the numbers of a message, raises ValueError
+    if the content isn't valid
+    '''
+    if content[:4] != MAGIC or len(content) < 8:
+        raise ValueError('Not a decide binary message')
+
+    size = struct.unpack('>I', content[4:8])[0]
+    header = json.loads(bytes(content[8:8 + size]).decode('utf-8'))
+    if not isinstance(header, dict) or 'fields' not in header:
+        raise ValueError('Wrong header')
+    if not isinstance(header['fields'], (dict, type(None))):
+        raise ValueError('Wrong fields')
+
+    body = memoryview(content)[8 + size:]
+    if 'count' in header:
+        w, k, n = header.get('width', None), header.get('arity', None), header['count']
+        if not (is_number(w) and w > 0 and k in (1, 2) and is_number(n)):
+            raise ValueError('Wrong width, arity or count')
+        if len(body) != w * k * n:
+            raise ValueError('Wrong size for {} msgs'.format(n))
+    return header, body
+
+
+def dumps(data, bits=None):
+    '''
+    Encodes a list of msgs or a dict with a "msgs" list. The msgs can be
+    already packed, an object with width, arity, len and tobytes, like
+    mixnet.batch.CiphertextBatch.
+    '''
+    fields = None
+    msgs = data
+    if isinstance(data, dict):
+        fields = {k: v for k, v in data.items() if k != 'msgs'}
+        msgs = data.get('msgs', None)
+    elif hasattr(data, 'tobytes'):
+        msgs = data
+
+    header = {'fields': fields}
+    body = b''
+    if hasattr(msgs, 'tobytes'):
+        body = msgs.tobytes()
+        header.update(width=msgs.width, arity=msgs.arity, count=len(msgs))
+    elif msgs is not None:
+        k = arity(msgs)
+        if k is None:
+            header['raw'] = msgs
+        else:
+            values = msgs if k == 1 else [v for m in msgs for v in m]
+            width = ((bits or settings.KEYBITS) + 7) // 8
+            width = max([width] + [(v.bit_length() + 7) // 8 for v in values])
+            body = b''.join(v.to_bytes(width, 'big') for v in values)
+            header.update(width=width, arity=k, count=len(msgs))
+
+    return pack(header, body)
+
+
+def loads(content):
+    '''
+    Decodes the result of dumps, raises ValueError if the content isn't
+    valid
+    '''
+    header, body = unpack(content)
+
+    msgs = header.get('raw', None)
+    if 'count' in header:
+        w, k = header['width'], header['arity']
+        values = [int.from_bytes(body[i:i + w], 'big') for i in range(0, len(body), w)]
+        msgs = values if k == 1 else [values[i:i + k] for i in range(0, len(values), k)]
+
+    return with_msgs(header, msgs)
+
+
+def with_msgs(header, msgs):
+    fields = header['fields']
+    if fields is None:
+        return msgs
+    if msgs is not None:
+        fields['msgs'] = msgs
+    return fields
+
+
+class BinaryParser(BaseParser):
+    media_type = MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return loads(stream.read())
+        except ValueError as exc:
+            raise ParseError('Binary parse error - %s' % str(exc))
+
+
+class BinaryRenderer(BaseRenderer):
+    media_type = MEDIA_TYPE
+    format = 'bin'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return dumps(data)
@@ -1,6 +1,27 @@
+import functools
+import json
+import logging
+import threading
 import urllib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.db import close_old_connections
+from django.http import Http404, HttpResponseNotFound, HttpResponseServerError
+from django.test.client import RequestFactory
+from django.urls import Resolver404, resolve
+from requests.adapters import HTTPAdapter
+from rest_framework.utils.encoders import JSONEncoder
+from urllib3.util.retry import Retry
+
+from . import binary
+
+
+# the errors of the local calls are logged like the errors of the requests
+request_logger = logging.getLogger('django.request')
 
 
 def query(modname, entry_point='/', method='get', baseurl=None, **kwargs):
@@ -21,6 +42,15 @@ def query(modname, entry_point='/', method='get', baseurl=None, **kwargs):
     you can complete the query with GET params using the **params** keyword
     and with json data, using the **json** keyword.
 
+    With **binary=True** the data is sent and received in the binary format
+    of base.binary if the other module supports it, and as json if not.
+
+    Modules served by this deployment, the ones with the url BASEURL, are
+    called in this process without http if settings.LOCAL_DISPATCH, see
+    dispatch. The others are called with the pooled session of their url,
+    see session, with the MODS_*_TIMEOUT timeouts or the **timeout** param
+    (seconds or a (connect, read) tuple).
+
     Examples
 
     >>> r = query('voting', params={'id': 1})
@@ -35,7 +65,11 @@ def query(modname, entry_point='/', method='get', baseurl=None, **kwargs):
     else:
         mod = baseurl
 
-    q = getattr(requests, method)
+    if is_local(mod):
+        q = functools.partial(dispatch, method)
+    else:
+        timeout = kwargs.get('timeout', (settings.MODS_CONNECT_TIMEOUT, settings.MODS_READ_TIMEOUT))
+        q = functools.partial(getattr(session(mod), method), timeout=timeout)
     url = '{}/{}{}'.format(mod, modname, entry_point)
 
     headers = {}
@@ -46,16 +80,158 @@ def query(modname, entry_point='/', method='get', baseurl=None, **kwargs):
     if params:
         url += '?{}'.format(urllib.parse.urlencode(params))
 
-    if method == 'get':
-        response = q(url, headers=headers)
-    else:
-        json_data = kwargs.get('json', {})
-        response = q(url, json=json_data, headers=headers)
+    use_binary = kwargs.get('binary', False)
+    if use_binary:
+        headers['Accept'] = '{}, application/json;q=0.9'.format(binary.MEDIA_TYPE)
+
+    try:
+        if method == 'get':
+            response = q(url, headers=headers)
+        else:
+            json_data = kwargs.get('json', {})
+            if use_binary:
+                h = dict(headers, **{'Content-Type': binary.MEDIA_TYPE})
+                response = q(url, data=binary.dumps(json_data), headers=h)
+            if not use_binary or response.status_code == 415:
+                # the encoder of rest_framework also sends batches of msgs
+                h = dict(headers, **{'Content-Type': 'application/json'})
+                response = q(url, data=json.dumps(json_data, cls=JSONEncoder), headers=h)
+    except requests.RequestException:
+        with _sessions_lock:
+            _errors[mod] += 1
+        raise
 
     if kwargs.get('response', False):
         return response
     else:
-        return response.json()
+        return content(response)
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_errors = Counter()
+
+
+def session(baseurl):
+    '''
+    Session of the modules of baseurl, shared by all the threads. It keeps
+    up to MODS_POOL_SIZE connections alive, and retries the GETs that fail
+    to connect or get a 502, 503 or 504 up to MODS_RETRIES times, waiting
+    MODS_BACKOFF, 2 * MODS_BACKOFF, ... seconds. The POSTs are only retried
+    if the connection failed, so they're never sent twice.
+    '''
+
+    with _sessions_lock:
+        s = _sessions.get(baseurl, None)
+        if s is None:
+            retry = Retry(total=settings.MODS_RETRIES, backoff_factor=settings.MODS_BACKOFF,
+                          allowed_methods=frozenset(['GET']),
+                          status_forcelist=(502, 503, 504), raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.MODS_POOL_SIZE,
+                                  max_retries=retry)
+            s = requests.Session()
+            s.mount('http://', adapter)
+            s.mount('https://', adapter)
+            _sessions[baseurl] = s
+        return s
+
+
+def pool_stats():
+    '''
+    Connections of each session, { baseurl: { "connections": int,
+    "idle": int, "requests": int, "errors": int } }, connections opened
+    since the start, idle ones kept alive, requests sent through them and
+    calls that failed after the retries.
+    '''
+
+    with _sessions_lock:
+        sessions = list(_sessions.items())
+
+    stats = {}
+    for baseurl, s in sessions:
+        st = {"connections": 0, "idle": 0, "requests": 0, "errors": _errors[baseurl]}
+        manager = s.get_adapter(baseurl).poolmanager
+        for key in manager.pools.keys():
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            st["connections"] += pool.num_connections
+            st["requests"] += pool.num_requests
+            # the free slots of the pool are None
+            st["idle"] += sum(1 for c in list(pool.pool.queue) if c) if pool.pool else 0
+        stats[baseurl] = st
+    return stats
+
+
+def is_local(baseurl):
+    '''
+    True if the modules of baseurl are the ones of this process
+    '''
+    return settings.LOCAL_DISPATCH and baseurl.rstrip('/') == settings.BASEURL.rstrip('/')
+
+
+class LocalResponse:
+    '''
+    Response of a view called with dispatch, with the attributes of
+    requests.Response used by the modules
+    '''
+
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.content = response.content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def dispatch(method, url, data=b'', headers=None):
+    '''
+    Calls the view of url in this process, like requests.get or
+    requests.post would do through http. Only the view runs, not the
+    middlewares. An exception of the view is a 500 response, as in http.
+    '''
+
+    headers = dict(headers or {})
+    base = urllib.parse.urlsplit(settings.BASEURL)
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path[len(base.path.rstrip('/')):]
+    if parts.query:
+        path += '?' + parts.query
+    content_type = headers.pop('Content-Type', 'application/octet-stream')
+    meta = {'HTTP_' + k.upper().replace('-', '_'): v for k, v in headers.items()}
+
+    factory = RequestFactory(SERVER_NAME=base.hostname or 'localhost',
+                             SERVER_PORT=str(base.port or (443 if base.scheme == 'https' else 80)))
+    request = factory.generic(method.upper(), path, data=data or b'', content_type=content_type,
+                              secure=base.scheme == 'https', **meta)
+    try:
+        match = resolve(request.path_info)
+        request.resolver_match = match
+        response = match.func(request, *match.args, **match.kwargs)
+        if callable(getattr(response, 'render', None)):
+            response = response.render()
+    except (Http404, Resolver404):
+        response = HttpResponseNotFound()
+    except Exception:
+        # through http the caller gets a 500, not the exception of the view
+        request_logger.exception('Internal Server Error: %s', request.path)
+        response = HttpResponseServerError()
+
+    return LocalResponse(response)
+
+
+def content(response):
+    '''
+    The data of the response, in json or in the binary format
+    '''
+    if response.headers.get('Content-Type', '').startswith(binary.MEDIA_TYPE):
+        return binary.loads(response.content)
+    return response.json()
 
 
 def get(*args, **kwargs):
@@ -66,6 +242,109 @@ def post(*args, **kwargs):
     return query(*args, method='post', **kwargs)
 
 
+_executor = None
+
+
+def executor():
+    global _executor
+    with _sessions_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.MODS_ASYNC_THREADS,
+                                           thread_name_prefix='mods')
+        return _executor
+
+
+async def aquery(*args, **kwargs):
+    '''
+    query for async views, the same params and result. Each call runs in
+    one of MODS_ASYNC_THREADS threads with the pooled sessions, so the
+    calls awaited together, with asyncio.gather, are sent at the same
+    time. With MODS_ASYNC_THREADS = 0 they run one by one in the thread of
+    the sync code, like the sync views.
+    '''
+
+    call = lambda: query(*args, **kwargs)
+    if not settings.MODS_ASYNC_THREADS:
+        return await sync_to_async(call)()
+    return await sync_to_async(worker_call, thread_sensitive=False, executor=executor())(call)
+
+
+def worker_call(call):
+    '''
+    Runs call in a thread of the executor. The local calls use the db, so
+    the connections of the thread are handled like in a request, closed
+    when they're too old (CONN_MAX_AGE) and not left open by the thread.
+    '''
+    close_old_connections()
+    try:
+        return call()
+    finally:
+        close_old_connections()
+
+
+async def aget(*args, **kwargs):
+    return await aquery(*args, method='get', **kwargs)
+
+
+async def apost(*args, **kwargs):
+    return await aquery(*args, method='post', **kwargs)
+
+
+def get_user(token):
+    '''
+    User of the token, { "id", "username", "is_staff", ... } as returned
+    by authentication/getuser, without a request if the authentication
+    module is local, see authentication.cache
+    '''
+    if is_local(settings.APIS.get('authentication', settings.BASEURL)):
+        from authentication.cache import token_user
+        return token_user(token) or {}
+    return post('authentication', entry_point='/getuser/', json={'token': token})
+
+
+async def aget_user(token):
+    if is_local(settings.APIS.get('authentication', settings.BASEURL)):
+        return await sync_to_async(get_user)(token)
+    return await apost('authentication', entry_point='/getuser/', json={'token': token})
+
+
+def post_chunks(modname, entry_point, msgs, transfer, offset=0, fields=None, **kwargs):
+    '''
+    Sends the list msgs in chunks of settings.CHUNK_SIZE items, each one
+    posted as { "transfer": transfer, "offset": int, "msgs": [...] } so
+    the receiver can store them in order. fields are added to each chunk.
+    Raises requests.HTTPError if a chunk isn't stored.
+    '''
+
+    size = settings.CHUNK_SIZE
+    for i in range(0, len(msgs), size):
+        data = dict(fields or {}, transfer=transfer, offset=offset + i, msgs=msgs[i:i + size])
+        response = post(modname, entry_point=entry_point, json=data, binary=True,
+                        response=True, **kwargs)
+        if response.status_code != 200:
+            raise requests.HTTPError('Chunk {} of {} not stored: {}'.format(
+                offset + i, transfer, response.status_code), response=response)
+
+
+def get_chunks(modname, entry_point, transfer, total, **kwargs):
+    '''
+    Gets a list sent in chunks, yielding one chunk of at most
+    settings.CHUNK_SIZE items at a time. Raises requests.HTTPError if a
+    chunk can't be read or it's incomplete.
+    '''
+
+    size = settings.CHUNK_SIZE
+    for offset in range(0, total, size):
+        params = {"transfer": transfer, "offset": offset, "limit": size}
+        response = get(modname, entry_point=entry_point, params=params, binary=True,
+                       response=True, **kwargs)
+        chunk = content(response) if response.status_code == 200 else None
+        if not isinstance(chunk, list) or len(chunk) != min(size, total - offset):
+            raise requests.HTTPError('Chunk {} of {} not read: {}'.format(
+                offset, transfer, response.status_code), response=response)
+        yield chunk
+
+
 def mock_query(client):
     '''
     Function to build a mock to override the query function in this module.
@@ -81,16 +360,25 @@ def mock_query(client):
 
         q = getattr(client, method)
 
+        headers = {}
+        use_binary = kwargs.get('binary', False)
+        if use_binary:
+            headers['HTTP_ACCEPT'] = '{}, application/json;q=0.9'.format(binary.MEDIA_TYPE)
+
         if method == 'get':
-            response = q(url, format='json')
+            response = q(url, format='json', **headers)
         else:
             json_data = kwargs.get('json', {})
-            response = q(url, data=json_data, format='json')
+            if use_binary:
+                response = q(url, data=binary.dumps(json_data),
+                             content_type=binary.MEDIA_TYPE, **headers)
+            if not use_binary or response.status_code == 415:
+                response = q(url, data=json_data, format='json', **headers)
 
         if kwargs.get('response', False):
             return response
         else:
-            return response.json()
+            return content(response)
 
     global query
     query = test_query
@@ -8,6 +8,4 @@ class UserIsStaff(permissions.BasePermission):
     def has_permission(self, request, view):
         if not request.auth:
             return False
-        response = mods.post('authentication/getuser', json={'token': request.auth.key},
-                response=True)
-        return response.json().get('is_staff', False)
+        return mods.get_user(request.auth.key).get('is_staff', False)
@@ -1,7 +1,17 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from unittest import mock
 from rest_framework.test import APIClient
 from rest_framework.test import APITestCase
 
+from base import binary
 from base import mods
 
 
@@ -34,3 +44,192 @@ class BaseTestCase(APITestCase):
 
     def logout(self):
         self.client.credentials()
+
+    def test_pool_stats(self):
+        response = self.client.get('/base/pool/', format='json')
+        self.assertEqual(response.status_code, 401)
+
+        self.login(user='noadmin')
+        response = self.client.get('/base/pool/', format='json')
+        self.assertEqual(response.status_code, 403)
+
+        self.login()
+        response = self.client.get('/base/pool/', format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), mods.pool_stats())
+
+
+class BinaryTestCase(TestCase):
+
+    def test_dumps_loads(self):
+        big = 2 ** 300 + 1
+        for data in [[], [1, 2, big], [[1, 2], [big, 3]],
+                     {"msgs": [[1, 2]], "pk": {"p": 23}, "shuffled": True},
+                     {"detail": "Not found."}, {"msgs": ["a", None]}]:
+            self.assertEqual(binary.loads(binary.dumps(data)), data)
+
+        # fixed width numbers of KEYBITS bits, instead of decimal text
+        msgs = [[2 ** 255 + i, 2 ** 255 - i] for i in range(100)]
+        self.assertLess(len(binary.dumps(msgs)), 100 * 64 + 100)
+
+        with self.assertRaises(ValueError):
+            binary.loads(b'[1, 2]')
+        with self.assertRaises(ValueError):
+            binary.loads(binary.dumps([1, 2])[:-1])
+
+    def test_corrupted(self):
+        body = (1).to_bytes(4, 'big') * 2
+        for header in [[1, 2], {'width': 4, 'arity': 1, 'count': 2},
+                       {'fields': 'x'}, {'fields': None, 'width': 0, 'arity': 1, 'count': 0},
+                       {'fields': None, 'width': 4, 'arity': 3, 'count': 0},
+                       {'fields': None, 'width': '4', 'arity': 1, 'count': 2},
+                       {'fields': None, 'arity': 1, 'count': 2}]:
+            content = binary.pack(header, body if header != [1, 2] else b'')
+            with self.assertRaises(ValueError):
+                binary.loads(content)
+            with self.assertRaises(ValueError):
+                binary.unpack(content)
+
+        content = binary.MAGIC + (3).to_bytes(4, 'big') + b'\xff{}'
+        with self.assertRaises(ValueError):
+            binary.loads(content)
+
+    def test_corrupted_request(self):
+        for header in [{'fields': None, 'width': 0, 'arity': 2, 'count': 0}, {'width': 4}]:
+            content = binary.pack(header)
+            for path in ['/mixnet/shuffle/1/', '/mixnet/chunk/1/']:
+                response = self.client.post(path, content, content_type=binary.MEDIA_TYPE)
+                self.assertEqual(response.status_code, 400)
+
+
+@override_settings(BASEURL='http://decide.test:8000', LOCAL_DISPATCH=True)
+class LocalDispatchTestCase(TestCase):
+
+    def setUp(self):
+        user = User(username='admin', is_staff=True)
+        user.set_password('qwerty')
+        user.save()
+
+    def post(self, path, data, **headers):
+        headers['Content-Type'] = 'application/json'
+        return mods.dispatch('post', settings.BASEURL + path, data=json.dumps(data),
+                             headers=headers)
+
+    def test_is_local(self):
+        self.assertTrue(mods.is_local('http://decide.test:8000/'))
+        self.assertFalse(mods.is_local('http://10.5.0.1:8000'))
+        with self.settings(LOCAL_DISPATCH=False):
+            self.assertFalse(mods.is_local('http://decide.test:8000'))
+
+    def test_dispatch(self):
+        response = self.post('/authentication/login/', {'username': 'admin', 'password': 'qwerty'})
+        self.assertEqual(response.status_code, 200)
+        token = response.json().get('token')
+        self.assertTrue(token)
+
+        response = self.post('/authentication/getuser/', {'token': token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mods.content(response)['username'], 'admin')
+
+        response = self.post('/authentication/login/', {'username': 'admin', 'password': 'bad'})
+        self.assertEqual(response.status_code, 400)
+
+        # the query params and the headers reach the view
+        response = mods.dispatch('get', settings.BASEURL + '/voting/?id=1',
+                                 headers={'Authorization': 'Token ' + token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+
+        response = mods.dispatch('get', settings.BASEURL + '/nomodule/')
+        self.assertEqual(response.status_code, 404)
+
+        # an error of the view is a 500, as through http
+        with mock.patch('authentication.views.GetUserView.post', side_effect=ValueError), \
+                self.assertLogs('django.request', 'ERROR'):
+            response = self.post('/authentication/getuser/', {'token': token})
+        self.assertEqual(response.status_code, 500)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    failures = 0
+
+    def do_GET(self):
+        code = 200
+        if self.path == '/flaky/' and Handler.failures:
+            Handler.failures -= 1
+            code = 503
+        body = json.dumps({'path': self.path}).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(MODS_POOL_SIZE=2, MODS_RETRIES=2, MODS_BACKOFF=0)
+class PoolTestCase(TestCase):
+
+    def setUp(self):
+        mods._sessions.clear()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        mods._sessions.clear()
+
+    def test_session(self):
+        s = mods.session(self.url)
+        self.assertIs(mods.session(self.url + ''), s)
+        for i in range(3):
+            r = s.get(self.url + '/voting/', timeout=5)
+            self.assertEqual(r.json(), {'path': '/voting/'})
+
+        # one connection kept alive for all the requests
+        stats = mods.pool_stats()[self.url]
+        self.assertEqual(stats, {'connections': 1, 'idle': 1, 'requests': 3, 'errors': 0})
+
+        Handler.failures = 2
+        r = s.get(self.url + '/flaky/', timeout=5)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(mods.pool_stats()[self.url]['requests'], 6)
+
+        Handler.failures = 3
+        r = s.get(self.url + '/flaky/', timeout=5)
+        self.assertEqual(r.status_code, 503)
+        Handler.failures = 0
+
+
+class AsyncQueryTestCase(TestCase):
+
+    def test_aquery(self):
+        def slow_query(modname, entry_point='/', method='get', **kwargs):
+            time.sleep(0.2)
+            return [modname, entry_point, method]
+
+        async def lookups():
+            return await asyncio.gather(
+                mods.aget('voting', params={'id': 1}),
+                mods.apost('authentication', entry_point='/getuser/', json={}),
+                mods.aget('census/1'),
+            )
+
+        with mock.patch.object(mods, 'query', slow_query):
+            start = time.monotonic()
+            results = asyncio.run(lookups())
+            # at the same time, not one after the other
+            self.assertLess(time.monotonic() - start, 0.5)
+            self.assertEqual(results, [['voting', '/', 'get'],
+                                       ['authentication', '/getuser/', 'post'],
+                                       ['census/1', '/', 'get']])
+
+            with self.settings(MODS_ASYNC_THREADS=0):
+                start = time.monotonic()
+                self.assertEqual(asyncio.run(lookups()), results)
+                self.assertGreaterEqual(time.monotonic() - start, 0.6)
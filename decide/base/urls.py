@@ -1 +1,8 @@
-urlpatterns = []
+from django.urls import path
+
+from .views import PoolStatsView
+
+
+urlpatterns = [
+    path('pool/', PoolStatsView.as_view(), name='pool'),
+]
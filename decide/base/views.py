@@ -1,3 +1,15 @@
-from django.shortcuts import render
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
-# Create your views here.
+from . import mods
+from .perms import UserIsStaff
+
+
+class PoolStatsView(APIView):
+    permission_classes = (UserIsStaff,)
+
+    def get(self, request):
+        '''
+        Connections of the http calls to other modules, see mods.pool_stats
+        '''
+        return Response(mods.pool_stats())
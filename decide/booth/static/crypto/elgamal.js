@@ -26,3 +26,64 @@ ElGamal.encrypt = function(pk, m, r) {
 
   return { alpha: alpha, beta: beta };
 };
+
+// proofs of the ballots of the homomorphic votings, the same as
+// mixnet/proofs.py: a disjunctive Chaum-Pedersen proof that each option
+// is g^0 or g^1 and a Chaum-Pedersen proof that their product is g^1
+ElGamal.CHALLENGE = BigInt.fromInt(2).pow(256);
+
+ElGamal.challenge = function(values) {
+  var text = values.map(v => v.toString()).join(',');
+  return new BigInt(sjcl.codec.hex.fromBits(sjcl.hash.sha256.hash(text)), 16);
+};
+
+ElGamal.proveBit = function(pk, cipher, m, r) {
+  var p = pk.p, n = p.subtract(BigInt.ONE);
+  var a = cipher.alpha, b = cipher.beta;
+  var bs = [b, b.multiply(pk.g.modInverse(p)).mod(p)];
+  var c = [], s = [], A = [], B = [];
+
+  // the other branch is simulated with its challenge chosen first
+  var j = 1 - m;
+  c[j] = ElGamal.getRandomInteger(ElGamal.CHALLENGE);
+  s[j] = ElGamal.getRandomInteger(n);
+  A[j] = pk.g.modPow(s[j], p).multiply(a.modInverse(p).modPow(c[j], p)).mod(p);
+  B[j] = pk.y.modPow(s[j], p).multiply(bs[j].modInverse(p).modPow(c[j], p)).mod(p);
+
+  var w = ElGamal.getRandomInteger(n);
+  A[m] = pk.g.modPow(w, p);
+  B[m] = pk.y.modPow(w, p);
+  var h = ElGamal.challenge([p, pk.g, pk.y, a, b, A[0], B[0], A[1], B[1]]);
+  c[m] = h.subtract(c[j]).mod(ElGamal.CHALLENGE);
+  s[m] = w.add(c[m].multiply(r)).mod(n);
+  return [c[0], c[1], s[0], s[1]].map(v => v.toString());
+};
+
+ElGamal.proveSum = function(pk, ciphers, rs) {
+  var p = pk.p, n = p.subtract(BigInt.ONE);
+  var a = BigInt.ONE, b = BigInt.ONE, r = BigInt.ZERO;
+  ciphers.forEach((cipher, i) => {
+    a = a.multiply(cipher.alpha).mod(p);
+    b = b.multiply(cipher.beta).mod(p);
+    r = r.add(rs[i]);
+  });
+  var w = ElGamal.getRandomInteger(n);
+  var c = ElGamal.challenge([p, pk.g, pk.y, a, b, pk.g.modPow(w, p), pk.y.modPow(w, p)]);
+  return [c, w.add(c.multiply(r)).mod(n)].map(v => v.toString());
+};
+
+// ballot for the option in position choice of n options, as it's sent
+// to the store, { options: [ { a, b, proof } ], proof }
+ElGamal.encryptBallot = function(pk, choice, n) {
+  var options = [], ciphers = [], rs = [];
+  for (var i = 0; i < n; i++) {
+    var m = i == choice ? 1 : 0;
+    var r = ElGamal.getRandomInteger(pk.p.subtract(BigInt.ONE));
+    var cipher = ElGamal.encrypt(pk, m ? pk.g : BigInt.ONE, r);
+    options.push({a: cipher.alpha.toString(), b: cipher.beta.toString(),
+                  proof: ElGamal.proveBit(pk, cipher, m, r)});
+    ciphers.push(cipher);
+    rs.push(r);
+  }
+  return {options: options, proof: ElGamal.proveSum(pk, ciphers, rs)};
+};
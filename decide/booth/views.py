@@ -4,6 +4,7 @@ from django.conf import settings
 from django.http import Http404
 
 from base import mods
+from voting.cache import voting_state
 
 
 # TODO: check permissions and census
@@ -14,6 +15,12 @@ class BoothView(TemplateView):
         context = super().get_context_data(**kwargs)
         vid = kwargs.get('voting_id', 0)
 
+        # the votings not started have no key yet, they're rejected without
+        # getting the whole voting
+        state = voting_state(vid)
+        if not state or not state['start_date']:
+            raise Http404
+
         try:
             r = mods.get('voting', params={'id': vid})
             # Casting numbers to string to manage in javascript with BigInt
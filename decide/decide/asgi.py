@@ -0,0 +1,18 @@
+"""
+ASGI config for decide project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+needed to serve the async views, /store/async/ and /gateway/async/, without
+blocking a worker.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "decide.settings")
+
+application = get_asgi_application()
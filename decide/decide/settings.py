@@ -133,6 +133,24 @@ if not DEBUG:
 
 BASEURL = config('BASEURL', default='http://localhost:8000')
 
+# modules with the url BASEURL (in APIS or by default) are called in the
+# same process instead of through http, see base.mods.dispatch
+LOCAL_DISPATCH = True
+
+# http calls to the other modules (base.mods), connections kept alive for
+# each module url, timeouts in seconds and retries of the failed GETs,
+# waiting MODS_BACKOFF, 2 * MODS_BACKOFF, ... seconds. The read timeout
+# should be longer than the whole mixnet chain of a tally.
+MODS_POOL_SIZE = 10
+MODS_CONNECT_TIMEOUT = 5
+MODS_READ_TIMEOUT = 900
+MODS_RETRIES = 3
+MODS_BACKOFF = 0.5
+
+# threads of the async calls to other modules (mods.aget, mods.apost), 0 to
+# make them one by one in the thread of the sync code
+MODS_ASYNC_THREADS = 10
+
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
 
@@ -180,6 +198,68 @@ STATIC_URL = '/static/'
 # number of bits for the key, all auths should use the same number of bits
 KEYBITS = 256
 
+# number of worker processes used by the mixnet to reencrypt and decrypt,
+# 1 to do it in the request process
+MIXNET_WORKERS = 1
+
+# number of pregenerated keys the genkeys command keeps for new mixnets
+MIXNET_KEY_POOL_SIZE = 10
+
+# standard group used for the mixnet keys instead of generating a new safe
+# prime for each voting, one of mixnet.groups.GROUPS of KEYBITS size, for
+# example 'ffdhe2048'. None to generate the group.
+MIXNET_GROUP = None
+
+# use the prime order subgroup of the key with 256 bits exponents, much
+# faster than exponents of KEYBITS bits. Votes should be encoded with
+# MixCrypt(subgroup=True).encrypt, plain votes are decoded as they are.
+MIXNET_SUBGROUP = False
+
+# number of messages per request when big batches are sent in chunks
+# between modules, see mods.post_chunks
+CHUNK_SIZE = 1000
+
+# pipelined shuffle, each auth reencrypts the chunks as they arrive, then
+# permutes all the msgs and sends them to the next one with
+# MIXNET_PIPELINE_SENDERS threads (0 to send them in the request). The
+# shuffle call waits at most MIXNET_PIPELINE_TIMEOUT seconds for the chunks.
+MIXNET_PIPELINE = False
+MIXNET_PIPELINE_SENDERS = 1
+MIXNET_PIPELINE_TIMEOUT = 600
+
+# async mixnet chain, voting starts the key generation, shuffle and decrypt
+# as jobs and polls their status every MIXNET_JOB_POLL seconds, for at most
+# MIXNET_JOB_TIMEOUT seconds. Each auth runs its jobs in MIXNET_JOB_WORKERS
+# threads (0 to run them in the request).
+MIXNET_ASYNC = False
+MIXNET_JOB_WORKERS = 2
+MIXNET_JOB_POLL = 0.5
+MIXNET_JOB_TIMEOUT = 600
+
+# decrypt the tally asking all the auths for their partial decryption at
+# the same time, in MIXNET_FANOUT_THREADS threads (0 to ask them one by
+# one), instead of decrypting along the chain
+MIXNET_PARALLEL_DECRYPT = False
+MIXNET_FANOUT_THREADS = 8
+
+# directory of the discrete log tables used to decode homomorphic tallies,
+# see mixnet.dlog and the gendlog command
+MIXNET_DLOG_DIR = os.path.join(BASE_DIR, 'dlog')
+
+# state of the votings (dates and tally) cached for the votes, see
+# voting.cache. VOTING_STATE_CACHE is an alias of CACHES shared by all the
+# processes, None to keep only the closed ones in each process.
+VOTING_STATE_CACHE = None
+VOTING_STATE_TTL = 60
+
+# users of the tokens cached for the views that check the user of each
+# request, see authentication.cache. TOKEN_CACHE is an alias of CACHES shared
+# by all the processes, None to keep them only in each process: then a logout
+# or a change of the user is seen by the other processes after TOKEN_CACHE_TTL.
+TOKEN_CACHE = None
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 60
+
 # Versioning
 ALLOWED_VERSIONS = ['v1', 'v2']
 DEFAULT_VERSION = 'v1'
@@ -3,5 +3,6 @@ from . import views
 
 
 urlpatterns = [
+    path('async/<str:submodule><path:route>', views.AsyncGateway.as_view(), name='gateway_async'),
     path('<str:submodule><path:route>', views.Gateway.as_view(), name='gateway'),
 ]
@@ -1,3 +1,9 @@
+import json
+
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from base import mods
@@ -16,3 +22,26 @@ class Gateway(APIView):
 
         resp = mods.query(submodule, route, method='post', response=True, **kwargs)
         return Response(resp.json(), status=resp.status_code)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncGateway(View):
+    '''
+    Gateway for ASGI, the worker isn't blocked while the module answers
+    '''
+
+    async def get(self, request, submodule, route):
+        kwargs = {'HTTP_AUTHORIZATION': request.META.get('HTTP_AUTHORIZATION', '')}
+        kwargs['params'] = {k: v for k, v in request.GET.items()}
+        resp = await mods.aquery(submodule, route, method='get', response=True, **kwargs)
+        return JsonResponse(resp.json(), status=resp.status_code, safe=False)
+
+    async def post(self, request, submodule, route):
+        kwargs = {'HTTP_AUTHORIZATION': request.META.get('HTTP_AUTHORIZATION', '')}
+        try:
+            kwargs['json'] = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({}, status=400)
+
+        resp = await mods.aquery(submodule, route, method='post', response=True, **kwargs)
+        return JsonResponse(resp.json(), status=resp.status_code, safe=False)
@@ -1,6 +1,20 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 
 
 class MixnetConfig(AppConfig):
     default_auto_field = 'django.db.models.AutoField'
     name = 'mixnet'
+
+    def ready(self):
+        from .groups import check_group
+
+        # keys of another size than KEYBITS would break the other auths
+        if settings.MIXNET_GROUP:
+            try:
+                check_group(settings.MIXNET_GROUP, settings.KEYBITS)
+            except KeyError:
+                raise ImproperlyConfigured('Unknown MIXNET_GROUP {}'.format(settings.MIXNET_GROUP))
+            except ValueError as e:
+                raise ImproperlyConfigured('MIXNET_GROUP doesn\'t match KEYBITS, {}'.format(e))
@@ -0,0 +1,127 @@
+'''
+Ciphers (a, b) stored in one buffer of fixed width big-endian numbers,
+the same layout as the body of the binary format (see base.binary), so
+a batch received in that format is used without building the numbers.
+
+A million ciphers of 2048 bits take 512MB in one buffer, a slice is a
+view of the same buffer and a permutation copies the bytes once. The
+numbers are built only when a cipher is read.
+
+>>> batch = CiphertextBatch.from_list([[1, 2], [3, 4], [5, 6]], width=2)
+>>> len(batch), batch[1]
+(3, (3, 4))
+>>> batch[1:].tolist()
+[[3, 4], [5, 6]]
+>>> batch.permute([2, 0, 1]).tolist()
+[[5, 6], [1, 2], [3, 4]]
+>>> CiphertextBatch.from_wire(batch.to_wire({'pk': None}))[0].tolist()
+[[1, 2], [3, 4], [5, 6]]
+'''
+
+from base import binary
+
+
+class CiphertextBatch:
+    arity = 2
+
+    def __init__(self, buf, width):
+        self.buf = memoryview(buf).cast('B')
+        self.width = width
+        self.size = 2 * width
+        if len(self.buf) % self.size:
+            raise ValueError('The buffer should have ciphers of {} bytes'.format(self.size))
+
+    @classmethod
+    def from_list(cls, msgs, width=0):
+        '''
+        Batch of a list of ciphers, with numbers of at least width bytes
+        '''
+        width = max([width] + [(int(v).bit_length() + 7) // 8 for m in msgs for v in m])
+        body = b''.join(int(v).to_bytes(width, 'big') for m in msgs for v in m)
+        return cls(body, max(width, 1))
+
+    @classmethod
+    def from_wire(cls, content):
+        '''
+        Batch of the msgs of a message in the binary format and the other
+        fields, the batch is a view of content
+        '''
+        header, body = binary.unpack(content)
+        if header.get('arity', None) != cls.arity:
+            raise ValueError('The msgs should be pairs of numbers')
+        return cls(body, header['width']), header['fields']
+
+    def to_wire(self, fields=None):
+        header = {'fields': fields, 'width': self.width, 'arity': self.arity, 'count': len(self)}
+        return binary.pack(header, self.tobytes())
+
+    def with_ciphers(self, msgs):
+        '''
+        New batch with the msgs, the same width as this one
+        '''
+        return CiphertextBatch.from_list(msgs, self.width)
+
+    def cipher(self, offset):
+        w, buf = self.width, self.buf
+        return (int.from_bytes(buf[offset:offset + w], 'big'),
+                int.from_bytes(buf[offset + w:offset + 2 * w], 'big'))
+
+    def __len__(self):
+        return len(self.buf) // self.size
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                return self.permute(range(start, stop, step))
+            return CiphertextBatch(self.buf[start * self.size:max(start, stop) * self.size],
+                                   self.width)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('CiphertextBatch index out of range')
+        return self.cipher(i * self.size)
+
+    def __iter__(self):
+        for offset in range(0, len(self.buf), self.size):
+            yield self.cipher(offset)
+
+    def __eq__(self, other):
+        if isinstance(other, CiphertextBatch):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __reduce__(self):
+        # only the bytes of this view are sent to the worker processes
+        return (CiphertextBatch, (self.tobytes(), self.width))
+
+    def permute(self, perm):
+        '''
+        New batch with the ciphers in the order of perm
+        '''
+        buf, s = self.buf, self.size
+        return CiphertextBatch(b''.join(buf[i * s:(i + 1) * s] for i in perm), self.width)
+
+    def tobytes(self):
+        return self.buf.tobytes()
+
+    def tolist(self):
+        return [list(c) for c in self]
+
+
+class BatchParser(binary.BinaryParser):
+    '''
+    Binary parser that gives the msgs as a CiphertextBatch, if they're
+    pairs of numbers
+    '''
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        content = stream.read()
+        try:
+            header, body = binary.unpack(content)
+        except ValueError as exc:
+            raise binary.ParseError('Binary parse error - %s' % str(exc))
+
+        if header.get('arity', None) != CiphertextBatch.arity:
+            return binary.loads(content)
+        return binary.with_msgs(header, CiphertextBatch(body, header['width']))
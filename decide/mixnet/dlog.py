@@ -0,0 +1,204 @@
+'''
+Discrete logs of small exponents, to decode the result of a homomorphic
+tally, g^votes, with baby-step giant-step.
+
+A table has the baby steps g^j for j < m, so any exponent < m * n is found
+with at most n giant steps. The tables only depend on the group (p, g) and
+the bound, so they're stored in MIXNET_DLOG_DIR and reused by every voting
+with the same group. As they're built once, they're bigger than the usual
+m = sqrt(bound), to take at most GIANT_STEPS giant steps. The file is:
+
+    b'DLG1' | padding (4 bytes) | m (8 bytes) | sha256 of (p, g) (32 bytes)
+    | low 64 bits of each g^j, sorted (8 bytes each) | j of each one (4 bytes each)
+
+in the byte order of the machine, and it's mapped in memory when loaded.
+
+>>> t = DlogTable.build(23, 3, 4)
+>>> t.dlog(pow(3, 9, 23), 10)
+9
+>>> t.dlog(5, 5) is None
+True
+'''
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from math import isqrt
+
+from django.conf import settings
+
+from . import mixcrypt
+
+
+MAGIC = b'DLG1'
+HEADER = struct.Struct('=4s4xQ32s')
+MASK = (1 << 64) - 1
+GIANT_STEPS = 256
+
+
+def group_digest(p, g):
+    return hashlib.sha256('{}:{}'.format(int(p), int(g)).encode('ascii')).digest()
+
+
+def table_size(bound):
+    '''
+    Number of baby steps for exponents up to bound
+
+    >>> table_size(1000), table_size(10 ** 7)
+    (32, 39063)
+    '''
+    return max(isqrt(max(bound, 1)) + 1, -(-(bound + 1) // GIANT_STEPS))
+
+
+class DlogTable:
+    def __init__(self, p, g, m, keys, steps, buf=None):
+        self.p, self.g, self.m = int(p), int(g), m
+        self.keys, self.steps = keys, steps
+        # the mmap of a loaded table, keys and steps are views of it
+        self.buf = buf
+        backend = mixcrypt.backend
+        self.giant = backend.invert(backend.powmod(backend.num(g), m, self.p), self.p)
+
+    @classmethod
+    def build(cls, p, g, m):
+        backend = mixcrypt.backend
+        p = int(p)
+        x, gn = backend.num(1), backend.num(g)
+        pairs = []
+        for j in range(m):
+            pairs.append((int(x) & MASK, j))
+            x = backend.mulmod(x, gn, p)
+        pairs.sort()
+        keys = array('Q', (k for k, _ in pairs))
+        steps = array('I', (j for _, j in pairs))
+        return cls(p, g, m, keys, steps)
+
+    def save(self, path):
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, self.m, group_digest(self.p, self.g)))
+            f.write(self.keys.tobytes())
+            f.write(self.steps.tobytes())
+        # another process may be saving the same table
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, p, g):
+        '''
+        Maps the table in path, raises ValueError if it isn't a table of
+        the group (p, g)
+        '''
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(buf) < HEADER.size:
+            buf.close()
+            raise ValueError('Not a dlog table')
+        magic, m, digest = HEADER.unpack_from(buf)
+        if magic != MAGIC or digest != group_digest(p, g):
+            buf.close()
+            raise ValueError('Not a dlog table of this group')
+        if len(buf) != HEADER.size + 12 * m:
+            buf.close()
+            raise ValueError('Wrong size for {} steps'.format(m))
+
+        view = memoryview(buf)
+        keys = view[HEADER.size:HEADER.size + 8 * m].cast('Q')
+        steps = view[HEADER.size + 8 * m:].cast('I')
+        return cls(p, g, m, keys, steps, buf=buf)
+
+    def find(self, x):
+        key = int(x) & MASK
+        i = bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i] == key:
+            yield self.steps[i]
+            i += 1
+
+    def dlog(self, h, bound):
+        '''
+        Exponent c <= bound with g^c = h. Decrypted msgs are decoded in
+        the subgroup mode, so p - h is also accepted. Returns None if
+        there's no such c.
+        '''
+        backend = mixcrypt.backend
+        p = self.p
+        h = int(h) % p
+        x = backend.num(h)
+        for i in range(bound // self.m + 1):
+            for y in (int(x), p - int(x)):
+                for j in self.find(y):
+                    c = i * self.m + j
+                    # only 64 bits are compared, so the match is checked
+                    if c <= bound and int(backend.powmod(self.g, c, p)) in (h, p - h):
+                        return c
+            x = backend.mulmod(x, self.giant, p)
+        return None
+
+
+# tables loaded in this process, the last TABLES used
+_tables = OrderedDict()
+_lock = threading.Lock()
+TABLES = 8
+
+
+def stored_sizes(prefix):
+    '''
+    Sizes of the tables stored for the group prefix, the other files are
+    ignored
+    '''
+    if not os.path.isdir(settings.MIXNET_DLOG_DIR):
+        return []
+    sizes = []
+    for name in os.listdir(settings.MIXNET_DLOG_DIR):
+        base, ext = os.path.splitext(name)
+        if ext == '.dlog' and base.startswith(prefix + '-'):
+            try:
+                sizes.append(int(base[len(prefix) + 1:]))
+            except ValueError:
+                pass
+    return sizes
+
+
+def keep(path, table):
+    _tables[path] = table
+    _tables.move_to_end(path)
+    while len(_tables) > TABLES:
+        _tables.popitem(last=False)
+    return table
+
+
+def get_table(p, g, bound):
+    '''
+    Table for exponents up to bound in the group (p, g). A stored table
+    at least that big is mapped, or a new one is built and stored.
+    '''
+    m = table_size(bound)
+    prefix = group_digest(p, g).hex()[:16]
+    path = lambda size: os.path.join(settings.MIXNET_DLOG_DIR, '{}-{}.dlog'.format(prefix, size))
+
+    # a table is built only once even if several threads need it
+    with _lock:
+        for size in sorted({m} | {s for s in stored_sizes(prefix) if s > m}):
+            if path(size) in _tables:
+                return keep(path(size), _tables[path(size)])
+            try:
+                return keep(path(size), DlogTable.load(path(size), p, g))
+            except (OSError, ValueError):
+                pass
+
+        table = DlogTable.build(p, g, m)
+        os.makedirs(settings.MIXNET_DLOG_DIR, exist_ok=True)
+        table.save(path(m))
+        return keep(path(m), table)
+
+
+def dlog(h, g, p, bound):
+    '''
+    Exponent c <= bound with g^c = h, see DlogTable.dlog
+    '''
+    return get_table(p, g, bound).dlog(h, bound)
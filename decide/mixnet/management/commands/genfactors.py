@@ -0,0 +1,76 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from base import mods
+from mixnet.models import Mixnet
+
+
+class Command(BaseCommand):
+    help = 'Precompute the reencryption factors of the mixnets, one per voter in the census'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voting', type=int,
+                            help='only for this voting, by default all the votings not stopped')
+        parser.add_argument('--size', type=int,
+                            help='pool size, by default the census size of the voting')
+        parser.add_argument('--token', type=str,
+                            help='token of a staff user, to read the census size if there is no --size')
+        parser.add_argument('--batch', type=int, default=1000,
+                            help='factors stored at once')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='keep running, filling the pools every INTERVAL seconds')
+
+    def census_size(self, voting_id, options):
+        census = mods.get('census', params={'voting_id': voting_id},
+                          HTTP_AUTHORIZATION='Token ' + options['token'])
+        if not isinstance(census, list):
+            raise CommandError('The census of the voting {} can\'t be read'.format(voting_id))
+        return len(census)
+
+    def fill(self, mn, options):
+        size = options['size']
+        if size is None:
+            size = self.census_size(mn.voting_id, options)
+
+        missing = size - mn.factors.count()
+        while missing > 0:
+            n = min(missing, options['batch'])
+            mn.fill_factors(n)
+            missing -= n
+
+        return mn.factors.count()
+
+    def votings(self, options):
+        '''
+        The votings that need factors, by id, as returned by the voting
+        module: all the auths take the voting pubkey from it
+        '''
+        params = {'id': options['voting']} if options['voting'] else {}
+        votings = mods.get('voting', params=params)
+        if not isinstance(votings, list):
+            raise CommandError('The votings can\'t be read')
+        # stopped votings don't need more factors
+        return {v['id']: v for v in votings
+                if options['voting'] or v.get('end_date', None) is None}
+
+    def handle(self, *args, **options):
+        if options['size'] is None and not options['token']:
+            raise CommandError('--token is needed to read the census size without --size')
+
+        while True:
+            votings = self.votings(options)
+            mixnets = Mixnet.objects.filter(key__isnull=False, voting_id__in=votings.keys())
+
+            for mn in mixnets:
+                pk = votings[mn.voting_id].get('pub_key', None)
+                if not pk:
+                    continue
+                mn.set_factors_pubkey(pk['y'])
+                n = self.fill(mn, options)
+                self.stdout.write('Voting {}, position {}: {} factors'.format(
+                    mn.voting_id, mn.auth_position, n))
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,27 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mixnet.models import fill_key_pool, key_pool_depth
+
+
+class Command(BaseCommand):
+    help = 'Pregenerate keys for new mixnets, so starting a voting does not generate a safe prime'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=settings.MIXNET_KEY_POOL_SIZE,
+                            help='number of keys to keep in the pool')
+        parser.add_argument('--bits', type=int, default=settings.KEYBITS)
+        parser.add_argument('--interval', type=int, default=0,
+                            help='keep running, filling the pool every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            fill_key_pool(options['bits'], options['size'])
+            for bits, n in sorted(key_pool_depth().items()):
+                self.stdout.write('{} bits: {} keys'.format(bits, n))
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
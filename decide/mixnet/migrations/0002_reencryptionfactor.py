@@ -0,0 +1,22 @@
+import base.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixnet', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReencryptionFactor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('a', base.models.BigBigField()),
+                ('b', base.models.BigBigField()),
+                ('mixnet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='factors', to='mixnet.mixnet')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixnet', '0003_pooledkey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransferMsg',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transfer', models.CharField(db_index=True, max_length=32)),
+                ('index', models.PositiveIntegerField()),
+                ('msg', models.JSONField()),
+            ],
+            options={
+                'unique_together': {('transfer', 'index')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixnet', '0004_transfermsg'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PipelineStage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transfer', models.CharField(max_length=32)),
+                ('position', models.PositiveIntegerField()),
+                ('processed', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('transfer', 'position')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+import mixnet.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixnet', '0005_pipelinestage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.CharField(default=mixnet.models.new_transfer, max_length=32, primary_key=True, serialize=False)),
+                ('voting_id', models.PositiveIntegerField()),
+                ('position', models.PositiveIntegerField(default=0)),
+                ('kind', models.CharField(choices=[('key', 'key'), ('shuffle', 'shuffle'), ('decrypt', 'decrypt')], max_length=8)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('forwarded', 'forwarded'), ('done', 'done'), ('error', 'error')], default='pending', max_length=10)),
+                ('data', models.JSONField(default=dict)),
+                ('origin', models.JSONField(null=True)),
+                ('next', models.JSONField(null=True)),
+                ('result', models.JSONField(null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
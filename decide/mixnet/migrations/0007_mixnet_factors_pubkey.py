@@ -0,0 +1,18 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0001_initial'),
+        ('mixnet', '0006_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mixnet',
+            name='factors_pubkey',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mixnets_factors', to='base.key'),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixnet', '0007_mixnet_factors_pubkey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pipelinestage',
+            name='error',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+import mixnet.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixnet', '0008_pipelinestage_error'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='token',
+            field=models.CharField(default=mixnet.models.new_transfer, max_length=32),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixnet', '0009_job_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transfermsg',
+            name='voting_id',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
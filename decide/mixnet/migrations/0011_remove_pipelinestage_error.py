@@ -0,0 +1,15 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixnet', '0010_transfermsg_voting_id'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='pipelinestage',
+            name='error',
+        ),
+    ]
@@ -34,6 +34,10 @@ True
 '''
 
 
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pprint import pprint
 
 from Crypto.PublicKey import ElGamal
@@ -41,21 +45,492 @@ from Crypto.Random import random
 from Crypto import Random
 from Crypto.Util.number import GCD
 
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
 
-def rand(p):
+
+class PythonBackend:
+    '''
+    Big integer arithmetic with python ints. Every operation of mixcrypt
+    on big numbers goes through the selected backend (see set_backend).
+    '''
+
+    name = 'python'
+
+    def num(self, x):
+        return int(x)
+
+    def powmod(self, b, e, m):
+        return pow(b, e, m)
+
+    def mulmod(self, a, b, m):
+        return (a * b) % m
+
+    def invert(self, a, m):
+        return pow(a, -1, m)
+
+    def randint(self, a, b, rng):
+        # the random numbers always come from a cryptographically strong
+        # generator, backends shouldn't use their own generators
+        return rng.randint(a, b)
+
+
+class GMPBackend(PythonBackend):
+    '''
+    Big integer arithmetic with gmpy2, much faster than python ints for
+    the multiplications of the fixed-base tables and the batch inverse.
+    '''
+
+    name = 'gmp'
+
+    def num(self, x):
+        return gmpy2.mpz(x)
+
+    def powmod(self, b, e, m):
+        return gmpy2.powmod(b, e, m)
+
+    def invert(self, a, m):
+        return gmpy2.invert(a, m)
+
+
+BACKENDS = {'python': PythonBackend}
+if gmpy2:
+    BACKENDS['gmp'] = GMPBackend
+
+
+def get_backend(name=None):
+    '''
+    Returns the backend with this name, by default gmp if gmpy2 is
+    installed and python if not.
+    '''
+    if not name:
+        name = 'gmp' if 'gmp' in BACKENDS else 'python'
+    return BACKENDS[name]()
+
+
+backend = get_backend()
+
+
+def set_backend(name=None):
+    '''
+    Selects the backend used by mixcrypt and returns the previous one.
+    The worker processes of chunked_map use the same backend.
+    '''
+    global backend
+    prev = backend
+    backend = get_backend(name)
+    fixed_base.cache_clear()
+    return prev
+
+
+class RandomStream:
+    '''
+    Cryptographically strong random numbers for a whole batch.
+
+    Has the same randint as random.StrongRandom, but the random bytes are
+    read in blocks, so a batch doesn't pay one read to the OS and one new
+    generator per number.
+
+    >>> rng = RandomStream()
+    >>> all(0 <= rng.randint(0, i) <= i for i in range(1000))
+    True
+    '''
+
+    def __init__(self, block=4096):
+        self.read = Random.new().read
+        self.block = block
+        self.buf = b''
+        self.pos = 0
+
+    def getbytes(self, n):
+        if self.pos + n > len(self.buf):
+            self.buf = self.buf[self.pos:] + self.read(max(n, self.block))
+            self.pos = 0
+        b = self.buf[self.pos:self.pos + n]
+        self.pos += n
+        return b
+
+    def randint(self, a, b):
+        n = b - a + 1
+        k = n.bit_length()
+        size = (k + 7) // 8
+        while True:
+            # rejection sampling, without modulo bias
+            v = int.from_bytes(self.getbytes(size), 'big') >> (size * 8 - k)
+            if v < n:
+                return a + v
+
+
+def rand(p, rng=None):
+    if not rng:
+        rng = random.StrongRandom()
     while True:
-        k = random.StrongRandom().randint(1, int(p) - 1)
+        k = backend.randint(1, int(p) - 1, rng)
         if GCD(k, int(p) - 1) == 1: break
     return k
 
 
+# exponent size in the prime order subgroup, 256 bits give the same security
+# as a 3072 bits p against the known discrete log attacks
+EXP_BITS = 256
+
+
+def rand_short(bits=EXP_BITS, rng=None):
+    '''
+    Random exponent of at most bits bits, in [1, 2^bits)
+    '''
+    if not rng:
+        rng = random.StrongRandom()
+    return backend.randint(1, (1 << bits) - 1, rng)
+
+
+def encode(m, p):
+    '''
+    Maps the message 1 <= m <= q to the subgroup of quadratic residues of
+    the safe prime p = 2q + 1, as m or p - m, only one of them is a residue.
+
+    >>> p = 1019
+    >>> [decode(encode(m, p), p) for m in range(1, 10)]
+    [1, 2, 3, 4, 5, 6, 7, 8, 9]
+    >>> all(pow(encode(m, p), (p - 1) // 2, p) == 1 for m in range(1, 10))
+    True
+    '''
+    p = int(p)
+    if backend.powmod(m, (p - 1) // 2, p) == 1:
+        return m
+    return p - m
+
+
+def decode(e, p):
+    '''
+    Inverse of encode. Messages that weren't encoded are returned as they
+    are, if they're lower than q.
+    '''
+    p = int(p)
+    e = int(e)
+    if e <= (p - 1) // 2:
+        return e
+    return p - e
+
+
+def gen_perm(l, rng=None):
+    '''
+    Random permutation of range(l), Fisher-Yates shuffle, O(l).
+
+    >>> sorted(gen_perm(10)) == list(range(10))
+    True
+    '''
+    if not rng:
+        rng = RandomStream()
+    x = list(range(l))
+    for i in range(l - 1, 0, -1):
+        d = rng.randint(0, i)
+        x[i], x[d] = x[d], x[i]
+    return x
+
+
+class FixedBase:
+    '''
+    Fixed-base modular exponentiation with a precomputed window table.
+
+    The table stores ``base^(j * 2^(w*i)) mod p`` for every window position
+    ``i`` and digit ``j``, so ``base^e`` costs one multiplication per
+    window of ``e`` and no squarings. It only pays off when the same base
+    is used many times, like ``g`` and ``y`` during a whole tally.
+
+    The table is stored as numbers of the backend, with the python backend
+    the per-multiplication overhead of python ints is too high to beat the
+    GMP ``pow`` used by pycryptodome.
+
+    >>> fb = FixedBase(5, 1019)
+    >>> [fb.pow(e) for e in (0, 1, 77, 1018)] == [pow(5, e, 1019) for e in (0, 1, 77, 1018)]
+    True
+    '''
+
+    def __init__(self, base, p, bits=None, window=6):
+        self.p = p = int(p)
+        self.window = window
+        self.bits = bits or p.bit_length()
+        self.mask = (1 << window) - 1
+
+        self.table = []
+        b = backend.num(base) % p
+        for i in range(-(-self.bits // window)):
+            row = [backend.num(1), b]
+            for j in range(2, 1 << window):
+                row.append(backend.mulmod(row[-1], b, p))
+            self.table.append(row)
+            b = backend.mulmod(row[-1], b, p)
+
+    def pow(self, e):
+        if e.bit_length() > self.bits:
+            return int(backend.powmod(self.table[0][1], e, self.p))
+
+        p, w, mask = self.p, self.window, self.mask
+        r = 1
+        for row in self.table:
+            if not e:
+                break
+            d = e & mask
+            if d:
+                r = backend.mulmod(r, row[d], p)
+            e >>= w
+        return int(r)
+
+
+@lru_cache(maxsize=8)
+def fixed_base(base, p):
+    '''
+    Returns the cached FixedBase table for this base and modulus, building
+    it on first use.
+    '''
+    return FixedBase(base, p)
+
+
+def multi_pow(bases, exps, p, window=5):
+    '''
+    Product of bases[i]^exps[i] mod p, computed at once with interleaved
+    windows (Straus / Shamir's trick). All the exponentiations share the
+    same squarings, so each base only adds one multiplication per window
+    instead of a whole exponentiation. Negative exponents use the inverse
+    of the base. Pays off from 4 bases and 1024 bits keys.
+
+    >>> multi_pow([2, 3, 5], [10, 20, -30], 1019) == (2**10 * 3**20 * pow(5, -30, 1019)) % 1019
+    True
+    '''
+    p = int(p)
+    if len(bases) < 4 or p.bit_length() < 1024:
+        # with few bases or small keys the loop costs more than the
+        # squarings it saves
+        r = backend.num(1)
+        for b, e in zip(bases, exps):
+            r = backend.mulmod(r, backend.powmod(backend.num(b), int(e), p), p)
+        return int(r)
+
+    mask = (1 << window) - 1
+    tables = []
+    es = []
+    for b, e in zip(bases, exps):
+        b, e = backend.num(b) % p, int(e)
+        if e < 0:
+            b, e = backend.invert(b, p), -e
+        row = [backend.num(1), b]
+        for j in range(2, 1 << window):
+            row.append(backend.mulmod(row[-1], b, p))
+        tables.append(row)
+        es.append(e)
+
+    nbits = max(e.bit_length() for e in es)
+    r = backend.num(1)
+    for shift in range(-(-nbits // window) * window - window, -1, -window):
+        r = backend.powmod(r, 1 << window, p)
+        for e, row in zip(es, tables):
+            d = (e >> shift) & mask
+            if d:
+                r = backend.mulmod(r, row[d], p)
+    return int(r)
+
+
+def elgamal_combine(ciphers, p, exps=None):
+    '''
+    Combines a list of ciphers (a, b) into the cipher of the product of
+    the messages, or of the product of each message to exps[i] if exps is
+    provided, (prod a_i^e_i, prod b_i^e_i).
+
+    >>> elgamal_combine([(2, 3), (4, 5)], 11)
+    (8, 4)
+    >>> elgamal_combine([(2, 3), (4, 5)], 11, [2, 3]) == ((4 * 64) % 11, (9 * 125) % 11)
+    True
+    '''
+    p = int(p)
+    if exps is None:
+        a, b = backend.num(1), backend.num(1)
+        for a1, b1 in ciphers:
+            a = backend.mulmod(a, int(a1), p)
+            b = backend.mulmod(b, int(b1), p)
+        return int(a), int(b)
+
+    return (multi_pow([c[0] for c in ciphers], exps, p),
+            multi_pow([c[1] for c in ciphers], exps, p))
+
+
+def elgamal_encrypt(m, r, p, g, y):
+    '''
+    ElGamal encryption of m with the exponent r, using the fixed-base
+    tables of g and y.
+    '''
+    p, g, y = int(p), int(g), int(y)
+    a = fixed_base(g, p).pow(r)
+    b = int(backend.mulmod(fixed_base(y, p).pow(r), backend.num(m), p))
+    return a, b
+
+
+def elgamal_reencrypt(cipher, r, p, g, y):
+    '''
+    Re-encryption of the cipher (a, b) with the exponent r.
+    '''
+    a, b = map(int, cipher)
+    a1, b1 = elgamal_encrypt(1, r, p, g, y)
+    return ((a * a1) % p, (b * b1) % p)
+
+
+def batch_inverse(xs, p):
+    '''
+    Inverts every number in xs modulo p with a single modular inverse and
+    3(n-1) multiplications (Montgomery's trick).
+
+    >>> batch_inverse([2, 3, 4], 7) == [pow(i, -1, 7) for i in (2, 3, 4)]
+    True
+    '''
+    if not xs:
+        return []
+
+    # prefix[i] = xs[0] * ... * xs[i]
+    prefix = []
+    acc = backend.num(1)
+    for x in xs:
+        acc = backend.mulmod(acc, x, p)
+        prefix.append(acc)
+
+    inv = backend.invert(acc, p)
+    invs = [0] * len(xs)
+    for i in range(len(xs) - 1, 0, -1):
+        invs[i] = int(backend.mulmod(inv, prefix[i - 1], p))
+        inv = backend.mulmod(inv, xs[i], p)
+    invs[0] = int(inv)
+    return invs
+
+
+def elgamal_decrypt_batch(msgs, p, x):
+    '''
+    Decrypts a list of ciphers (a, b) with the private key x, computing
+    b / a^x with one batched inverse for the whole list.
+    '''
+    p = int(p)
+    shared = [backend.powmod(backend.num(a), x, p) for a, b in msgs]
+    invs = batch_inverse(shared, p)
+    return [(int(b) * inv) % p for (a, b), inv in zip(msgs, invs)]
+
+
+def combine_partials(msgs, partials, p):
+    '''
+    Decrypts a list of ciphers (a, b) with the partial decryptions of every
+    key of a multiple key, one list of a^x_i per key, computing
+    b / (a^x_1 * ... * a^x_n) with one batched inverse for the whole list.
+    '''
+    p = int(p)
+    shared = []
+    for factors in zip(*partials):
+        acc = backend.num(1)
+        for f in factors:
+            acc = backend.mulmod(acc, f, p)
+        shared.append(acc)
+    invs = batch_inverse(shared, p)
+    return [(int(b) * inv) % p for (a, b), inv in zip(msgs, invs)]
+
+
+def split(l, n):
+    '''
+    Splits the list l in n chunks of the same size, the last one can be
+    smaller.
+
+    >>> split([1, 2, 3, 4, 5], 2)
+    [[1, 2, 3], [4, 5]]
+    '''
+    size = max(1, -(-len(l) // n))
+    return [l[i:i + size] for i in range(0, len(l), size)]
+
+
+def permute(msgs, perm):
+    '''
+    The msgs in the order of perm. msgs can be a list or a batch with its
+    own permute, like mixnet.batch.CiphertextBatch.
+    '''
+    if hasattr(msgs, 'permute'):
+        return msgs.permute(perm)
+    return [msgs[i] for i in perm]
+
+
+def like(msgs, ciphers):
+    '''
+    The list of ciphers as the same type as msgs, a batch if msgs is a batch
+    '''
+    if hasattr(msgs, 'with_ciphers'):
+        return msgs.with_ciphers(ciphers)
+    return ciphers
+
+
+_pool = None
+_pool_key = None
+_pool_lock = threading.Lock()
+
+
+def worker_pool(workers):
+    '''
+    The pool of worker processes shared by every chunked_map, created on
+    the first use and again only when it needs more workers or the backend
+    changes. The workers are spawned, not forked: the processes that call
+    it run other threads (jobs, senders) and a fork could copy their locks
+    held.
+    '''
+    global _pool, _pool_key
+    with _pool_lock:
+        if _pool is None or _pool_key[0] < workers or _pool_key[1] != backend.name:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers,
+                                        mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=set_backend, initargs=(backend.name,))
+            _pool_key = (workers, backend.name)
+        return _pool
+
+
+def chunked_map(f, chunks, workers=1):
+    '''
+    Calls f for each chunk and returns the results in the same order.
+
+    If workers > 1 the chunks are processed in the pool of worker processes
+    (see worker_pool), f and the chunks should be picklable.
+    '''
+    if workers <= 1 or len(chunks) <= 1:
+        return [f(c) for c in chunks]
+
+    return list(worker_pool(workers).map(f, chunks))
+
+
+def _reencrypt_chunk(args):
+    msgs, rs, (p, g, y) = args
+    return [elgamal_reencrypt(m, r, p, g, y) for m, r in zip(msgs, rs)]
+
+
+def _factors_chunk(args):
+    rs, (p, g, y) = args
+    return [elgamal_encrypt(1, r, p, g, y) for r in rs]
+
+
+def _decrypt_chunk(args):
+    msgs, (p, g, y, x), last = args
+    clears = elgamal_decrypt_batch(msgs, p, x)
+    if last:
+        return clears
+    return [(a, clear) for (a, b), clear in zip(msgs, clears)]
+
+
+def _partial_chunk(args):
+    alphas, (p, x) = args
+    return [int(backend.powmod(backend.num(a), x, p)) for a in alphas]
+
+
 def gen_multiple_key(*crypts):
     k1 = crypts[0]
-    k = MixCrypt(k=k1.k, bits=k1.bits)
-    k.k.y = 1
+    k = MixCrypt(k=k1.k, bits=k1.bits, subgroup=k1.subgroup)
+    p = int(k.k.p)
+    y = 1
     for kx in crypts:
-        k.k.y *= kx.k.y
-    k.k.y = k.k.y % k.k.p
+        y = int(backend.mulmod(y, int(kx.k.y), p))
+    k.k = ElGamal.construct((p, int(k.k.g), y))
     return k
 
 
@@ -66,14 +541,21 @@ def multiple_decrypt(c, *crypts):
     return b
 
 
-def multiple_decrypt_shuffle(ciphers, *crypts):
+def multiple_decrypt_shuffle(ciphers, *crypts, workers=1, shuffled=False):
+    '''
+    If the ciphers were already shuffled, shuffled=True skips the shuffle
+    done by each decryption.
+    '''
     b = ciphers
     for i, k in enumerate(crypts):
         last = i == len(crypts) - 1
-        b = k.shuffle_decrypt(b, last)
+        if shuffled:
+            b = k.multiple_decrypt(b, last, workers=workers)
+        else:
+            b = k.shuffle_decrypt(b, last, workers=workers)
     return b
 
-def multiple_decrypt_shuffle2(ciphers, *crypts, pubkey=None):
+def multiple_decrypt_shuffle2(ciphers, *crypts, pubkey=None, workers=1):
     '''
     >>> B = 256
     >>> k1 = MixCrypt(bits=B)
@@ -94,30 +576,77 @@ def multiple_decrypt_shuffle2(ciphers, *crypts, pubkey=None):
 
     # shuffle
     for k in crypts:
-        b = k.shuffle(b, pubkey)
+        b = k.shuffle(b, pubkey, workers=workers)
 
     # decrypt
     for i, k in enumerate(crypts):
         last = i == len(crypts) - 1
-        b = k.multiple_decrypt(b, last=last)
+        b = k.multiple_decrypt(b, last=last, workers=workers)
     return b
 
 
 class MixCrypt:
-    def __init__(self, k=None, bits=256):
+    '''
+    With subgroup=True the keys are in the subgroup of prime order q of a
+    safe prime p = 2q + 1, and every exponent (private key, encryption and
+    reencryption) is a random number of EXP_BITS bits instead of a number
+    in [1, p-1]. The messages should be encoded in the subgroup (see
+    encrypt) and the last decryption decodes them.
+
+    >>> k = MixCrypt(bits=256, subgroup=True)
+    >>> int(k.k.x).bit_length() <= EXP_BITS
+    True
+    >>> cipher = [k.encrypt(i) for i in range(1, 9)]
+    >>> k.multiple_decrypt(cipher)
+    [1, 2, 3, 4, 5, 6, 7, 8]
+    '''
+
+    def __init__(self, k=None, bits=256, subgroup=False):
         self.bits = bits
+        self.subgroup = subgroup
         if k:
             self.k = self.getk(k.p, k.g)
         else:
             self.k = self.genk()
 
+    @classmethod
+    def from_key(cls, p, g, y, x=None, bits=256, subgroup=False):
+        '''
+        MixCrypt for an existing key, without generating a new one. Without
+        x it can only encrypt and reencrypt.
+
+        >>> k1 = MixCrypt(bits=256)
+        >>> k2 = MixCrypt.from_key(k1.k.p, k1.k.g, k1.k.y, k1.k.x)
+        >>> k2.decrypt(k1.encrypt(5))
+        5
+        '''
+        crypt = cls.__new__(cls)
+        crypt.bits = bits
+        crypt.subgroup = subgroup
+        key = (p, g, y) if x is None else (p, g, y, x)
+        crypt.k = ElGamal.construct(tuple(int(i) for i in key))
+        return crypt
+
+    def rand(self, p, rng=None):
+        '''
+        Random exponent, short in the subgroup mode. With small keys the
+        exponent is kept lower than q.
+        '''
+        if self.subgroup:
+            return rand_short(min(EXP_BITS, int(p).bit_length() - 2), rng)
+        return rand(p, rng)
+
     def genk(self):
+        # the generator g of ElGamal.generate is a quadratic residue, so it
+        # already generates the subgroup of order q
         self.k = ElGamal.generate(self.bits, Random.new().read)
+        if self.subgroup:
+            self.getk(self.k.p, self.k.g)
         return self.k
 
     def getk(self, p, g):
-        x = rand(p)
-        y = pow(g, x, p)
+        x = self.rand(p)
+        y = int(backend.powmod(int(g), x, int(p)))
         self.k = ElGamal.construct((p, g, y, x))
         return self.k
 
@@ -126,41 +655,89 @@ class MixCrypt:
         return self.k
 
     def encrypt(self, m, k=None):
-        r = rand(self.k.p)
         if not k:
             k = self.k
-        a, b = k._encrypt(m, r)
-        return a, b
+        r = self.rand(k.p)
+        if self.subgroup:
+            m = encode(m, k.p)
+        return elgamal_encrypt(m, r, k.p, k.g, k.y)
 
     def decrypt(self, c):
-        m = self.k._decrypt(c)
+        '''
+        Blinded decryption of pycryptodome, for a single cipher. The batches
+        go through batch_decrypt, which doesn't blind.
+        '''
+        return int(self.k._decrypt(c))
+
+    def decode(self, m):
+        '''
+        Decodes a decrypted message, only needed in the subgroup mode
+        '''
+        if self.subgroup:
+            return decode(m, self.k.p)
         return m
 
-    def multiple_decrypt(self, msgs, last=True):
+    def batch_decrypt(self, msgs):
+        '''
+        Decrypt a list of messages with a single modular inverse for the
+        whole list, returns the same as decrypting them one by one.
+
+        >>> B = 256
+        >>> k = MixCrypt(bits=B)
+        >>> cipher = [k.encrypt(i) for i in range(2, 10)]
+        >>> k.batch_decrypt(cipher) == [k.decrypt(c) for c in cipher]
+        True
+        '''
+        return elgamal_decrypt_batch(msgs, self.k.p, int(self.k.x))
+
+    def multiple_decrypt(self, msgs, last=True, workers=1):
+        '''
+        Decrypt a list of messages, keeping the order. If msgs is a batch
+        and it's not the last decryption, the result is a batch too.
+
+        Each chunk is decrypted with batch inversion. With workers > 1 the
+        list is split in one chunk per worker process and the private key
+        is sent once with each chunk.
+        '''
+
+        key = tuple(int(i) for i in (self.k.p, self.k.g, self.k.y, self.k.x))
+        chunks = [(c, key, last) for c in split(msgs, workers)]
         msgs2 = []
-        for a, b in msgs:
-            clear = self.decrypt((a, b))
-            if last:
-                msg = clear
-            else:
-                msg = (a, clear)
-            msgs2.append(msg)
+        for chunk in chunked_map(_decrypt_chunk, chunks, workers):
+            msgs2.extend(chunk)
+        if not last:
+            return like(msgs, msgs2)
+        if self.subgroup:
+            msgs2 = [self.decode(m) for m in msgs2]
         return msgs2
 
-    def shuffle_decrypt(self, msgs, last=True):
-        msgs2 = msgs.copy()
-        msgs3 = []
-        while msgs2:
-            n = random.StrongRandom().randint(0, len(msgs2) - 1)
-            a, b = msgs2.pop(n)
-            clear = self.decrypt((a, b))
-            if last:
-                msg = clear
-            else:
-                msg = (a, clear)
-            msgs3.append(msg)
-
-        return msgs3
+    def partial_decrypt(self, alphas, workers=1):
+        '''
+        Partial decryption with this key, a^x for the first component a of
+        each cipher. The partial decryptions of all the keys of a multiple
+        key decrypt the ciphers, see combine_partials.
+
+        >>> B = 256
+        >>> k1 = MixCrypt(bits=B)
+        >>> k2 = MixCrypt(k=k1.k, bits=B)
+        >>> k3 = gen_multiple_key(k1, k2)
+        >>> cipher = [k3.encrypt(i) for i in range(2, 10)]
+        >>> alphas = [a for a, b in cipher]
+        >>> partials = [k1.partial_decrypt(alphas), k2.partial_decrypt(alphas)]
+        >>> combine_partials(cipher, partials, k3.k.p) == list(range(2, 10))
+        True
+        '''
+
+        key = (int(self.k.p), int(self.k.x))
+        chunks = [(c, key) for c in split(alphas, workers)]
+        partial = []
+        for chunk in chunked_map(_partial_chunk, chunks, workers):
+            partial.extend(chunk)
+        return partial
+
+    def shuffle_decrypt(self, msgs, last=True, workers=1):
+        perm = self.gen_perm(len(msgs))
+        return self.multiple_decrypt(permute(msgs, perm), last, workers)
 
     def reencrypt(self, cipher, pubkey=None):
         '''
@@ -177,40 +754,101 @@ class MixCrypt:
         True
         '''
 
+        p, g, y = self.pubkey(pubkey)
+        return elgamal_reencrypt(cipher, self.rand(p), p, g, y)
+
+    def reencrypt_batch(self, msgs, rs, pubkey=None, workers=1):
+        '''
+        Reencrypt each message with the corresponding exponent in rs.
+
+        With workers > 1 the batch is split in chunks that are reencrypted
+        in worker processes. The result doesn't depend on the number of
+        workers.
+
+        >>> B = 256
+        >>> k = MixCrypt(bits=B)
+        >>> cipher = [k.encrypt(i) for i in range(2, 10)]
+        >>> rs = [rand(k.k.p) for i in cipher]
+        >>> k.reencrypt_batch(cipher, rs) == k.reencrypt_batch(cipher, rs, workers=2)
+        True
+        '''
+
+        if not msgs:
+            return []
+
+        p, g, y = self.pubkey(pubkey)
+        # the tables are built before forking so the workers inherit them
+        fixed_base(g, p)
+        fixed_base(y, p)
+
+        chunks = [(m, r, (p, g, y)) for m, r in zip(split(msgs, workers), split(rs, workers))]
+        msgs2 = []
+        for chunk in chunked_map(_reencrypt_chunk, chunks, workers):
+            msgs2.extend(chunk)
+        return msgs2
+
+    def pubkey(self, pubkey=None):
+        '''
+        Returns (p, g, y) as ints, from pubkey if provided or from this key.
+        '''
         if pubkey:
             p, g, y = pubkey
-            k = ElGamal.construct((p, g, y))
         else:
-            k = self.k
+            p, g, y = self.k.p, self.k.g, self.k.y
+        return int(p), int(g), int(y)
+
+    def gen_perm(self, l, rng=None):
+        return gen_perm(l, rng)
 
-        a, b = map(int, cipher)
-        a1, b1 = map(int, self.encrypt(1, k=k))
-        p = int(k.p)
+    def gen_factors(self, n, pubkey=None, workers=1):
+        '''
+        Generates n reencryption factors, the encryptions of 1,
+        (g^r, y^r), that can be computed before knowing the messages.
+        '''
 
-        return ((a * a1) % p, (b * b1) % p)
+        p, g, y = self.pubkey(pubkey)
+        fixed_base(g, p)
+        fixed_base(y, p)
 
-    def gen_perm(self, l):
-        x = list(range(l))
-        for i in range(l):
-            d = random.StrongRandom().randint(0, i)
-            if i != d:
-                x[i] = x[d]
-                x[d] = i
-        return x
+        rng = RandomStream()
+        rs = [self.rand(p, rng) for i in range(n)]
+        chunks = [(c, (p, g, y)) for c in split(rs, workers)]
+        factors = []
+        for chunk in chunked_map(_factors_chunk, chunks, workers):
+            factors.extend(chunk)
+        return factors
 
-    def shuffle(self, msgs, pubkey=None):
+    def shuffle(self, msgs, pubkey=None, workers=1, factors=None):
         '''
         Reencrypt and shuffle
+
+        The permutation and the reencryption exponents are generated here,
+        so workers only change where the reencryption is done.
+
+        factors is a list of precomputed reencryption factors for this
+        pubkey (see gen_factors), each one should be used only once. With
+        a factor the reencryption is just two modular multiplications,
+        the messages without factor are reencrypted as usual.
+
+        msgs can be a list or a batch (see mixnet.batch), the result is
+        of the same type.
         '''
 
-        msgs2 = msgs.copy()
-        perm = self.gen_perm(len(msgs))
-        for i, p in enumerate(perm):
-            m = msgs[p]
-            nm = self.reencrypt(m, pubkey)
-            msgs2[i] = nm
+        p, g, y = self.pubkey(pubkey)
+        rng = RandomStream()
+        perm = self.gen_perm(len(msgs), rng)
+        msgs2 = permute(msgs, perm)
 
-        return msgs2
+        factors = list(factors or [])[:len(msgs2)]
+        nf = len(factors)
+        msgs3 = []
+        for (a, b), (a1, b1) in zip(msgs2, factors):
+            msgs3.append((int(backend.mulmod(int(a), a1, p)),
+                          int(backend.mulmod(int(b), b1, p))))
+
+        rs = [self.rand(p, rng) for i in msgs2[nf:]]
+        msgs3.extend(self.reencrypt_batch(msgs2[nf:], rs, pubkey, workers))
+        return like(msgs, msgs3)
 
 
 if __name__ == "__main__":
@@ -1,15 +1,26 @@
-from django.db import models
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
 
-from .mixcrypt import MixCrypt
+from django.db import connections, models, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .mixcrypt import MixCrypt, combine_partials
 
 from base import mods
-from base.models import Auth, Key
+from base.models import Auth, Key, BigBigField
 from base.serializers import AuthSerializer
 from django.conf import settings
 
 
 # number of bits for the key, all auths should use the same number of bits
 B = settings.KEYBITS
+# keys in the prime order subgroup with short exponents, see MixCrypt
+S = settings.MIXNET_SUBGROUP
+# indexes per query reading a transfer, SQLite allows 999 variables
+TRANSFER_READ = 500
 
 
 class Mixnet(models.Model):
@@ -22,36 +33,104 @@ class Mixnet(models.Model):
     pubkey = models.ForeignKey(Key, blank=True, null=True,
                                related_name="mixnets_pub",
                                on_delete=models.SET_NULL)
+    # voting pubkey of the precomputed factors, see factors_key
+    factors_pubkey = models.ForeignKey(Key, blank=True, null=True,
+                                       related_name="mixnets_factors",
+                                       on_delete=models.SET_NULL)
 
     def __str__(self):
         auths = ", ".join(a.name for a in self.auths.all())
         return "Voting: {}, Auths: {}\nPubKey: {}".format(self.voting_id,
                                                           auths, self.pubkey)
 
+    def crypt(self):
+        '''
+        MixCrypt for the key of this mixnet, see key_crypt
+        '''
+        k = self.key
+        return key_crypt(int(k.p), int(k.g), int(k.y), int(k.x))
+
     def shuffle(self, msgs, pk):
-        crypt = MixCrypt(bits=B)
-        k = crypt.setk(self.key.p, self.key.g, self.key.y, self.key.x)
+        crypt = self.crypt()
+        factors = self.take_factors(len(msgs), pk)
+        return crypt.shuffle(msgs, pk, workers=settings.MIXNET_WORKERS,
+                             factors=factors)
+
+    def factors_key(self):
+        '''
+        The key used to precompute reencryption factors. All the auths
+        reencrypt with the voting pubkey, the product of the keys of all
+        of them, but the pubkey of this mixnet only has the keys of this
+        auth and the next ones, so it's the voting pubkey only for the
+        first auth. The others need it set with set_factors_pubkey.
+        '''
+        return self.factors_pubkey or self.pubkey or self.key
+
+    def set_factors_pubkey(self, y):
+        '''
+        Sets y as the voting pubkey for the factors, the factors computed
+        for another key are dropped
+        '''
+        key = self.factors_key()
+        if key and int(key.y) == int(y):
+            return
+        self.factors.all().delete()
+        pubkey = Key(p=self.key.p, g=self.key.g, y=int(y))
+        pubkey.save()
+        self.factors_pubkey = pubkey
+        self.save()
 
-        return crypt.shuffle(msgs, pk)
+    def fill_factors(self, n):
+        '''
+        Precomputes n reencryption factors for the shuffle, this doesn't
+        depend on the votes so it can be done while the voting is open.
+        '''
+        key = self.factors_key()
+        crypt = self.crypt()
+        factors = crypt.gen_factors(n, (key.p, key.g, key.y),
+                                    workers=settings.MIXNET_WORKERS)
+        ReencryptionFactor.objects.bulk_create(
+            ReencryptionFactor(mixnet=self, a=a, b=b) for a, b in factors)
 
-    def decrypt(self, msgs, pk, last=False):
-        crypt = MixCrypt(bits=B)
-        k = crypt.setk(self.key.p, self.key.g, self.key.y, self.key.x)
-        return crypt.shuffle_decrypt(msgs, last)
+    def take_factors(self, n, pk):
+        '''
+        Takes up to n precomputed factors for the pk, each factor is
+        deleted when taken so it's never used twice.
+        '''
+        key = self.factors_key()
+        if not key or tuple(map(int, pk)) != (key.p, key.g, key.y):
+            return []
+
+        with transaction.atomic():
+            factors = list(self.factors.select_for_update(skip_locked=True)
+                           .values_list('id', 'a', 'b')[:n])
+            ReencryptionFactor.objects.filter(id__in=[f[0] for f in factors]).delete()
+
+        return [(a, b) for _, a, b in factors]
+
+    def decrypt(self, msgs, pk, last=False, shuffled=False):
+        crypt = self.crypt()
+        # if msgs comes from the shuffle there's no need to shuffle again
+        if shuffled:
+            return crypt.multiple_decrypt(msgs, last, workers=settings.MIXNET_WORKERS)
+        return crypt.shuffle_decrypt(msgs, last, workers=settings.MIXNET_WORKERS)
 
     def gen_key(self, p=0, g=0):
-        crypt = MixCrypt(bits=B)
+        # MixCrypt(bits=B) generates a new key, so it's only built when
+        # there's no key in the pool
         if self.key:
-            k = crypt.setk(self.key.p, self.key.g, self.key.y, self.key.x)
+            return
         elif (not g or not p):
-            k = crypt.genk()
-            key = Key(p=int(k.p), g=int(k.g), y=int(k.y), x=int(k.x))
-            key.save()
+            key = take_pooled_key(B)
+            if not key:
+                k = MixCrypt(bits=B, subgroup=S).k
+                key = Key(p=int(k.p), g=int(k.g), y=int(k.y), x=int(k.x))
+                key.save()
 
             self.key = key
             self.save()
         else:
-            k = crypt.getk(p, g)
+            k = MixCrypt(k=Key(p=p, g=g), bits=B, subgroup=S).k
             key = Key(p=int(k.p), g=int(k.g), y=int(k.y), x=int(k.x))
             key.save()
 
@@ -68,17 +147,642 @@ class Mixnet(models.Model):
         })
 
         if next_auths:
-            auth = next_auths.first().url
+            auth = next_auths[0].url
             r = mods.post('mixnet', entry_point=path,
-                           baseurl=auth, json=data)
+                           baseurl=auth, json=data, binary=True)
             return r
 
         return None
 
+    def process_transfer(self, transfer, size, f, perm=None, store=False):
+        '''
+        Applies f to a batch stored in chunks, one chunk at a time, in the
+        order given by perm if any. Each result chunk is sent to the next
+        auth as soon as it's ready, or stored here if this is the last
+        auth or with store. Returns the id of the new transfer. The input
+        transfer is dropped even if it fails, and so is the result here.
+        '''
+
+        next_auths = [] if store else self.next_auths()
+        entry_point = '/chunk/{}/'.format(self.voting_id)
+        out = new_transfer()
+
+        try:
+            for offset in range(0, size, settings.CHUNK_SIZE):
+                end = min(size, offset + settings.CHUNK_SIZE)
+                indexes = perm[offset:end] if perm else range(offset, end)
+                msgs = f(read_transfer(self.voting_id, transfer, indexes))
+                if next_auths:
+                    mods.post_chunks('mixnet', entry_point, msgs, out, offset,
+                                     baseurl=next_auths[0].url)
+                else:
+                    store_transfer(self.voting_id, out, offset, msgs)
+        except Exception:
+            if not next_auths:
+                drop_transfer(self.voting_id, out)
+            raise
+        finally:
+            drop_transfer(self.voting_id, transfer)
+        return out
+
+    def shuffle_transfer(self, transfer, size, pk):
+        perm = self.crypt().gen_perm(size)
+        return self.process_transfer(transfer, size,
+                                     lambda msgs: self.shuffle(msgs, pk), perm)
+
+    def decrypt_transfer(self, transfer, size, pk, last=False, shuffled=False):
+        # the permutation is applied reading the chunks, so the chunks
+        # don't need to be shuffled again
+        perm = None if shuffled else self.crypt().gen_perm(size)
+        f = lambda msgs: self.decrypt(msgs, pk, last=last, shuffled=True)
+        return self.process_transfer(transfer, size, f, perm)
+
+    def partial_decrypt(self, alphas):
+        return self.crypt().partial_decrypt([int(a) for a in alphas],
+                                            workers=settings.MIXNET_WORKERS)
+
+    def parallel_decrypt(self, msgs, pk):
+        '''
+        Decrypts shuffled msgs asking all the auths for their partial
+        decryption at the same time, see MixCrypt.partial_decrypt, so it
+        takes the time of the slowest auth and not the sum of all of them.
+        '''
+
+        alphas = [int(a) for a, b in msgs]
+        entry_point = '/partial/{}/'.format(self.voting_id)
+        calls = [{ "baseurl": a.url,
+                   "json": { "msgs": alphas, "position": self.auth_position + i + 1 } }
+                 for i, a in enumerate(self.next_auths())]
+        results = fan_out(lambda **kw: mods.post('mixnet', entry_point=entry_point,
+                                                 binary=True, **kw), calls)
+
+        partials = [self.partial_decrypt(alphas)]
+        for call, partial in zip(calls, results()):
+            if not isinstance(partial, list) or len(partial) != len(alphas):
+                raise ValueError("No partial decryption from {}".format(call["baseurl"]))
+            partials.append(partial)
+
+        crypt = self.crypt()
+        return [crypt.decode(m) for m in combine_partials(msgs, partials, pk[0])]
+
+    def parallel_decrypt_transfer(self, transfer, size, pk, shuffled=False):
+        perm = None if shuffled else self.crypt().gen_perm(size)
+        f = lambda msgs: self.parallel_decrypt(msgs, pk)
+        return self.process_transfer(transfer, size, f, perm, store=True)
+
+    def chain_transfer(self, path, transfer, size, data):
+        '''
+        Like chain_call, for a batch stored in chunks. The result of the
+        next auth is brought back in chunks, so the caller always gets the
+        result from this auth. Returns the id of the result transfer.
+        '''
+
+        data.update({"transfer": transfer, "size": size})
+        resp = self.chain_call(path, data)
+        if not resp:
+            return transfer
+        if not isinstance(resp, dict) or not resp.get("transfer"):
+            raise ValueError("The next auth didn't return the transfer")
+
+        baseurl = self.next_auths()[0].url
+        entry_point = '/chunk/{}/'.format(self.voting_id)
+        out = new_transfer()
+        offset = 0
+        try:
+            for msgs in mods.get_chunks('mixnet', entry_point, resp["transfer"], size,
+                                        baseurl=baseurl):
+                store_transfer(self.voting_id, out, offset, msgs)
+                offset += len(msgs)
+        except Exception:
+            drop_transfer(self.voting_id, out)
+            raise
+        finally:
+            mods.query('mixnet', entry_point=entry_point, method='delete',
+                       baseurl=baseurl, params={"transfer": resp["transfer"]})
+        return out
+
+    def check_pipeline(self, info):
+        '''
+        Raises ValueError if info isn't a valid pipeline
+        '''
+
+        try:
+            size = int(info["size"])
+            [int(info["pk"][k]) for k in ("p", "g", "y")]
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("The pipeline needs size and pk")
+        if size < 0:
+            raise ValueError("Wrong size")
+
+    def pipeline_chunk(self, transfer, offset, msgs, info):
+        '''
+        Pipelined shuffle, each chunk is reencrypted as soon as it arrives,
+        while the previous auth is still sending the next ones. The chunks
+        are stored at their offset and wait_pipeline permutes the whole
+        batch, so each auth mixes all the msgs like shuffle_transfer.
+
+        info is { "size": int, "pk": { "p", "g", "y" } }
+        '''
+
+        size = int(info["size"])
+        if offset < 0 or offset + len(msgs) > size:
+            raise ValueError("The chunk is out of the pipeline")
+
+        pk = info["pk"]
+        # the order inside the chunk doesn't matter, the full permutation
+        # comes later
+        msgs = self.shuffle(msgs, (int(pk["p"]), int(pk["g"]), int(pk["y"])))
+        store_transfer(self.voting_id, stage_transfer(transfer, self.auth_position), offset, msgs)
+
+        st, _ = PipelineStage.objects.get_or_create(transfer=transfer,
+                                                    position=self.auth_position)
+        PipelineStage.objects.filter(pk=st.pk).update(processed=F('processed') + len(msgs))
+
+    def wait_pipeline(self, transfer, size, pk):
+        '''
+        Waits until this auth has reencrypted the size msgs of the
+        pipeline, returns False after MIXNET_PIPELINE_TIMEOUT seconds,
+        dropping the msgs received so far.
+
+        Then the msgs are read in the order of a random permutation of the
+        whole batch and sent in chunks to the next auth, or stored for the
+        result in the last one. Raises ValueError or RequestException if a
+        chunk couldn't be sent.
+        '''
+
+        start = time.monotonic()
+        stages = PipelineStage.objects.filter(transfer=transfer, position=self.auth_position)
+        received = stage_transfer(transfer, self.auth_position)
+        while True:
+            st = stages.first()
+            if (st.processed if st else 0) >= size:
+                stages.delete()
+                break
+            if time.monotonic() - start > settings.MIXNET_PIPELINE_TIMEOUT:
+                stages.delete()
+                drop_transfer(self.voting_id, received)
+                return False
+            time.sleep(0.05)
+
+        next_auths = self.next_auths()
+        out = stage_transfer(transfer, self.auth_position + 1)
+        info = {"size": size, "pk": pk}
+        perm = self.crypt().gen_perm(size)
+        sent = []
+        try:
+            for offset in range(0, size, settings.CHUNK_SIZE):
+                msgs = read_transfer(self.voting_id, received,
+                                     perm[offset:offset + settings.CHUNK_SIZE])
+                if next_auths:
+                    data = {"transfer": transfer, "offset": offset, "msgs": msgs,
+                            "pipeline": info, "position": self.auth_position + 1}
+                    sent.append(send(send_chunk, entry_point='/chunk/{}/'.format(self.voting_id),
+                                     baseurl=next_auths[0].url, json=data))
+                else:
+                    store_transfer(self.voting_id, out, offset, msgs)
+            for s in sent:
+                if isinstance(s, Future):
+                    s.result()
+        except Exception:
+            if not next_auths:
+                drop_transfer(self.voting_id, out)
+            raise
+        finally:
+            drop_transfer(self.voting_id, received)
+        return True
+
+    def job_pk(self, data):
+        return data.get("pk") or { "p": self.key.p, "g": self.key.g, "y": self.key.y }
+
+    def key_job(self, data):
+        '''
+        Async key generation, the key of this auth is added to the product
+        of the keys of the previous auths, data["y"]
+        '''
+        key = data.get("key", {"p": 0, "g": 0})
+        self.gen_key(int(key["p"]), int(key["g"]))
+        p = self.key.p
+        y = (int(data.get("y", 1)) * self.key.y) % p
+        return { "key": { "p": p, "g": self.key.g }, "y": y }
+
+    def shuffle_job(self, data):
+        '''
+        Async shuffle of data["msgs"] or data["transfer"], returns the data
+        for the next auth
+        '''
+        pk = self.job_pk(data)
+        k = (pk["p"], pk["g"], pk["y"])
+        transfer, size = data.get("transfer", None), int(data.get("size", 0))
+
+        if transfer and data.get("pipeline", False):
+            if not self.wait_pipeline(transfer, size, pk):
+                raise TimeoutError("Pipeline timeout")
+            if not self.next_auths():
+                return { "transfer": stage_transfer(transfer, self.auth_position + 1),
+                         "size": size }
+            return { "transfer": transfer, "size": size, "pk": pk, "pipeline": True }
+
+        if transfer:
+            out = self.shuffle_transfer(transfer, size, k)
+            return { "transfer": out, "size": size, "pk": pk }
+
+        return { "msgs": self.shuffle(data.get("msgs", []), k), "pk": pk }
+
+    def decrypt_job(self, data):
+        '''
+        Async decrypt of data["msgs"] or data["transfer"], returns the data
+        for the next auth
+        '''
+        pk = self.job_pk(data)
+        k = (pk["p"], pk["g"], pk["y"])
+        shuffled = data.get("shuffled", False)
+        last = not self.next_auths()
+        transfer, size = data.get("transfer", None), int(data.get("size", 0))
+
+        if data.get("parallel", False):
+            if transfer:
+                out = self.parallel_decrypt_transfer(transfer, size, k, shuffled=shuffled)
+                return { "transfer": out, "size": size }
+            msgs = data.get("msgs", [])
+            if not shuffled:
+                msgs = [msgs[i] for i in self.crypt().gen_perm(len(msgs))]
+            return { "msgs": self.parallel_decrypt(msgs, k) }
+
+        if transfer:
+            out = self.decrypt_transfer(transfer, size, k, last=last, shuffled=shuffled)
+            return { "transfer": out, "size": size, "pk": pk, "shuffled": shuffled }
+
+        msgs = self.decrypt(data.get("msgs", []), k, last=last, shuffled=shuffled)
+        return { "msgs": msgs, "pk": pk, "shuffled": shuffled }
+
+    def upload_transfer(self, transfer, size, baseurl):
+        '''
+        Sends a transfer stored here to the auth in baseurl, returns the id
+        of the transfer there
+        '''
+        entry_point = '/chunk/{}/'.format(self.voting_id)
+        out = new_transfer()
+        try:
+            for offset in range(0, size, settings.CHUNK_SIZE):
+                end = min(size, offset + settings.CHUNK_SIZE)
+                msgs = read_transfer(self.voting_id, transfer, range(offset, end))
+                mods.post_chunks('mixnet', entry_point, msgs, out, offset, baseurl=baseurl)
+        finally:
+            drop_transfer(self.voting_id, transfer)
+        return out
+
     def next_auths(self):
-        next_auths = self.auths.filter(me=False)
+        # using auths.all() so the prefetched auths are used if any
+        auths = sorted(self.auths.all(), key=lambda a: a.id)
+        next_auths = [a for a in auths if not a.me]
 
-        if self.auths.count() == next_auths.count():
+        if len(auths) == len(next_auths):
             next_auths = next_auths[1:]
 
         return next_auths
+
+
+class ReencryptionFactor(models.Model):
+    '''
+    Precomputed reencryption factor (g^r, y^r) for the pubkey of a mixnet
+    '''
+    mixnet = models.ForeignKey(Mixnet, related_name="factors",
+                               on_delete=models.CASCADE)
+    a = BigBigField()
+    b = BigBigField()
+
+
+class TransferMsg(models.Model):
+    '''
+    Message of a batch sent in chunks between auths, so no request holds
+    the whole batch. A transfer belongs to the voting of the mixnet that
+    stored it, and it's only read or dropped for that voting.
+    '''
+    voting_id = models.PositiveIntegerField(default=0)
+    transfer = models.CharField(max_length=32, db_index=True)
+    index = models.PositiveIntegerField()
+    msg = models.JSONField()
+
+    class Meta:
+        unique_together = (('transfer', 'index'),)
+
+
+def new_transfer():
+    return uuid.uuid4().hex
+
+
+def stage_transfer(transfer, position):
+    '''
+    Id of the msgs received by the auth in position in a pipeline
+    '''
+    return '{}.{}'.format(transfer[:28], position)
+
+
+def store_transfer(voting_id, transfer, offset, msgs):
+    TransferMsg.objects.bulk_create(
+        TransferMsg(voting_id=voting_id, transfer=transfer, index=offset + i, msg=m)
+        for i, m in enumerate(msgs))
+
+
+def read_transfer(voting_id, transfer, indexes):
+    '''
+    Messages of the transfer in the order of indexes. Consecutive indexes
+    are read as a range, the others in groups of TRANSFER_READ so no query
+    goes over the bound variables limit of the database.
+    '''
+    indexes = list(indexes)
+    if not indexes:
+        return []
+    rows = TransferMsg.objects.filter(voting_id=voting_id, transfer=transfer)
+    lo, hi = min(indexes), max(indexes) + 1
+    if hi - lo == len(indexes):
+        msgs = dict(rows.filter(index__gte=lo, index__lt=hi).values_list('index', 'msg'))
+    else:
+        msgs = {}
+        for i in range(0, len(indexes), TRANSFER_READ):
+            part = indexes[i:i + TRANSFER_READ]
+            msgs.update(rows.filter(index__in=part).values_list('index', 'msg'))
+    return [msgs[i] for i in indexes]
+
+
+def drop_transfer(voting_id, transfer):
+    TransferMsg.objects.filter(voting_id=voting_id, transfer=transfer).delete()
+
+
+def transfer_owned(voting_id, transfer):
+    '''
+    False if the transfer has msgs of another voting
+    '''
+    return not TransferMsg.objects.filter(transfer=transfer).exclude(voting_id=voting_id).exists()
+
+
+class PipelineStage(models.Model):
+    '''
+    Progress of an auth in a pipelined shuffle
+    '''
+    transfer = models.CharField(max_length=32)
+    position = models.PositiveIntegerField()
+    processed = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('transfer', 'position'),)
+
+
+_senders = None
+
+
+def send(f, *args, **kwargs):
+    '''
+    Calls f in a sender thread, so the pipeline goes on while the chunk is
+    sent. With MIXNET_PIPELINE_SENDERS = 0 f is called here.
+    '''
+    global _senders
+    if not settings.MIXNET_PIPELINE_SENDERS:
+        return f(*args, **kwargs)
+    if _senders is None:
+        _senders = ThreadPoolExecutor(max_workers=settings.MIXNET_PIPELINE_SENDERS)
+    return _senders.submit(sender_thread, f, *args, **kwargs)
+
+
+def sender_thread(f, *args, **kwargs):
+    try:
+        return f(*args, **kwargs)
+    finally:
+        connections.close_all()
+
+
+def send_chunk(**kwargs):
+    '''
+    Sends a permuted chunk of a pipeline to the next auth
+    '''
+    response = mods.post('mixnet', binary=True, response=True, **kwargs)
+    if response.status_code != 200:
+        raise ValueError("{} didn't take the chunk: {}".format(kwargs["baseurl"],
+                                                              response.status_code))
+
+
+_fanout = None
+
+
+def fan_out(f, calls):
+    '''
+    Calls f(**kwargs) for each kwargs in calls at the same time, in
+    MIXNET_FANOUT_THREADS threads (0 to call them one by one here).
+    Returns a function that waits for the results, in the same order.
+    '''
+    global _fanout
+    if not settings.MIXNET_FANOUT_THREADS:
+        results = [f(**kwargs) for kwargs in calls]
+        return lambda: results
+    if _fanout is None:
+        _fanout = ThreadPoolExecutor(max_workers=settings.MIXNET_FANOUT_THREADS)
+    futures = [_fanout.submit(f, **kwargs) for kwargs in calls]
+    return lambda: [future.result() for future in futures]
+
+
+class PooledKey(models.Model):
+    '''
+    Pregenerated keypair, waiting to be taken by a new mixnet
+    '''
+    key = models.OneToOneField(Key, related_name="pooled",
+                               on_delete=models.CASCADE)
+    bits = models.PositiveIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+
+
+def fill_key_pool(bits, n):
+    '''
+    Generates keys until there're n keys of this bits in the pool
+    '''
+    while PooledKey.objects.filter(bits=bits).count() < n:
+        k = MixCrypt(bits=bits, subgroup=S).k
+        with transaction.atomic():
+            key = Key(p=int(k.p), g=int(k.g), y=int(k.y), x=int(k.x))
+            key.save()
+            PooledKey(key=key, bits=bits).save()
+
+
+def take_pooled_key(bits):
+    '''
+    Takes the oldest key of this bits from the pool, it's removed from the
+    pool so two mixnets never get the same key. Returns None if the pool
+    is empty.
+    '''
+    with transaction.atomic():
+        pooled = (PooledKey.objects.select_for_update(skip_locked=True)
+                  .select_related('key').filter(bits=bits).order_by('id').first())
+        if not pooled:
+            return None
+        key = pooled.key
+        pooled.delete()
+    return key
+
+
+def key_pool_depth():
+    '''
+    Number of keys in the pool for each key size, { bits: n }
+    '''
+    depth = PooledKey.objects.values('bits').annotate(n=models.Count('id'))
+    return {d['bits']: d['n'] for d in depth}
+
+
+class Job(models.Model):
+    '''
+    Work of an auth in the async chain. Each auth does its part, starts
+    the job of the next auth and returns. The last auth sends the result
+    to the job of the first one, the origin.
+    '''
+    KINDS = (('key', 'key'), ('shuffle', 'shuffle'), ('decrypt', 'decrypt'))
+    STATUS = (('pending', 'pending'), ('running', 'running'),
+              ('forwarded', 'forwarded'), ('done', 'done'), ('error', 'error'))
+
+    id = models.CharField(max_length=32, primary_key=True, default=new_transfer)
+    voting_id = models.PositiveIntegerField()
+    position = models.PositiveIntegerField(default=0)
+    kind = models.CharField(max_length=8, choices=KINDS)
+    status = models.CharField(max_length=10, choices=STATUS, default='pending')
+    data = models.JSONField(default=dict)
+    # { "url": str, "job": str } of the first auth and of the next one
+    origin = models.JSONField(null=True)
+    next = models.JSONField(null=True)
+    result = models.JSONField(null=True)
+    error = models.TextField(blank=True, default='')
+    # secret of the origin job, only the auths of the chain can finish it
+    token = models.CharField(max_length=32, default=new_transfer)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+
+# entry point of each kind of job in the next auth
+JOB_PATHS = {
+    'key': '/',
+    'shuffle': '/shuffle/{}/',
+    'decrypt': '/decrypt/{}/',
+}
+
+_jobs = None
+
+
+def update_job(job_id, **fields):
+    Job.objects.filter(pk=job_id).update(updated=timezone.now(), **fields)
+
+
+def start_job(kind, mn, data, origin=None):
+    '''
+    Creates the job and runs it in a job thread, or here with
+    MIXNET_JOB_WORKERS = 0. Without origin this job is the origin.
+    '''
+    global _jobs
+    job = Job(voting_id=mn.voting_id, position=mn.auth_position, kind=kind, data=data)
+    job.origin = origin or { "url": settings.BASEURL, "job": job.id, "token": job.token }
+    job.save()
+
+    if not settings.MIXNET_JOB_WORKERS:
+        run_job(job.id)
+    else:
+        if _jobs is None:
+            _jobs = ThreadPoolExecutor(max_workers=settings.MIXNET_JOB_WORKERS)
+        _jobs.submit(run_job_thread, job.id)
+    return job
+
+
+def run_job_thread(job_id):
+    try:
+        run_job(job_id)
+    finally:
+        connections.close_all()
+
+
+def run_job(job_id):
+    job = Job.objects.get(pk=job_id)
+    update_job(job.id, status='running')
+
+    mn = None
+    try:
+        mn = get_mixnet(job.voting_id, job.position)
+        data = getattr(mn, '{}_job'.format(job.kind))(job.data)
+        next_auths = mn.next_auths()
+        # the parallel decrypt is done by the first auth
+        if not next_auths or job.data.get("parallel", False):
+            return push_result(mn, job, data)
+
+        # forwarded before the call, the result can arrive before it returns
+        update_job(job.id, status='forwarded')
+        data.update({ "async": True, "origin": job.origin })
+        resp = mn.chain_call(JOB_PATHS[job.kind].format(job.voting_id), data)
+        if not isinstance(resp, dict) or not resp.get("job"):
+            raise ValueError("The next auth didn't start the job")
+        update_job(job.id, next={ "url": next_auths[0].url, "job": resp["job"] })
+        # the origin waits for the result, the other auths are done
+        if job.origin["job"] != job.id:
+            update_job(job.id, status='done')
+    except Exception as e:
+        push_result(mn, job, error=str(e) or e.__class__.__name__)
+
+
+def push_result(mn, job, result=None, error=None):
+    '''
+    Sends the result of the chain to the origin job, with the msgs of a
+    transfer stored in the origin auth. If it can't be sent this job is
+    marked as error and the exception is raised.
+    '''
+    origin = job.origin
+    if origin["job"] == job.id:
+        return finish_job(job.id, result, error)
+
+    try:
+        if result and result.get("transfer"):
+            result["transfer"] = mn.upload_transfer(result["transfer"], int(result["size"]),
+                                                    origin["url"])
+        response = mods.post('mixnet', entry_point='/job/{}/'.format(origin["job"]),
+                             baseurl=origin["url"], response=True,
+                             json={ "result": result, "error": error, "token": origin["token"] })
+        if response.status_code != 200:
+            raise ValueError("The origin job didn't take the result: {}".format(response.status_code))
+    except Exception as e:
+        update_job(job.id, status='error', error=str(e) or e.__class__.__name__)
+        raise
+    update_job(job.id, status='error' if error else 'done', error=error or '')
+
+
+def finish_job(job_id, result=None, error=None):
+    '''
+    Stores the result of the chain in the origin job. The result of a key
+    job is the pubkey, { "p": int, "g": int, "y": int }, and it's saved as
+    the pubkey of the mixnet.
+    '''
+    job = Job.objects.get(pk=job_id)
+    if job.kind == 'key' and result and not error:
+        pubkey = Key(p=int(result["key"]["p"]), g=int(result["key"]["g"]), y=int(result["y"]))
+        pubkey.save()
+        mn = Mixnet.objects.get(voting_id=job.voting_id, auth_position=job.position)
+        mn.pubkey = pubkey
+        mn.save()
+        result = { "p": pubkey.p, "g": pubkey.g, "y": pubkey.y }
+
+    update_job(job.id, status='error' if error else 'done', result=result, error=error or '')
+
+
+@lru_cache(maxsize=128)
+def key_crypt(p, g, y, x):
+    '''
+    MixCrypt for a key, built and validated once per process. It's cached
+    by the numbers of the key, so a key changed in the database, by any
+    process, gets a new one.
+    '''
+    return MixCrypt.from_key(p, g, y, x, bits=B, subgroup=S)
+
+
+def get_mixnet(voting_id, position=0):
+    '''
+    Mixnet for this voting and auth position, with its keys and auths
+    already loaded. The row is read on each call, only its MixCrypt is
+    cached (see key_crypt), so the changes of other processes, like the
+    factors_pubkey of genfactors, are seen at once and each thread has its
+    own instance.
+
+    Raises Mixnet.DoesNotExist if there's no mixnet.
+    '''
+    mn = (Mixnet.objects.select_related('key', 'pubkey', 'factors_pubkey')
+          .prefetch_related('auths'))
+    return mn.get(voting_id=voting_id, auth_position=position)
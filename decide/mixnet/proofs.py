@@ -0,0 +1,177 @@
+'''
+Zero knowledge proofs of the ballots of the homomorphic votings.
+
+A ballot has a cipher (a, b) = (g^r, y^r g^m) for each option. It proves
+that each m is 0 or 1, with a disjunctive Chaum-Pedersen proof, and that
+the m add up to 1, with a Chaum-Pedersen proof on the product of the
+ciphers, so a ballot adds one vote to one option and nothing else to the
+tally. The challenges are sha256 hashes (Fiat-Shamir) of the key, the
+ciphers and the commitments, computed in the same way by the booth, see
+booth/static/crypto/elgamal.js. The exponents are reduced modulo p - 1.
+
+>>> p, g, y = 2039, 7, 1562
+>>> ballot = encrypt_ballot(1, 3, p, g, y)
+>>> ciphers = verify_ballot(ballot, p, g, y)
+>>> len(ciphers)
+3
+>>> ballot["options"][0]["proof"][0] += 1
+>>> verify_ballot(ballot, p, g, y)
+Traceback (most recent call last):
+    ...
+ValueError: Wrong proof of option 0
+'''
+
+import hashlib
+
+from Crypto.Random import random
+
+from . import mixcrypt
+
+
+# bits of the challenges
+CHALLENGE_BITS = 256
+
+
+def challenge(*values):
+    '''
+    Fiat-Shamir challenge of the values, the sha256 of their decimal
+    representation separated by commas
+    '''
+    text = ','.join(str(int(v)) for v in values)
+    return int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest(), 'big')
+
+
+def powmod(b, e, p):
+    '''
+    b^e mod p, e can be negative
+    '''
+    if e < 0:
+        b, e = int(mixcrypt.backend.invert(b, p)), -e
+    return int(mixcrypt.backend.powmod(b, e, p))
+
+
+def randint(n, rng=None):
+    '''
+    Random number in [0, n)
+    '''
+    return mixcrypt.backend.randint(0, n - 1, rng or random.StrongRandom())
+
+
+def prove_bit(cipher, m, r, p, g, y, rng=None):
+    '''
+    Proof that cipher = (g^r, y^r g^m) with m 0 or 1, [c0, c1, s0, s1]
+    '''
+    a, b = cipher
+    n = p - 1
+    bs = [b, b * powmod(g, -1, p) % p]
+    c, s, A, B = [0, 0], [0, 0], [0, 0], [0, 0]
+
+    # the other branch is simulated with its challenge chosen first
+    j = 1 - m
+    c[j] = randint(1 << CHALLENGE_BITS, rng)
+    s[j] = randint(n, rng)
+    A[j] = powmod(g, s[j], p) * powmod(a, -c[j], p) % p
+    B[j] = powmod(y, s[j], p) * powmod(bs[j], -c[j], p) % p
+
+    w = randint(n, rng)
+    A[m], B[m] = powmod(g, w, p), powmod(y, w, p)
+    h = challenge(p, g, y, a, b, A[0], B[0], A[1], B[1])
+    c[m] = (h - c[j]) % (1 << CHALLENGE_BITS)
+    s[m] = (w + c[m] * r) % n
+    return [c[0], c[1], s[0], s[1]]
+
+
+def verify_bit(cipher, proof, p, g, y):
+    a, b = cipher
+    c0, c1, s0, s1 = proof
+    bs = [b, b * powmod(g, -1, p) % p]
+    A = [mixcrypt.multi_pow([g, a], [s, -c], p) for c, s in ((c0, s0), (c1, s1))]
+    B = [mixcrypt.multi_pow([y, b1], [s, -c], p)
+         for b1, c, s in zip(bs, (c0, c1), (s0, s1))]
+    h = challenge(p, g, y, a, b, A[0], B[0], A[1], B[1])
+    return (c0 + c1) % (1 << CHALLENGE_BITS) == h
+
+
+def prove_sum(ciphers, rs, p, g, y, rng=None):
+    '''
+    Proof that the product of the ciphers is (g^R, y^R g), [c, s]
+    '''
+    a, b = combine(ciphers, p)
+    n = p - 1
+    w = randint(n, rng)
+    c = challenge(p, g, y, a, b, powmod(g, w, p), powmod(y, w, p))
+    return [c, (w + c * sum(rs)) % n]
+
+
+def verify_sum(ciphers, proof, p, g, y):
+    a, b = combine(ciphers, p)
+    c, s = proof
+    b1 = b * powmod(g, -1, p) % p
+    t1 = mixcrypt.multi_pow([g, a], [s, -c], p)
+    t2 = mixcrypt.multi_pow([y, b1], [s, -c], p)
+    return c == challenge(p, g, y, a, b, t1, t2)
+
+
+def combine(ciphers, p):
+    a, b = 1, 1
+    for a1, b1 in ciphers:
+        a, b = a * a1 % p, b * b1 % p
+    return a, b
+
+
+def encrypt_ballot(choice, n, p, g, y, rng=None):
+    '''
+    Ballot for the option choice of n options, with its proofs, as it's
+    sent to the store:
+
+        { "options": [ { "a": int, "b": int, "proof": [int] } ], "proof": [int] }
+    '''
+    p, g, y = int(p), int(g), int(y)
+    options, ciphers, rs = [], [], []
+    for i in range(n):
+        m = 1 if i == choice else 0
+        r = randint(p - 1, rng)
+        a, b = powmod(g, r, p), powmod(y, r, p) * powmod(g, m, p) % p
+        options.append({ "a": a, "b": b, "proof": prove_bit((a, b), m, r, p, g, y, rng) })
+        ciphers.append((a, b))
+        rs.append(r)
+    return { "options": options, "proof": prove_sum(ciphers, rs, p, g, y, rng) }
+
+
+def number(v):
+    '''
+    The int of v, an int or a decimal string, raises ValueError if it isn't
+    a non negative integer
+    '''
+    if isinstance(v, bool) or not isinstance(v, (int, str)):
+        raise ValueError('Not a number')
+    v = int(v)
+    if v < 0:
+        raise ValueError('Not a number')
+    return v
+
+
+def verify_ballot(ballot, p, g, y):
+    '''
+    The ciphers of the options of the ballot, [ (a, b) ], raises ValueError
+    if the ballot isn't well formed or a proof is wrong
+    '''
+    p, g, y = int(p), int(g), int(y)
+    try:
+        options, proof = ballot["options"], ballot["proof"]
+        ciphers = [(number(o["a"]), number(o["b"])) for o in options]
+        proofs = [[number(v) for v in o["proof"]] for o in options]
+        proof = [number(v) for v in proof]
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Wrong ballot')
+
+    if not ciphers or len(proof) != 2 or any(len(pr) != 4 for pr in proofs):
+        raise ValueError('Wrong ballot')
+    if any(not (0 < v < p) for c in ciphers for v in c):
+        raise ValueError('Wrong ballot')
+    for i, (cipher, pr) in enumerate(zip(ciphers, proofs)):
+        if not verify_bit(cipher, pr, p, g, y):
+            raise ValueError('Wrong proof of option {}'.format(i))
+    if not verify_sum(ciphers, proof, p, g, y):
+        raise ValueError('Wrong proof of the sum')
+    return ciphers
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from .models import Mixnet
+from .models import Mixnet, Job
 from base.serializers import AuthSerializer, KeySerializer
 
 
@@ -11,3 +11,10 @@ class MixnetSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Mixnet
         fields = ('voting_id', 'auths', 'pubkey')
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = ('id', 'voting_id', 'position', 'kind', 'status', 'result',
+                  'error', 'next', 'created', 'updated')
@@ -1,12 +1,49 @@
-from django.test import TestCase
+import os
+import tempfile
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.test import TestCase, override_settings
 from django.conf import settings
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
 from rest_framework.test import APIClient
 from rest_framework.test import APITestCase
 
 from mixnet.mixcrypt import MixCrypt
 from mixnet.mixcrypt import ElGamal
+from mixnet.mixcrypt import FixedBase
+from mixnet.mixcrypt import RandomStream
+from mixnet.mixcrypt import batch_inverse
+from mixnet.mixcrypt import fixed_base
+from mixnet.mixcrypt import multiple_decrypt_shuffle
+from mixnet.mixcrypt import rand
+from mixnet.mixcrypt import elgamal_combine
+from mixnet.mixcrypt import multi_pow
+from mixnet.mixcrypt import BACKENDS
+from mixnet.mixcrypt import elgamal_encrypt
+from mixnet.mixcrypt import set_backend
+from mixnet import mixcrypt
+from mixnet.mixcrypt import EXP_BITS
+from mixnet.mixcrypt import decode
+from mixnet.mixcrypt import encode
+from mixnet.mixcrypt import gen_multiple_key
+from mixnet.mixcrypt import multiple_decrypt_shuffle2
+from mixnet.groups import get_group
+from mixnet import dlog
+from mixnet import proofs
+from mixnet.proofs import encrypt_ballot
+from mixnet.batch import CiphertextBatch
 
+from base import binary
 from base import mods
+from mixnet.models import Job, Mixnet, PipelineStage, PooledKey, TransferMsg
+from mixnet.models import get_mixnet, key_crypt, fill_key_pool, push_result, read_transfer, store_transfer
+from mixnet.models import Key
+from voting.models import Question, Voting
 
 
 class MixnetCase(APITestCase):
@@ -14,6 +51,7 @@ class MixnetCase(APITestCase):
     def setUp(self):
         self.client = APIClient()
         mods.mock_query(self.client)
+        key_crypt.cache_clear()
 
     def tearDown(self):
         self.client = None
@@ -26,6 +64,13 @@ class MixnetCase(APITestCase):
         cipher = [k.encrypt(i) for i in msgs]
         return cipher
 
+    def gen_voting(self, pk, key, end_date=None):
+        q = Question(desc='question')
+        q.save()
+        pub_key = Key(p=key["p"], g=key["g"], y=key["y"])
+        pub_key.save()
+        Voting(pk=pk, name='voting', question=q, pub_key=pub_key, end_date=end_date).save()
+
     def test_create(self):
         data = {
             "voting": 1,
@@ -79,6 +124,29 @@ class MixnetCase(APITestCase):
 
         self.assertNotEqual(shuffled, encrypt)
 
+    def test_shuffle_binary(self):
+        self.test_create()
+
+        clear = [2, 3, 4, 5]
+        pk = self.key["p"], self.key["g"], self.key["y"]
+        encrypt = self.encrypt_msgs(clear, pk)
+        data = binary.dumps({ "msgs": encrypt })
+
+        response = self.client.post('/mixnet/shuffle/1/', data,
+                                    content_type=binary.MEDIA_TYPE,
+                                    HTTP_ACCEPT=binary.MEDIA_TYPE)
+        self.assertEqual(response.status_code, 200)
+
+        shuffled = binary.loads(response.content)
+        self.assertEqual(len(shuffled), len(encrypt))
+        self.assertNotEqual(shuffled, encrypt)
+
+        data = binary.dumps({ "msgs": shuffled, "force-last": True })
+        response = self.client.post('/mixnet/decrypt/1/', data,
+                                    content_type=binary.MEDIA_TYPE)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.json()), clear)
+
     def test_decrypt(self):
         self.test_create()
 
@@ -158,6 +226,158 @@ class MixnetCase(APITestCase):
         self.assertNotEqual(clear, clear2)
         self.assertEqual(sorted(clear), sorted(clear2))
 
+    def test_shuffle_factors(self):
+        self.test_create()
+        mn = Mixnet.objects.get(voting_id=1)
+        # no voting, no pubkey for the factors yet
+        call_command('genfactors', voting=1, size=5, stdout=StringIO())
+        self.assertEqual(mn.factors.count(), 0)
+        self.gen_voting(1, self.key)
+        call_command('genfactors', voting=1, size=5, stdout=StringIO())
+        self.assertEqual(mn.factors.count(), 5)
+
+        clear = [2, 3, 4]
+        pk = self.key["p"], self.key["g"], self.key["y"]
+        encrypt = self.encrypt_msgs(clear, pk)
+        data = { "msgs": encrypt }
+        response = self.client.post('/mixnet/shuffle/1/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mn.factors.count(), 2)
+
+        data = { "msgs": response.json() }
+        response = self.client.post('/mixnet/decrypt/1/', data, format='json')
+        self.assertEqual(sorted(response.json()), clear)
+
+    def test_shuffle_factors_multiple_auths(self):
+        data = { "voting": 1, "auths": [ { "name": "auth1", "url": "http://localhost:8000" } ] }
+        key1 = self.client.post('/mixnet/', data, format='json').json()
+        data = {
+            "voting": 2,
+            "auths": [ { "name": "auth2", "url": "http://localhost:8000" }],
+            "key": {"p": key1["p"], "g": key1["g"]}
+        }
+        key2 = self.client.post('/mixnet/', data, format='json').json()
+        p, g = key1["p"], key1["g"]
+        key = { "p": p, "g": g, "y": (key1["y"] * key2["y"]) % p }
+
+        # the second auth takes the voting pubkey from the voting module
+        self.gen_voting(2, key)
+        self.gen_voting(1, key1, end_date=timezone.now())
+        mn2 = Mixnet.objects.get(voting_id=2)
+        call_command('genfactors', size=5, stdout=StringIO())
+        self.assertEqual(mn2.factors.count(), 5)
+        # a stopped voting doesn't need them
+        self.assertEqual(Mixnet.objects.get(voting_id=1).factors.count(), 0)
+        mn2.refresh_from_db()
+        self.assertEqual(mn2.factors_key().y, key["y"])
+
+        clear = [2, 3, 4]
+        encrypt = self.encrypt_msgs(clear, (p, g, key["y"]))
+        data = { "msgs": encrypt, "pk": key }
+        response = self.client.post('/mixnet/shuffle/2/', data, format='json')
+        self.assertEqual(mn2.factors.count(), 2)
+
+        data = { "msgs": response.json(), "pk": key, "force-last": False }
+        clear1 = self.client.post('/mixnet/decrypt/1/', data, format='json').json()
+        data = { "msgs": clear1, "pk": key }
+        clear2 = self.client.post('/mixnet/decrypt/2/', data, format='json').json()
+        self.assertEqual(sorted(clear2), clear)
+
+        with self.assertRaises(CommandError):
+            call_command('genfactors', voting=2, stdout=StringIO())
+
+    def test_mixnet_cache(self):
+        self.test_create()
+        mn = get_mixnet(1)
+        # the key is only constructed, no other one is generated
+        with mock.patch.object(MixCrypt, 'getk') as getk, \
+             mock.patch.object(MixCrypt, 'genk') as genk:
+            self.assertEqual(int(mn.crypt().k.y), mn.key.y)
+        self.assertFalse(getk.called or genk.called)
+        # the row is read again, the key is built once
+        with mock.patch.object(MixCrypt, 'from_key') as from_key:
+            mn2 = get_mixnet(1)
+            self.assertIsNot(mn2, mn)
+            self.assertIs(mn2.crypt(), mn.crypt())
+        self.assertFalse(from_key.called)
+        with self.assertNumQueries(0):
+            self.assertEqual(mn.next_auths(), [])
+
+        # changed without signals, like in another process
+        factors = Key(p=mn.key.p, g=mn.key.g, y=2)
+        factors.save()
+        Mixnet.objects.filter(pk=mn.pk).update(factors_pubkey=factors)
+        self.assertEqual(get_mixnet(1).factors_key().y, 2)
+        p, g, x = int(mn.key.p), int(mn.key.g), int(mn.key.x) + 1
+        Key.objects.filter(pk=mn.key.pk).update(x=x, y=pow(g, x, p))
+        self.assertEqual(int(get_mixnet(1).crypt().k.x), x)
+
+        with self.assertRaises(Mixnet.DoesNotExist):
+            get_mixnet(2)
+
+    def test_key_pool(self):
+        bits = settings.KEYBITS
+        fill_key_pool(bits, 1)
+        pooled = PooledKey.objects.get().key
+
+        response = self.client.get('/mixnet/keypool/')
+        self.assertEqual(response.json(), {str(bits): 1})
+
+        out = StringIO()
+        call_command('genkeys', size=1, stdout=out)
+        self.assertEqual(PooledKey.objects.count(), 1)
+
+        self.test_create()
+        self.assertEqual(self.key["p"], pooled.p)
+        self.assertEqual(Mixnet.objects.get().key, pooled)
+
+        response = self.client.get('/mixnet/keypool/')
+        self.assertEqual(response.json(), {})
+
+    @override_settings(KEYBITS=2048)
+    def test_create_group(self):
+        p, g = get_group('ffdhe2048')
+        data = {
+            "voting": 1,
+            "group": "ffdhe2048",
+            "auths": [
+                { "name": "auth1", "url": "http://localhost:8000" }
+            ]
+        }
+
+        response = self.client.post('/mixnet/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        key = response.json()
+        self.assertEqual((key["p"], key["g"]), (p, g))
+
+        clear = [2, 3, 4]
+        encrypt = self.encrypt_msgs(clear, (key["p"], key["g"], key["y"]))
+        data = { "msgs": encrypt }
+        response = self.client.post('/mixnet/decrypt/1/', data, format='json')
+        self.assertEqual(sorted(response.json()), clear)
+
+        data = {
+            "voting": 2,
+            "group": "unknown",
+            "auths": [
+                { "name": "auth1", "url": "http://localhost:8000" }
+            ]
+        }
+        response = self.client.post('/mixnet/', data, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        # a group of another size than KEYBITS
+        data["group"] = "modp1536"
+        response = self.client.post('/mixnet/', data, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        app = apps.get_app_config('mixnet')
+        with self.settings(MIXNET_GROUP='modp1536'):
+            with self.assertRaises(ImproperlyConfigured):
+                app.ready()
+        with self.settings(MIXNET_GROUP='ffdhe2048'):
+            app.ready()
+
     def test_multiple_auths_mock(self):
         '''
         This test emulates a two authorities shuffle and decryption.
@@ -188,3 +408,638 @@ class MixnetCase(APITestCase):
 
         self.assertNotEqual(clear, clear1)
         self.assertEqual(sorted(clear), sorted(clear1))
+
+
+    @override_settings(CHUNK_SIZE=4)
+    def test_multiple_auths_chunks(self):
+        '''
+        Same as test_multiple_auths_mock, sending the msgs in chunks
+        '''
+
+        data = {
+            "voting": 1,
+            "auths": [
+                { "name": "auth1", "url": "http://localhost:8000" },
+                { "name": "auth2", "url": "http://127.0.0.1:8000" },
+            ]
+        }
+        response = self.client.post('/mixnet/', data, format='json')
+        key = response.json()
+        pk = key["p"], key["g"], key["y"]
+
+        clear = [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14]
+        encrypt = self.encrypt_msgs(clear, pk)
+        mods.post_chunks('mixnet', '/chunk/1/', encrypt, 'votes')
+
+        data = { "transfer": "votes", "size": len(encrypt), "pk": key }
+        response = self.client.post('/mixnet/shuffle/1/', data, format='json')
+        transfer = response.json()["transfer"]
+        self.assertFalse(TransferMsg.objects.filter(transfer='votes').exists())
+
+        data = { "transfer": transfer, "size": len(encrypt), "pk": key, "shuffled": True }
+        response = self.client.post('/mixnet/decrypt/1/', data, format='json')
+        transfer = response.json()["transfer"]
+
+        clear1 = []
+        for chunk in mods.get_chunks('mixnet', '/chunk/1/', transfer, len(encrypt)):
+            self.assertLessEqual(len(chunk), 4)
+            clear1.extend(chunk)
+        self.assertNotEqual(clear, clear1)
+        self.assertEqual(sorted(clear), sorted(clear1))
+
+        # the transfer is only reached through its voting
+        response = self.client.get('/mixnet/chunk/2/?transfer={}'.format(transfer))
+        self.assertEqual(response.json(), [])
+        data = { "transfer": transfer, "offset": len(encrypt), "msgs": encrypt[:1] }
+        response = self.client.post('/mixnet/chunk/2/', data, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.client.delete('/mixnet/chunk/2/?transfer={}'.format(transfer))
+        self.assertEqual(TransferMsg.objects.filter(transfer=transfer).count(), len(encrypt))
+
+        self.client.delete('/mixnet/chunk/1/?transfer={}'.format(transfer))
+        self.assertFalse(TransferMsg.objects.exists())
+
+        data = { "transfer": "x" * 33, "msgs": encrypt[:4] }
+        response = self.client.post('/mixnet/chunk/1/', data, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_read_transfer(self):
+        store_transfer(1, 't', 0, list(range(1200)))
+        self.assertEqual(read_transfer(1, 't', range(10, 20)), list(range(10, 20)))
+
+        self.assertEqual(read_transfer(1, 't', range(19, 9, -1)), list(range(19, 9, -1)))
+
+        # sparse indexes are read in groups below the variables limit
+        perm = list(reversed(range(0, 1200, 2)))
+        with self.assertNumQueries(2):
+            self.assertEqual(read_transfer(1, 't', perm), perm)
+
+        with self.assertRaises(KeyError):
+            read_transfer(2, 't', range(10))
+
+
+    @override_settings(CHUNK_SIZE=3, MIXNET_PIPELINE_SENDERS=0)
+    def test_multiple_auths_pipeline(self):
+        '''
+        Pipelined shuffle with three auths, each chunk is reencrypted when
+        it arrives and each auth permutes all the msgs
+        '''
+
+        data = {
+            "voting": 1,
+            "auths": [
+                { "name": "auth1", "url": "http://localhost:8000" },
+                { "name": "auth2", "url": "http://127.0.0.1:8000" },
+                { "name": "auth3", "url": "http://127.0.0.2:8000" },
+            ]
+        }
+        response = self.client.post('/mixnet/', data, format='json')
+        key = response.json()
+        pk = key["p"], key["g"], key["y"]
+
+        clear = list(range(2, 15))
+        encrypt = self.encrypt_msgs(clear, pk)
+        info = { "size": len(encrypt), "pk": key }
+        mods.post_chunks('mixnet', '/chunk/1/', encrypt, 'votes', fields={"pipeline": info})
+
+        data = { "transfer": "votes", "size": len(encrypt), "pk": key, "pipeline": True }
+        response = self.client.post('/mixnet/shuffle/1/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        transfer = response.json()["transfer"]
+        self.assertFalse(PipelineStage.objects.exists())
+
+        data = { "transfer": transfer, "size": len(encrypt), "pk": key, "shuffled": True }
+        response = self.client.post('/mixnet/decrypt/1/', data, format='json')
+        transfer = response.json()["transfer"]
+
+        clear1 = []
+        for chunk in mods.get_chunks('mixnet', '/chunk/1/', transfer, len(encrypt)):
+            clear1.extend(chunk)
+        self.assertEqual(sorted(clear), sorted(clear1))
+
+
+    @override_settings(CHUNK_SIZE=3, MIXNET_PIPELINE_SENDERS=0)
+    def test_pipeline_errors(self):
+        data = {
+            "voting": 1,
+            "auths": [
+                { "name": "auth1", "url": "http://localhost:8000" },
+                { "name": "auth2", "url": "http://127.0.0.1:8000" },
+            ]
+        }
+        response = self.client.post('/mixnet/', data, format='json')
+        key = response.json()
+        pk = key["p"], key["g"], key["y"]
+        encrypt = self.encrypt_msgs(list(range(2, 15)), pk)
+
+        # the pk is required and the chunk must be in the batch
+        for info, offset in [({ "size": 6 }, 0),
+                             ({ "size": 6, "pk": key }, 4)]:
+            data = { "transfer": "votes", "offset": offset, "msgs": encrypt[:3],
+                     "pipeline": info }
+            response = self.client.post('/mixnet/chunk/1/', data, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(TransferMsg.objects.exists())
+
+        # the next auth doesn't take the chunks
+        info = { "size": 6, "pk": key }
+        for offset in (0, 3):
+            data = { "transfer": "votes", "offset": offset, "msgs": encrypt[offset:offset + 3],
+                     "pipeline": info }
+            response = self.client.post('/mixnet/chunk/1/', data, format='json')
+            self.assertEqual(response.status_code, 200)
+
+        failed = mock.Mock(status_code=500)
+        with mock.patch('mixnet.models.mods.post', return_value=failed):
+            data = { "transfer": "votes", "size": 6, "pk": key, "pipeline": True }
+            response = self.client.post('/mixnet/shuffle/1/', data, format='json')
+        self.assertEqual(response.status_code, 502)
+        self.assertFalse(PipelineStage.objects.exists())
+        self.assertFalse(TransferMsg.objects.exists())
+
+    @override_settings(CHUNK_SIZE=3, MIXNET_PIPELINE_SENDERS=0)
+    def test_pipeline_permutation(self):
+        '''
+        A single auth moves the msgs across the chunks, reading them in the
+        order of a permutation of the whole batch
+        '''
+
+        data = { "voting": 1, "auths": [{ "name": "auth1", "url": "http://localhost:8000" }] }
+        key = self.client.post('/mixnet/', data, format='json').json()
+        pk = key["p"], key["g"], key["y"]
+        encrypt = self.encrypt_msgs(list(range(2, 14)), pk)
+
+        info = { "size": len(encrypt), "pk": key }
+        reverse = lambda n, rng=None: list(reversed(range(n)))
+        with mock.patch('mixnet.mixcrypt.MixCrypt.gen_perm', side_effect=reverse):
+            mods.post_chunks('mixnet', '/chunk/1/', encrypt, 'votes', fields={"pipeline": info})
+            data = { "transfer": "votes", "size": len(encrypt), "pk": key, "pipeline": True }
+            response = self.client.post('/mixnet/shuffle/1/', data, format='json')
+        transfer = response.json()["transfer"]
+
+        data = { "transfer": transfer, "size": len(encrypt), "pk": key, "shuffled": True }
+        transfer = self.client.post('/mixnet/decrypt/1/', data, format='json').json()["transfer"]
+        clear = []
+        for chunk in mods.get_chunks('mixnet', '/chunk/1/', transfer, len(encrypt)):
+            clear.extend(chunk)
+        # each chunk is reversed when it's reencrypted, and then the batch
+        self.assertEqual(clear, [11, 12, 13, 8, 9, 10, 5, 6, 7, 2, 3, 4])
+
+    @override_settings(CHUNK_SIZE=4, MIXNET_JOB_WORKERS=0)
+    def test_multiple_auths_async(self):
+        '''
+        Async chain with three auths, each call returns a job and the last
+        auth sends the result to the job of the first one
+        '''
+
+        data = {
+            "voting": 1,
+            "auths": [
+                { "name": "auth1", "url": "http://localhost:8000" },
+                { "name": "auth2", "url": "http://127.0.0.1:8000" },
+                { "name": "auth3", "url": "http://127.0.0.2:8000" },
+            ],
+            "async": True,
+        }
+        response = self.client.post('/mixnet/', data, format='json')
+        self.assertEqual(response.status_code, 202)
+        job = self.client.get('/mixnet/job/{}/'.format(response.json()["job"])).json()
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(Job.objects.filter(kind='key', status='done').count(), 3)
+        self.assertIsNotNone(job["next"])
+
+        key = job["result"]
+        mn = Mixnet.objects.get(voting_id=1, auth_position=0)
+        self.assertEqual(key["y"], mn.pubkey.y)
+        keys = [m.key for m in Mixnet.objects.filter(voting_id=1)]
+        self.assertEqual(len(keys), 3)
+        self.assertEqual(key["y"], keys[0].y * keys[1].y * keys[2].y % key["p"])
+        pk = key["p"], key["g"], key["y"]
+
+        clear = list(range(2, 13))
+        encrypt = self.encrypt_msgs(clear, pk)
+        data = { "msgs": encrypt, "pk": key, "async": True }
+        response = self.client.post('/mixnet/shuffle/1/', data, format='json')
+        job = self.client.get('/mixnet/job/{}/'.format(response.json()["job"])).json()
+        self.assertEqual(job["status"], "done")
+        shuffled = job["result"]["msgs"]
+        self.assertEqual(len(shuffled), len(encrypt))
+
+        mods.post_chunks('mixnet', '/chunk/1/', shuffled, 'votes')
+        data = { "transfer": "votes", "size": len(shuffled), "pk": key,
+                 "shuffled": True, "async": True }
+        response = self.client.post('/mixnet/decrypt/1/', data, format='json')
+        job = self.client.get('/mixnet/job/{}/'.format(response.json()["job"])).json()
+        self.assertEqual(job["status"], "done")
+        transfer = job["result"]["transfer"]
+
+        clear1 = []
+        for chunk in mods.get_chunks('mixnet', '/chunk/1/', transfer, len(encrypt)):
+            clear1.extend(chunk)
+        self.assertEqual(sorted(clear), sorted(clear1))
+        self.assertEqual(TransferMsg.objects.exclude(transfer=transfer).count(), 0)
+
+        # an error in any auth ends the job of the first one
+        data = { "transfer": "missing", "size": 3, "async": True }
+        response = self.client.post('/mixnet/decrypt/1/', data, format='json')
+        job = self.client.get('/mixnet/job/{}/'.format(response.json()["job"])).json()
+        self.assertEqual(job["status"], "error")
+
+        # only the auths of the chain have the token to finish the job
+        url = '/mixnet/job/{}/'.format(job["id"])
+        for data in [{ "result": {} }, { "result": {}, "token": "x" * 32 }]:
+            response = self.client.post(url, data, format='json')
+            self.assertEqual(response.status_code, 403)
+
+        # the job of an auth fails if its result can't reach the first one
+        job = Job(voting_id=1, position=2, kind='decrypt',
+                  origin={ "url": "http://localhost:8000", "job": "missing", "token": "x" })
+        job.save()
+        with self.assertRaises(ValueError):
+            push_result(None, job, { "msgs": [] })
+        job.refresh_from_db()
+        self.assertEqual(job.status, "error")
+
+
+    @override_settings(CHUNK_SIZE=4, MIXNET_FANOUT_THREADS=0)
+    def test_multiple_auths_parallel_decrypt(self):
+        '''
+        The first auth decrypts with the partial decryptions of the three
+        auths
+        '''
+
+        data = {
+            "voting": 1,
+            "auths": [
+                { "name": "auth1", "url": "http://localhost:8000" },
+                { "name": "auth2", "url": "http://127.0.0.1:8000" },
+                { "name": "auth3", "url": "http://127.0.0.2:8000" },
+            ]
+        }
+        response = self.client.post('/mixnet/', data, format='json')
+        key = response.json()
+        pk = key["p"], key["g"], key["y"]
+
+        clear = list(range(2, 13))
+        encrypt = self.encrypt_msgs(clear, pk)
+        data = { "msgs": encrypt, "pk": key }
+        response = self.client.post('/mixnet/shuffle/1/', data, format='json')
+        shuffled = response.json()
+
+        data = { "msgs": shuffled, "pk": key, "shuffled": True, "parallel": True }
+        response = self.client.post('/mixnet/decrypt/1/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        clear1 = response.json()
+        self.assertEqual(sorted(clear), sorted(clear1))
+
+        # without shuffled the first auth shuffles the msgs
+        data = { "msgs": encrypt, "pk": key, "parallel": True }
+        response = self.client.post('/mixnet/decrypt/1/', data, format='json')
+        self.assertEqual(sorted(clear), sorted(response.json()))
+
+        mods.post_chunks('mixnet', '/chunk/1/', shuffled, 'votes')
+        data = { "transfer": "votes", "size": len(shuffled), "pk": key,
+                 "shuffled": True, "parallel": True }
+        response = self.client.post('/mixnet/decrypt/1/', data, format='json')
+        transfer = response.json()["transfer"]
+        clear2 = []
+        for chunk in mods.get_chunks('mixnet', '/chunk/1/', transfer, len(shuffled)):
+            clear2.extend(chunk)
+        self.assertEqual(clear1, clear2)
+
+
+class MixCryptCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.k = MixCrypt(bits=settings.KEYBITS)
+
+    def test_fixed_base(self):
+        p, g = int(self.k.k.p), int(self.k.k.g)
+        fb = FixedBase(g, p)
+        for e in [0, 1, 2, p - 2, p - 1] + [rand(p) for i in range(20)]:
+            self.assertEqual(fb.pow(e), pow(g, e, p))
+        self.assertIs(fixed_base(g, p), fixed_base(g, p))
+
+    def test_encrypt_decrypt(self):
+        clear = [2, 3, 4, 5, 6]
+        cipher = [self.k.encrypt(i) for i in clear]
+        self.assertEqual([self.k.decrypt(c) for c in cipher], clear)
+
+        cipher2 = [self.k.reencrypt(c) for c in cipher]
+        self.assertNotEqual(cipher, cipher2)
+        self.assertEqual([self.k.decrypt(c) for c in cipher2], clear)
+
+    def test_shuffle_workers(self):
+        clear = list(range(2, 12))
+        cipher = [self.k.encrypt(i) for i in clear]
+        rs = [rand(self.k.k.p) for i in cipher]
+
+        serial = self.k.reencrypt_batch(cipher, rs)
+        parallel = self.k.reencrypt_batch(cipher, rs, workers=3)
+        self.assertEqual(serial, parallel)
+
+        shuffled = self.k.shuffle(cipher, workers=3)
+        self.assertEqual(len(shuffled), len(cipher))
+        self.assertEqual(sorted(self.k.decrypt(c) for c in shuffled), clear)
+
+        # one pool for all the calls
+        pool = mixcrypt.worker_pool(3)
+        self.assertIs(mixcrypt.worker_pool(2), pool)
+        self.k.reencrypt_batch(cipher, rs, workers=3)
+        self.assertIs(mixcrypt.worker_pool(3), pool)
+
+    def test_decrypt_workers(self):
+        clear = list(range(2, 12))
+        cipher = [self.k.encrypt(i) for i in clear]
+
+        self.assertEqual(self.k.multiple_decrypt(cipher, workers=3), clear)
+        partial = self.k.multiple_decrypt(cipher, last=False, workers=3)
+        self.assertEqual([a for a, b in partial], [a for a, b in cipher])
+
+        d = self.k.shuffle_decrypt(cipher, workers=3)
+        self.assertEqual(sorted(d), clear)
+
+    def test_gen_perm(self):
+        rng = RandomStream()
+        for n in [0, 1, 2, 10, 1000]:
+            self.assertEqual(sorted(self.k.gen_perm(n, rng)), list(range(n)))
+
+        clear = list(range(2, 12))
+        cipher = [self.k.encrypt(i) for i in clear]
+        self.assertEqual(multiple_decrypt_shuffle(cipher, self.k, shuffled=True), clear)
+        self.assertEqual(sorted(multiple_decrypt_shuffle(cipher, self.k)), clear)
+
+    def test_batch_decrypt(self):
+        p = int(self.k.k.p)
+        xs = [rand(p) for i in range(10)]
+        self.assertEqual(batch_inverse(xs, p), [pow(x, -1, p) for x in xs])
+        self.assertEqual(batch_inverse([], p), [])
+
+        clear = list(range(2, 12))
+        cipher = [self.k.encrypt(i) for i in clear]
+        self.assertEqual(self.k.batch_decrypt(cipher), [self.k.decrypt(c) for c in cipher])
+
+    def test_shuffle_factors(self):
+        pk = self.k.pubkey()
+        clear = list(range(2, 12))
+        cipher = [self.k.encrypt(i) for i in clear]
+
+        factors = self.k.gen_factors(4, pk)
+        self.assertEqual([self.k.decrypt(f) for f in factors], [1] * 4)
+
+        shuffled = self.k.shuffle(cipher, pk, factors=factors)
+        self.assertEqual(sorted(self.k.decrypt(c) for c in shuffled), clear)
+
+    def test_multi_pow(self):
+        p = int(self.k.k.p)
+        for n in [0, 1, 2, 5]:
+            bases = [rand(p) for i in range(n)]
+            exps = [rand(p) for i in range(n)]
+            expected = 1
+            for b, e in zip(bases, exps):
+                expected = (expected * pow(b, e, p)) % p
+            self.assertEqual(multi_pow(bases, exps, p), expected)
+
+        # the interleaved windows, from 4 bases and 1024 bits, with
+        # negative and zero exponents
+        p, g = get_group('modp2048')
+        for n in [4, 7]:
+            bases = [pow(g, rand(p), p) for i in range(n)]
+            exps = [rand(p) for i in range(n)]
+            exps[0], exps[-1] = -exps[0], 0
+            expected = 1
+            for b, e in zip(bases, exps):
+                expected = (expected * pow(b, e, p)) % p
+            self.assertEqual(multi_pow(bases, exps, p), expected)
+            self.assertEqual(multi_pow(bases, exps, p, window=3), expected)
+        p = int(self.k.k.p)
+
+        clear = [2, 3, 5, 7]
+        cipher = [self.k.encrypt(i) for i in clear]
+        self.assertEqual(self.k.decrypt(elgamal_combine(cipher, p)), 210)
+        c = elgamal_combine(cipher, p, [1, 2, 0, 3])
+        self.assertEqual(self.k.decrypt(c), (2 * 3**2 * 7**3) % p)
+
+    def test_subgroup(self):
+        p, g = self.k.k.p, self.k.k.g
+        k1 = MixCrypt(k=self.k.k, subgroup=True)
+        k2 = MixCrypt(k=self.k.k, subgroup=True)
+        self.assertLessEqual(int(k1.k.x).bit_length(), EXP_BITS)
+
+        q = (int(p) - 1) // 2
+        for m in range(1, 20):
+            e = encode(m, p)
+            self.assertEqual(pow(e, q, int(p)), 1)
+            self.assertEqual(decode(e, p), m)
+
+        k3 = gen_multiple_key(k1, k2)
+        pk = k3.pubkey()
+        clear = list(range(1, 12))
+        cipher = [k3.encrypt(i) for i in clear]
+        d = multiple_decrypt_shuffle2(cipher, k1, k2, pubkey=pk)
+        self.assertEqual(sorted(d), clear)
+
+        # votes that weren't encoded are decoded as they are
+        cipher = [self.k.encrypt(i, k1.k) for i in clear]
+        self.assertEqual(k1.multiple_decrypt(cipher), clear)
+
+
+class BackendCase(TestCase):
+    '''
+    Every arithmetic backend should give the same results
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.k = MixCrypt(bits=settings.KEYBITS)
+
+    def tearDown(self):
+        set_backend()
+
+    def results(self, name):
+        set_backend(name)
+        k = self.k
+        p, g, y = k.pubkey()
+        x = int(k.k.x)
+
+        cipher = [elgamal_encrypt(m, r, p, g, y) for m, r in zip(self.clear, self.rs)]
+        return {
+            'fixed_base': [FixedBase(g, p).pow(r) for r in self.rs],
+            'encrypt': cipher,
+            'reencrypt': k.reencrypt_batch(cipher, self.rs[::-1]),
+            'inverse': batch_inverse(self.rs, p),
+            'decrypt': k.batch_decrypt(cipher),
+            'decrypt1': [k.decrypt(c) for c in cipher],
+            'encode': [decode(encode(m, p), p) for m in self.clear],
+            'multiple_key': gen_multiple_key(k, k).pubkey(),
+        }
+
+    def test_parity(self):
+        p = int(self.k.k.p)
+        self.clear = list(range(1, 21))
+        self.rs = [rand(p) for i in self.clear]
+
+        expected = self.results('python')
+        self.assertEqual(expected['decrypt'], self.clear)
+        self.assertEqual(expected['decrypt1'], self.clear)
+        for name in BACKENDS:
+            self.assertEqual(self.results(name), expected, name)
+
+    @skipUnless('gmp' in BACKENDS, 'gmpy2 is not installed, only the python backend is tested')
+    def test_parity_gmp(self):
+        p = int(self.k.k.p)
+        self.clear = list(range(1, 21))
+        self.rs = [rand(p) for i in self.clear]
+        self.assertEqual(self.results('gmp'), self.results('python'))
+
+    def test_backends(self):
+        for name in BACKENDS:
+            set_backend(name)
+            self.assertEqual(mixcrypt.backend.name, name)
+            clear = list(range(2, 12))
+            cipher = [self.k.encrypt(i) for i in clear]
+            shuffled = self.k.shuffle(cipher, workers=2)
+            self.assertEqual(sorted(self.k.multiple_decrypt(shuffled, workers=2)), clear)
+
+        set_backend()
+        self.assertEqual(mixcrypt.backend.name, 'gmp' if 'gmp' in BACKENDS else 'python')
+
+
+class BatchCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.k = MixCrypt(bits=settings.KEYBITS)
+
+    def test_batch(self):
+        msgs = [[i, 1000 * i] for i in range(1, 11)]
+        batch = CiphertextBatch.from_list(msgs, width=4)
+        self.assertEqual(len(batch), 10)
+        self.assertEqual(batch.tolist(), msgs)
+        self.assertEqual(batch[-1], (10, 10000))
+        with self.assertRaises(IndexError):
+            batch[10]
+
+        # slices are views of the same buffer
+        part = batch[2:5]
+        self.assertEqual(part.tolist(), msgs[2:5])
+        self.assertEqual(part.buf.obj, batch.buf.obj)
+        self.assertEqual(batch[::3].tolist(), msgs[::3])
+        self.assertEqual(len(batch[8:2]), 0)
+
+        perm = [3, 1, 2, 0, 9, 8, 7, 6, 5, 4]
+        self.assertEqual(batch.permute(perm).tolist(), [msgs[i] for i in perm])
+
+        content = part.to_wire({ "pk": None })
+        self.assertEqual(binary.loads(content), { "pk": None, "msgs": msgs[2:5] })
+        part2, fields = CiphertextBatch.from_wire(content)
+        self.assertEqual(part2, part)
+        self.assertEqual(fields, { "pk": None })
+        self.assertEqual(binary.dumps(part), binary.dumps(msgs[2:5], bits=32))
+
+        with self.assertRaises(ValueError):
+            CiphertextBatch.from_wire(binary.dumps([1, 2, 3]))
+        with self.assertRaises(ValueError):
+            CiphertextBatch(b'12345', 4)
+
+    def test_mixcrypt(self):
+        clear = list(range(2, 12))
+        cipher = CiphertextBatch.from_list([self.k.encrypt(i) for i in clear])
+
+        shuffled = self.k.shuffle(cipher, workers=3)
+        self.assertIsInstance(shuffled, CiphertextBatch)
+        self.assertEqual(sorted(self.k.decrypt(c) for c in shuffled), clear)
+
+        partial = self.k.multiple_decrypt(shuffled, last=False)
+        self.assertIsInstance(partial, CiphertextBatch)
+        self.assertEqual([a for a, b in partial], [a for a, b in shuffled])
+
+        self.assertEqual(self.k.multiple_decrypt(shuffled, workers=3),
+                         [self.k.decrypt(c) for c in shuffled])
+        self.assertEqual(sorted(self.k.shuffle_decrypt(cipher)), clear)
+
+
+class DlogCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(MIXNET_DLOG_DIR=self.dir.name)
+        self.settings.enable()
+        dlog._tables.clear()
+
+    def tearDown(self):
+        dlog._tables.clear()
+        self.settings.disable()
+        self.dir.cleanup()
+
+    def test_dlog(self):
+        p, g = get_group('modp1536')
+        table = dlog.get_table(p, g, 1000)
+        self.assertIsNone(table.buf)
+        for c in [0, 1, 31, 32, 500, 999, 1000]:
+            h = pow(g, c, p)
+            self.assertEqual(table.dlog(h, 1000), c)
+            # decoded in the subgroup mode
+            self.assertEqual(table.dlog(p - h, 1000), c)
+        self.assertIsNone(table.dlog(pow(g, 1001, p), 1000))
+        self.assertEqual(len(os.listdir(self.dir.name)), 1)
+
+        # the stored table is mapped, and it's big enough for a smaller bound
+        dlog._tables.clear()
+        table2 = dlog.get_table(p, g, 500)
+        self.assertIsNotNone(table2.buf)
+        self.assertEqual(table2.m, table.m)
+        self.assertEqual(dlog.dlog(pow(g, 456, p), g, p, 500), 456)
+
+        # other groups have their own tables
+        p2, g2 = get_group('modp2048')
+        self.assertEqual(dlog.dlog(pow(g2, 77, p2), g2, p2, 100), 77)
+        self.assertEqual(len(os.listdir(self.dir.name)), 2)
+
+    def test_dlog_files(self):
+        p, g = get_group('modp1536')
+        prefix = dlog.group_digest(p, g).hex()[:16]
+        # other files of the group aren't tables
+        for name in ['{}-old.dlog', '{}-.dlog', '{}-9999.dlog']:
+            with open(os.path.join(self.dir.name, name.format(prefix)), 'wb') as f:
+                f.write(b'x')
+        self.assertEqual(dlog.dlog(pow(g, 321, p), g, p, 1000), 321)
+
+        # only the last TABLES tables are kept in memory
+        with mock.patch('mixnet.dlog.TABLES', 2):
+            for bound in (10 ** 5, 10 ** 6):
+                dlog.get_table(p, g, bound)
+            self.assertEqual(len(dlog._tables), 2)
+            self.assertEqual(len(os.listdir(self.dir.name)), 6)
+
+
+class ProofCase(TestCase):
+
+    def test_ballot(self):
+        k = MixCrypt(bits=settings.KEYBITS)
+        p, g, y = int(k.k.p), int(k.k.g), int(k.k.y)
+
+        ballot = encrypt_ballot(2, 4, p, g, y)
+        ciphers = proofs.verify_ballot(ballot, p, g, y)
+        self.assertEqual([k.decrypt(c) for c in ciphers], [1, 1, g, 1])
+
+        # a cipher of g^2 has no proof of 0 or 1
+        r = proofs.randint(p - 1)
+        cipher = (pow(g, r, p), pow(y, r, p) * pow(g, 2, p) % p)
+        for m in (0, 1):
+            proof = proofs.prove_bit(cipher, m, r, p, g, y)
+            self.assertFalse(proofs.verify_bit(cipher, proof, p, g, y))
+
+        # two votes in a ballot, each one a valid 0 or 1
+        ballot["options"][0] = encrypt_ballot(0, 4, p, g, y)["options"][0]
+        with self.assertRaisesRegex(ValueError, 'sum'):
+            proofs.verify_ballot(ballot, p, g, y)
+
+        # the proofs are bound to the key
+        ballot = encrypt_ballot(0, 2, p, g, y)
+        with self.assertRaises(ValueError):
+            proofs.verify_ballot(ballot, p, g, y * g % p)
@@ -6,7 +6,11 @@ router = routers.DefaultRouter()
 router.register(r'', views.MixnetViewSet)
 
 urlpatterns = [
+    path('keypool/', views.KeyPool.as_view(), name='keypool'),
+    path('job/<str:job_id>/', views.JobView.as_view(), name='job'),
     path('', include(router.urls)),
     path('shuffle/<int:voting_id>/', views.Shuffle.as_view(), name='shuffle'),
     path('decrypt/<int:voting_id>/', views.Decrypt.as_view(), name='decrypt'),
+    path('partial/<int:voting_id>/', views.Partial.as_view(), name='partial'),
+    path('chunk/<int:voting_id>/', views.Chunk.as_view(), name='chunk'),
 ]
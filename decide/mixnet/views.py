@@ -1,14 +1,43 @@
+import hmac
+
+import requests
+
 from django.conf import settings
+from django.http import Http404
 from django.shortcuts import get_object_or_404
-from rest_framework import viewsets
+from rest_framework import status, viewsets
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
-from .serializers import MixnetSerializer
-from .models import Auth, Mixnet, Key
+from .serializers import MixnetSerializer, JobSerializer
+from .batch import BatchParser
+from .groups import check_group
+from .models import Auth, Mixnet, Key, get_mixnet, key_pool_depth
+from .models import Job, start_job, finish_job
+from .models import TransferMsg, drop_transfer, store_transfer, stage_transfer, transfer_owned
+from base.binary import BinaryRenderer
 from base.serializers import KeySerializer, AuthSerializer
 
 
+# msgs can be sent and received in the binary format, see base.binary,
+# ciphers received in that format are a CiphertextBatch
+PARSERS = api_settings.DEFAULT_PARSER_CLASSES + [BatchParser]
+RENDERERS = api_settings.DEFAULT_RENDERER_CLASSES + [BinaryRenderer]
+
+
+def job_response(kind, mn, request, fields, **extra):
+    '''
+    Starts the job with the fields of the request and extra, the response
+    is the job id, { "job": str }, see JobView
+    '''
+    data = dict({k: request.data[k] for k in fields if k in request.data}, **extra)
+    # the job data is json
+    data = {k: v.tolist() if hasattr(v, 'tolist') else v for k, v in data.items()}
+    job = start_job(kind, mn, data, request.data.get("origin", None))
+    return Response({ "job": job.id }, status=status.HTTP_202_ACCEPTED)
+
+
 class MixnetViewSet(viewsets.ModelViewSet):
     """
     API endpoint that allows mixnets to be viewed or edited.
@@ -24,6 +53,10 @@ class MixnetViewSet(viewsets.ModelViewSet):
          * voting: id
          * position: int / nullable
          * key: { "p": int, "g": int } / nullable
+         * group: str / nullable, standard group name (mixnet.groups) of KEYBITS bits
+         * async: bool / nullable, generate the key in a job, see JobView
+         * origin: { "url": str, "job": str } / nullable, first job of the chain
+         * y: int / nullable, product of the keys of the previous auths, async only
         """
 
         auths = request.data.get("auths")
@@ -32,6 +65,14 @@ class MixnetViewSet(viewsets.ModelViewSet):
         position = request.data.get("position", 0)
         p, g = int(key["p"]), int(key["g"])
 
+        # with a standard group only the private key is generated
+        group = request.data.get("group", settings.MIXNET_GROUP)
+        if group and (not p or not g):
+            try:
+                p, g = check_group(group, settings.KEYBITS)
+            except (KeyError, ValueError):
+                return Response({}, status=status.HTTP_400_BAD_REQUEST)
+
         dbauths = []
         for auth in auths:
             isme = auth["url"] == settings.BASEURL
@@ -46,6 +87,9 @@ class MixnetViewSet(viewsets.ModelViewSet):
         for a in dbauths:
             mn.auths.add(a)
 
+        if request.data.get("async", False):
+            return job_response('key', mn, request, ("y",), key={ "p": p, "g": g })
+
         mn.gen_key(p, g)
 
         data = { "key": { "p": mn.key.p, "g": mn.key.g } }
@@ -65,6 +109,8 @@ class MixnetViewSet(viewsets.ModelViewSet):
 
 
 class Shuffle(APIView):
+    parser_classes = PARSERS
+    renderer_classes = RENDERERS
 
     def post(self, request, voting_id):
         """
@@ -72,10 +118,25 @@ class Shuffle(APIView):
          * msgs: [ [int, int] ]
          * pk: { "p": int, "g": int, "y": int } / nullable
          * position: int / nullable
+         * transfer: str / nullable, msgs sent in chunks (see Chunk)
+         * size: int / nullable, number of msgs of the transfer
+         * pipeline: bool / nullable, the chunks were sent with pipeline
+           and are already being shuffled, this waits for the result
+         * async: bool / nullable, shuffle in a job, see JobView
+         * origin: { "url": str, "job": str } / nullable, first job of the chain
+
+        With transfer the response is { "transfer": str, "size": int }
         """
 
         position = request.data.get("position", 0)
-        mn = get_object_or_404(Mixnet, voting_id=voting_id, auth_position=position)
+        try:
+            mn = get_mixnet(voting_id, int(position))
+        except Mixnet.DoesNotExist:
+            raise Http404
+
+        if request.data.get("async", False):
+            fields = ("msgs", "pk", "transfer", "size", "pipeline")
+            return job_response('shuffle', mn, request, fields)
 
         msgs = request.data.get("msgs", [])
         pk = request.data.get("pk", None)
@@ -84,6 +145,29 @@ class Shuffle(APIView):
         else:
             p, g, y = mn.key.p, mn.key.g, mn.key.y
 
+        transfer = request.data.get("transfer", None)
+        if transfer and request.data.get("pipeline", False):
+            size = int(request.data.get("size", 0))
+            pk = { "p": p, "g": g, "y": y }
+            try:
+                if not mn.wait_pipeline(transfer, size, pk):
+                    return Response({}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+            except (ValueError, requests.RequestException) as e:
+                return Response({"detail": str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+            if not mn.next_auths():
+                return Response({ "transfer": stage_transfer(transfer, mn.auth_position + 1),
+                                  "size": size })
+            data = { "pk": pk, "pipeline": True }
+            out = mn.chain_transfer("/shuffle/{}/".format(voting_id), transfer, size, data)
+            return Response({ "transfer": out, "size": size })
+
+        if transfer:
+            size = int(request.data.get("size", 0))
+            out = mn.shuffle_transfer(transfer, size, (p, g, y))
+            data = { "pk": { "p": p, "g": g, "y": y } }
+            out = mn.chain_transfer("/shuffle/{}/".format(voting_id), out, size, data)
+            return Response({ "transfer": out, "size": size })
+
         msgs = mn.shuffle(msgs, (p, g, y))
 
         data = {
@@ -99,6 +183,8 @@ class Shuffle(APIView):
 
 
 class Decrypt(APIView):
+    parser_classes = PARSERS
+    renderer_classes = RENDERERS
 
     def post(self, request, voting_id):
         """
@@ -106,10 +192,26 @@ class Decrypt(APIView):
          * msgs: [ [int, int] ]
          * pk: { "p": int, "g": int, "y": int } / nullable
          * position: int / nullable
+         * shuffled: bool / nullable, msgs already shuffled by the mixnet
+         * transfer: str / nullable, msgs sent in chunks (see Chunk)
+         * size: int / nullable, number of msgs of the transfer
+         * parallel: bool / nullable, this auth asks all the auths for their
+           partial decryption at the same time and combines them
+         * async: bool / nullable, decrypt in a job, see JobView
+         * origin: { "url": str, "job": str } / nullable, first job of the chain
+
+        With transfer the response is { "transfer": str, "size": int }
         """
 
         position = request.data.get("position", 0)
-        mn = get_object_or_404(Mixnet, voting_id=voting_id, auth_position=position)
+        try:
+            mn = get_mixnet(voting_id, int(position))
+        except Mixnet.DoesNotExist:
+            raise Http404
+
+        if request.data.get("async", False):
+            fields = ("msgs", "pk", "transfer", "size", "shuffled", "parallel")
+            return job_response('decrypt', mn, request, fields)
 
         msgs = request.data.get("msgs", [])
         pk = request.data.get("pk", None)
@@ -117,18 +219,38 @@ class Decrypt(APIView):
             p, g, y = pk["p"], pk["g"], pk["y"]
         else:
             p, g, y = mn.key.p, mn.key.g, mn.key.y
+        shuffled = request.data.get("shuffled", False)
 
         next_auths = mn.next_auths()
-        last = next_auths.count() == 0
+        last = not next_auths
 
         # useful for tests only, to override the last value
         last = request.data.get("force-last", last)
 
-        msgs = mn.decrypt(msgs, (p, g, y), last=last)
+        transfer = request.data.get("transfer", None)
+        if request.data.get("parallel", False):
+            if transfer:
+                size = int(request.data.get("size", 0))
+                out = mn.parallel_decrypt_transfer(transfer, size, (p, g, y), shuffled=shuffled)
+                return Response({ "transfer": out, "size": size })
+            if not shuffled:
+                msgs = [msgs[i] for i in mn.crypt().gen_perm(len(msgs))]
+            return Response(mn.parallel_decrypt(msgs, (p, g, y)))
+
+        if transfer:
+            size = int(request.data.get("size", 0))
+            out = mn.decrypt_transfer(transfer, size, (p, g, y), last=last,
+                                      shuffled=shuffled)
+            data = { "pk": { "p": p, "g": g, "y": y }, "shuffled": shuffled }
+            out = mn.chain_transfer("/decrypt/{}/".format(voting_id), out, size, data)
+            return Response({ "transfer": out, "size": size })
+
+        msgs = mn.decrypt(msgs, (p, g, y), last=last, shuffled=shuffled)
 
         data = {
             "msgs": msgs,
             "pk": { "p": p, "g": g, "y": y },
+            "shuffled": shuffled,
         }
         # chained call to the next auth to gen the key
         resp = mn.chain_call("/decrypt/{}/".format(voting_id), data)
@@ -136,3 +258,146 @@ class Decrypt(APIView):
             msgs = resp
 
         return  Response(msgs)
+
+
+class Partial(APIView):
+    parser_classes = PARSERS
+    renderer_classes = RENDERERS
+
+    def post(self, request, voting_id):
+        """
+        Partial decryption with the key of this auth, for the parallel
+        decrypt
+
+         * voting_id: id
+         * msgs: [ int ], first component of each cipher
+         * position: int / nullable
+
+        The response is [ int ], a^x for each a
+        """
+
+        position = request.data.get("position", 0)
+        try:
+            mn = get_mixnet(voting_id, int(position))
+        except Mixnet.DoesNotExist:
+            raise Http404
+
+        return Response(mn.partial_decrypt(request.data.get("msgs", [])))
+
+
+class Chunk(APIView):
+    """
+    Batches of msgs too big for a single request are sent in chunks, all
+    the chunks of a batch with the same transfer id. The transfer is then
+    passed to shuffle or decrypt instead of the msgs. A transfer is only
+    read, extended or dropped through the voting that stored it.
+    """
+    parser_classes = PARSERS
+    renderer_classes = RENDERERS
+
+    def get(self, request, voting_id):
+        """
+         * transfer: str
+         * offset: int
+         * limit: int
+        """
+
+        transfer = request.GET.get("transfer", "")
+        offset = int(request.GET.get("offset", 0))
+        limit = int(request.GET.get("limit", settings.CHUNK_SIZE))
+        msgs = (TransferMsg.objects.filter(voting_id=voting_id,
+                                           transfer=transfer,
+                                           index__gte=offset,
+                                           index__lt=offset + limit)
+                .order_by('index').values_list('msg', flat=True))
+        return Response(list(msgs))
+
+    def post(self, request, voting_id):
+        """
+         * transfer: str
+         * offset: int
+         * msgs: [ [int, int] ]
+         * pipeline: { "size": int, "pk": { "p", "g", "y" } } / nullable,
+           reencrypt the chunk now, see Mixnet.pipeline_chunk
+         * position: int / nullable, auth position, only with pipeline
+        """
+
+        transfer = request.data.get("transfer", "")
+        offset = int(request.data.get("offset", 0))
+        msgs = request.data.get("msgs", [])
+        if not transfer or len(transfer) > 32 or len(msgs) > settings.CHUNK_SIZE:
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
+        # the transfers of a voting aren't extended from another one
+        if not transfer_owned(voting_id, transfer):
+            return Response({}, status=status.HTTP_403_FORBIDDEN)
+
+        pipeline = request.data.get("pipeline", None)
+        if pipeline:
+            try:
+                mn = get_mixnet(voting_id, int(request.data.get("position", 0)))
+            except Mixnet.DoesNotExist:
+                raise Http404
+            try:
+                mn.check_pipeline(pipeline)
+                mn.pipeline_chunk(transfer, offset, msgs, pipeline)
+            except ValueError as e:
+                return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({})
+
+        store_transfer(voting_id, transfer, offset, msgs)
+        return Response({})
+
+    def delete(self, request, voting_id):
+        """
+         * transfer: str
+        """
+
+        drop_transfer(voting_id, request.GET.get("transfer", ""))
+        return Response({})
+
+
+class KeyPool(APIView):
+
+    def get(self, request):
+        """
+        Number of pregenerated keys in the pool for each key size
+
+         * { bits: int }
+        """
+
+        return Response(key_pool_depth())
+
+
+class JobView(APIView):
+    """
+    Jobs of the async chain. The first auth returns the job id, the status
+    of that job is the status of the whole chain: running or forwarded
+    while the auths work, done or error when the last auth has finished.
+    """
+
+    def get(self, request, job_id):
+        """
+         * { "id": str, "kind": str, "status": str, "result": ..., "error": str,
+             "next": { "url": str, "job": str } }
+
+        The result of a key job is the pubkey, the result of shuffle and
+        decrypt is { "msgs": [...] } or { "transfer": str, "size": int }
+        with the msgs stored in this auth (see Chunk).
+        """
+
+        return Response(JobSerializer(get_object_or_404(Job, pk=job_id)).data)
+
+    def post(self, request, job_id):
+        """
+        The last auth sends here the result of the chain
+
+         * result: dict / nullable
+         * error: str / nullable
+         * token: str, the token of the origin job, sent along the chain
+        """
+
+        job = get_object_or_404(Job, pk=job_id)
+        if not hmac.compare_digest(str(request.data.get("token", "")), job.token):
+            return Response({}, status=status.HTTP_403_FORBIDDEN)
+        finish_job(job.id, request.data.get("result", None), request.data.get("error", None))
+        return Response({})
@@ -8,6 +8,8 @@ class Vote(models.Model):
 
     a = BigBigField()
     b = BigBigField()
+    # homomorphic votings, a cipher for each option, [ [a, b] ]
+    options = models.JSONField(blank=True, null=True)
 
     voted = models.DateTimeField(auto_now=True)
 
@@ -2,18 +2,23 @@ import datetime
 import random
 from django.contrib.auth.models import User
 from django.utils import timezone
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from rest_framework.test import APIClient
 from rest_framework.test import APITestCase
 
 from .models import Vote
 from .serializers import VoteSerializer
+from base import binary
 from base import mods
 from base.models import Auth
 from base.tests import BaseTestCase
 from census.models import Census
+from mixnet.mixcrypt import elgamal_combine
 from mixnet.models import Key
+from mixnet.proofs import encrypt_ballot
 from voting.models import Question
+from voting.models import QuestionOption
+from voting.models import TallyMode
 from voting.models import Voting
 
 
@@ -100,6 +105,42 @@ class StoreTextCase(BaseTestCase):
         self.assertEqual(Vote.objects.first().a, CTE_A)
         self.assertEqual(Vote.objects.first().b, CTE_B)
 
+    @override_settings(MODS_ASYNC_THREADS=0)
+    def test_store_vote_async(self):
+        census = Census(voting_id=5001, voter_id=1)
+        census.save()
+        data = {
+            "voting": 5001,
+            "voter": 1,
+            "vote": { "a": 30, "b": 55 }
+        }
+        user = self.get_or_create_user(1)
+
+        # not authenticated
+        response = self.client.post('/store/async/', data, format='json')
+        self.assertEqual(response.status_code, 401)
+
+        self.login(user=user.username)
+        response = self.client.post('/store/async/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Vote.objects.get(voting_id=5001, voter_id=1).b, 55)
+
+        # not in the census
+        response = self.client.post('/store/async/', dict(data, voting=5002), format='json')
+        self.assertEqual(response.status_code, 401)
+        self.gen_voting(5002)
+        response = self.client.post('/store/async/', dict(data, voting=5002), format='json')
+        self.assertEqual(response.status_code, 401)
+
+        # closed
+        self.voting.end_date = timezone.now() - datetime.timedelta(days=1)
+        self.voting.save()
+        response = self.client.post('/store/async/', data, format='json')
+        self.assertEqual(response.status_code, 401)
+
+        response = self.client.post('/store/async/', { "voting": 5001 }, format='json')
+        self.assertEqual(response.status_code, 400)
+
     def test_vote(self):
         self.gen_votes()
         response = self.client.get('/store/', format='json')
@@ -142,6 +183,74 @@ class StoreTextCase(BaseTestCase):
 
         self.assertEqual(len(votes), Vote.objects.filter(voter_id=v).count())
 
+    def test_filter_binary(self):
+        votings, voters = self.gen_votes()
+        v = votings[0]
+
+        self.login()
+        response = self.client.get('/store/?voting_id={}'.format(v),
+                                   HTTP_ACCEPT=binary.MEDIA_TYPE)
+        self.assertEqual(response.status_code, 200)
+        votes = binary.loads(response.content)
+        expected = [[i.a, i.b] for i in Vote.objects.filter(voting_id=v)]
+        self.assertEqual(votes, expected)
+
+        # json is still the default
+        response = self.client.get('/store/?voting_id={}'.format(v))
+        self.assertEqual(len(response.json()), len(expected))
+
+    def test_aggregate(self):
+        VOTING_PK = 345
+        P, G, Y = 2039, 7, 1562
+        self.gen_voting(VOTING_PK)
+        for i in range(2):
+            QuestionOption(question=self.question, option='option {}'.format(i + 1)).save()
+        key = Key(p=P, g=G, y=Y)
+        key.save()
+        Voting.objects.filter(pk=VOTING_PK).update(tally_mode=TallyMode.HOMOMORPHIC, pub_key=key)
+
+        ballots = [encrypt_ballot(i, 2, P, G, Y) for i in (0, 1, 1)]
+        for voter, ballot in enumerate(ballots, 101):
+            Census(voting_id=VOTING_PK, voter_id=voter).save()
+            user = self.get_or_create_user(voter)
+            self.login(user=user.username)
+            data = { "voting": VOTING_PK, "voter": voter, "vote": ballot }
+            response = self.client.post('/store/', data, format='json')
+            self.assertEqual(response.status_code, 200)
+
+        # a cipher for each option, with the proofs, and no a, b
+        ballot = encrypt_ballot(0, 2, P, G, Y)
+        wrong = [{ "options": ballot["options"][:1], "proof": ballot["proof"] },
+                 { "options": ballot["options"] },
+                 { "options": [{ "a": 2, "b": 3, "proof": [1, 2, 3, 4] }] * 2,
+                   "proof": ballot["proof"] },
+                 { "options": [{ "x": 1 }, 2], "proof": ballot["proof"] },
+                 dict(ballot, a=2, b=3), { "a": 2, "b": 3 }, [1, 2]]
+        for vote in wrong:
+            data["vote"] = vote
+            response = self.client.post('/store/', data, format='json')
+            self.assertEqual(response.status_code, 400)
+
+        response = self.client.get('/store/aggregate/?voting_id={}&p={}'.format(VOTING_PK, P))
+        self.assertEqual(response.status_code, 403)
+
+        self.login()
+        response = self.client.get('/store/aggregate/?voting_id={}&p={}'.format(VOTING_PK, P))
+        self.assertEqual(response.status_code, 200)
+        ciphers = [[(o["a"], o["b"]) for o in b["options"]] for b in ballots]
+        expected = [list(elgamal_combine([c[i] for c in ciphers], P)) for i in range(2)]
+        self.assertEqual(response.json(), { "votes": 3, "options": expected })
+
+    def test_vote_mixnet_options(self):
+        self.gen_voting(346)
+        Census(voting_id=346, voter_id=101).save()
+        user = self.get_or_create_user(101)
+        self.login(user=user.username)
+        for vote in [{ "a": 2, "b": 3, "options": [[2, 3]] }, { "a": "x", "b": 3 }, { "a": 2 }]:
+            data = { "voting": 346, "voter": 101, "vote": vote }
+            response = self.client.post('/store/', data, format='json')
+            self.assertEqual(response.status_code, 400)
+
     def test_hasvote(self):
         votings, voters = self.gen_votes()
         vo = Vote.objects.first()
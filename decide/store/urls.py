@@ -4,4 +4,6 @@ from . import views
 
 urlpatterns = [
     path('', views.StoreView.as_view(), name='store'),
+    path('aggregate/', views.AggregateView.as_view(), name='aggregate'),
+    path('async/', views.AsyncStoreView.as_view(), name='store_async'),
 ]
@@ -1,14 +1,67 @@
-from django.utils import timezone
-from django.utils.dateparse import parse_datetime
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 import django_filters.rest_framework
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework import generics
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
 
 from .models import Vote
 from .serializers import VoteSerializer
 from base import mods
+from base.binary import BinaryRenderer
 from base.perms import UserIsStaff
+from mixnet import proofs
+from mixnet.mixcrypt import elgamal_combine
+from voting.cache import avoting_state, voting_open, voting_state
+from voting.models import TallyMode
+
+
+def store_vote(vid, uid, vote, voting):
+    '''
+    Saves the vote of the voter uid, returns the status of the response.
+    The votes of the homomorphic votings have a cipher for each option and
+    the proofs that they add one vote to one option, see mixnet.proofs.
+    '''
+    if not isinstance(vote, dict):
+        return status.HTTP_400_BAD_REQUEST
+
+    a, b, options = vote.get("a"), vote.get("b"), None
+    if voting.get('tally_mode', None) == TallyMode.HOMOMORPHIC:
+        pk = voting.get('pub_key', None)
+        if not pk or a is not None or b is not None:
+            return status.HTTP_400_BAD_REQUEST
+        try:
+            options = proofs.verify_ballot(vote, pk["p"], pk["g"], pk["y"])
+        except ValueError:
+            return status.HTTP_400_BAD_REQUEST
+        if len(options) != voting['options']:
+            return status.HTTP_400_BAD_REQUEST
+        options = [list(c) for c in options]
+    else:
+        try:
+            a, b = proofs.number(a), proofs.number(b)
+        except ValueError:
+            return status.HTTP_400_BAD_REQUEST
+        if "options" in vote:
+            return status.HTTP_400_BAD_REQUEST
+
+    defs = { "a": a, "b": b, "options": options }
+    v, _ = Vote.objects.get_or_create(voting_id=vid, voter_id=uid,
+                                      defaults=defs)
+    v.a = a
+    v.b = b
+    v.options = options
+
+    v.save()
+    return status.HTTP_200_OK
 
 
 class StoreView(generics.ListAPIView):
@@ -16,32 +69,32 @@ class StoreView(generics.ListAPIView):
     serializer_class = VoteSerializer
     filter_backends = (django_filters.rest_framework.DjangoFilterBackend,)
     filterset_fields = ('voting_id', 'voter_id')
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [BinaryRenderer]
 
     def get(self, request):
         self.permission_classes = (UserIsStaff,)
         self.check_permissions(request)
+        if isinstance(request.accepted_renderer, BinaryRenderer):
+            # only the votes, [ [a, b] ], for the tally
+            votes = self.filter_queryset(self.get_queryset())
+            return Response([[v.a, v.b] for v in votes])
         return super().get(request)
 
     def post(self, request):
         """
          * voting: id
          * voter: id
-         * vote: { "a": int, "b": int }
+         * vote: { "a": int, "b": int }, or in homomorphic votings
+           { "options": [ { "a": int, "b": int, "proof": [int] } ], "proof": [int] },
+           a cipher for each option with the proofs, see mixnet.proofs
         """
 
         vid = request.data.get('voting')
-        voting = mods.get('voting', params={'id': vid})
-        if not voting or not isinstance(voting, list):
+        voting = voting_state(vid)
+        if not voting:
             # print("por aqui 35")
             return Response({}, status=status.HTTP_401_UNAUTHORIZED)
-        start_date = voting[0].get('start_date', None)
-        # print ("Start date: "+  start_date)
-        end_date = voting[0].get('end_date', None)
-        #print ("End date: ", end_date)
-        not_started = not start_date or timezone.now() < parse_datetime(start_date)
-        #print (not_started)
-        is_closed = end_date and parse_datetime(end_date) < timezone.now()
-        if not_started or is_closed:
+        if not voting_open(voting):
             #print("por aqui 42")
             return Response({}, status=status.HTTP_401_UNAUTHORIZED)
 
@@ -56,7 +109,7 @@ class StoreView(generics.ListAPIView):
             token = request.auth.key
         else:
             token = "NO-AUTH-VOTE"
-        voter = mods.post('authentication', entry_point='/getuser/', json={'token': token})
+        voter = mods.get_user(token)
         voter_id = voter.get('id', None)
         if not voter_id or voter_id != uid:
             # print("por aqui 59")
@@ -64,19 +117,79 @@ class StoreView(generics.ListAPIView):
 
         # the user is in the census
         perms = mods.get('census/{}'.format(vid), params={'voter_id': uid}, response=True)
-        if perms.status_code == 401:
+        # the census answers 404 to the voters out of it
+        if perms.status_code != 200:
             # print("por aqui 65")
             return Response({}, status=status.HTTP_401_UNAUTHORIZED)
 
-        a = vote.get("a")
-        b = vote.get("b")
+        return  Response({}, status=store_vote(vid, uid, vote, voting))
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncStoreView(View):
+    """
+    StoreView.post for ASGI, the voting, the voter and the census are
+    checked at the same time, see mods.aquery
+    """
+
+    async def post(self, request):
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({}, status=status.HTTP_400_BAD_REQUEST)
+
+        vid = data.get('voting')
+        uid = data.get('voter')
+        vote = data.get('vote')
+        if not vid or not uid or not vote:
+            return JsonResponse({}, status=status.HTTP_400_BAD_REQUEST)
+
+        auth = request.headers.get('Authorization', '').split()
+        token = auth[1] if len(auth) == 2 and auth[0] == 'Token' else "NO-AUTH-VOTE"
+
+        voting, voter, perms = await asyncio.gather(
+            avoting_state(vid),
+            mods.aget_user(token),
+            mods.aget('census/{}'.format(vid), params={'voter_id': uid}, response=True),
+        )
 
-        defs = { "a": a, "b": b }
-        v, _ = Vote.objects.get_or_create(voting_id=vid, voter_id=uid,
-                                          defaults=defs)
-        v.a = a
-        v.b = b
+        if not voting or not voting_open(voting):
+            return JsonResponse({}, status=status.HTTP_401_UNAUTHORIZED)
+        voter_id = voter.get('id', None)
+        if not voter_id or voter_id != uid or perms.status_code != 200:
+            return JsonResponse({}, status=status.HTTP_401_UNAUTHORIZED)
+
+        code = await sync_to_async(store_vote)(vid, uid, vote, voting)
+        return JsonResponse({}, status=code)
+
+
+class AggregateView(APIView):
+    permission_classes = (UserIsStaff,)
+
+    def get(self, request):
+        """
+        Product of the ciphers of each option of the votes of a
+        homomorphic voting, the cipher of g^votes of each option
+
+         * voting_id: id
+         * p: int, the modulus of the voting key
+
+        The response is { "votes": int, "options": [ [a, b] ] }
+        """
+
+        vid = request.GET.get('voting_id', None)
+        p = int(request.GET.get('p', 0))
+        if not vid or p < 2:
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
 
-        v.save()
+        votes = 0
+        total = None
+        options = (Vote.objects.filter(voting_id=vid, options__isnull=False)
+                   .values_list('options', flat=True))
+        for ballot in options.iterator():
+            if total is None:
+                total = [(1, 1) for _ in ballot]
+            total = [elgamal_combine([t, c], p) for t, c in zip(total, ballot)]
+            votes += 1
 
-        return  Response({})
+        return Response({ "votes": votes, "options": [list(t) for t in total or []] })
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+import sys
+import time
+
+from Crypto.PublicKey import ElGamal
+from Crypto.Util.number import getPrime
+
+from mixnet.mixcrypt import elgamal_decrypt_batch
+from mixnet.mixcrypt import elgamal_encrypt
+from mixnet.mixcrypt import fixed_base
+from mixnet.mixcrypt import multi_pow
+from mixnet.mixcrypt import rand
+from mixnet.mixcrypt import rand_short
+from mixnet.mixcrypt import set_backend
+from mixnet.mixcrypt import BACKENDS
+from mixnet import mixcrypt
+
+
+BITS = [256, 1024, 2048]
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+
+def timeit(f, n=N):
+    t = time.perf_counter()
+    for i in range(n):
+        f()
+    return (time.perf_counter() - t) / n
+
+
+def bench_fixed_base(bits):
+    # a random prime is enough to measure the exponentiations, there's no
+    # need to wait for a safe prime here
+    p = getPrime(bits)
+    g = 3
+    x = rand(p)
+    y = pow(g, x, p)
+    k = ElGamal.construct((p, g, y))
+
+    t = time.perf_counter()
+    fixed_base(g, p)
+    fixed_base(y, p)
+    build = time.perf_counter() - t
+
+    # same exponent for both, only the exponentiations are measured
+    r = rand(p)
+    plain = timeit(lambda: k._encrypt(2, r))
+    fast = timeit(lambda: elgamal_encrypt(2, r, p, g, y))
+
+    print('{:>5} bits: tables {:8.1f} ms | pow {:8.3f} ms | fixed-base {:8.3f} ms '
+          '(x{:.1f})'.format(bits, build * 1000, plain * 1000, fast * 1000, plain / fast))
+
+
+def bench_batch_decrypt(bits):
+    p = getPrime(bits)
+    g = 3
+    x = rand(p)
+    y = pow(g, x, p)
+    k = ElGamal.construct((p, g, y, x))
+
+    cipher = [elgamal_encrypt(2, rand(p), p, g, y) for i in range(N)]
+    plain = timeit(lambda: [k._decrypt(c) for c in cipher], n=1) / N
+    batch = timeit(lambda: elgamal_decrypt_batch(cipher, p, x), n=1) / N
+
+    print('{:>5} bits: decrypt {:8.3f} ms | batch decrypt {:8.3f} ms (x{:.1f})'.format(
+        bits, plain * 1000, batch * 1000, plain / batch))
+
+
+def bench_subgroup(bits):
+    p = getPrime(bits)
+    g = 3
+    cipher = [elgamal_encrypt(2, rand(p), p, g, pow(g, rand(p), p)) for i in range(N)]
+
+    # full exponents against the short exponents of MixCrypt(subgroup=True)
+    full = timeit(lambda: elgamal_decrypt_batch(cipher, p, rand(p)), n=1) / N
+    short = timeit(lambda: elgamal_decrypt_batch(cipher, p, rand_short()), n=1) / N
+
+    print('{:>5} bits: full exponent {:8.3f} ms | short exponent {:8.3f} ms (x{:.1f})'.format(
+        bits, full * 1000, short * 1000, full / short))
+
+
+def bench_backends(bits):
+    p = getPrime(bits)
+    g = 3
+    x = rand(p)
+    y = pow(g, x, p)
+    rs = [rand(p) for i in range(N)]
+
+    times = []
+    for name in BACKENDS:
+        set_backend(name)
+        fixed_base(g, p)
+        fixed_base(y, p)
+        cipher = [elgamal_encrypt(2, r, p, g, y) for r in rs]
+        enc = timeit(lambda: [elgamal_encrypt(2, r, p, g, y) for r in rs], n=1) / N
+        dec = timeit(lambda: elgamal_decrypt_batch(cipher, p, x), n=1) / N
+        times.append('{} encrypt {:8.3f} ms decrypt {:8.3f} ms'.format(name, enc * 1000, dec * 1000))
+    set_backend()
+
+    print('{:>5} bits: {}'.format(bits, ' | '.join(times)))
+
+
+def bench_multi_pow(bits):
+    p = getPrime(bits)
+    times = []
+    for n in (2, 4, 16):
+        bases = [rand(p) for i in range(n)]
+        exps = [rand(p) for i in range(n)]
+
+        def separate():
+            # same arithmetic backend, only the algorithm changes
+            r = 1
+            for b, e in zip(bases, exps):
+                r = (r * mixcrypt.backend.powmod(b, e, p)) % p
+            return r
+
+        plain = timeit(separate, n=5)
+        multi = timeit(lambda: multi_pow(bases, exps, p), n=5)
+        times.append('{:>2} bases {:8.3f} ms / {:8.3f} ms (x{:.1f})'.format(
+            n, plain * 1000, multi * 1000, plain / multi))
+
+    print('{:>5} bits: {}'.format(bits, ' | '.join(times)))
+
+
+if __name__ == '__main__':
+    print('Per-ciphertext encryption, {} runs'.format(N))
+    for bits in BITS:
+        bench_fixed_base(bits)
+
+    print('Per-ciphertext decryption, batches of {}'.format(N))
+    for bits in BITS:
+        bench_batch_decrypt(bits)
+
+    print('Per-ciphertext batch decryption in the subgroup, batches of {}'.format(N))
+    for bits in BITS:
+        bench_subgroup(bits)
+
+    print('Product of powers, separate pow / multi_pow')
+    for bits in BITS:
+        bench_multi_pow(bits)
+
+    print('Per-ciphertext cost with each arithmetic backend, batches of {}'.format(N))
+    for bits in BITS:
+        bench_backends(bits)
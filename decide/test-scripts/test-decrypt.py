@@ -7,11 +7,12 @@ from mixnet.mixcrypt import ElGamal
 
 SK = sys.argv[1]
 MSG = sys.argv[2]
+SUBGROUP = '--subgroup' in sys.argv[3:]
 
 p, g, y, x = map(int, SK.split(','))
 a, b = map(int, MSG.split(','))
 
-k = MixCrypt(bits=256)
+k = MixCrypt(bits=256, subgroup=SUBGROUP)
 k.k = ElGamal.construct((p, g, y, x))
 
-print(k.decrypt((a, b)))
+print(k.decode(k.decrypt((a, b))))
@@ -7,9 +7,10 @@ from mixnet.mixcrypt import ElGamal
 
 PK = sys.argv[1]
 MSG = sys.argv[2]
+SUBGROUP = '--subgroup' in sys.argv[3:]
 
 p, g, y = map(int, PK.split(','))
-k = MixCrypt(bits=256)
+k = MixCrypt(bits=256, subgroup=SUBGROUP)
 k.k = ElGamal.construct((p, g, y))
 
 print(','.join(map(str, k.encrypt(int(MSG)))))
@@ -1,9 +1,10 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.utils import timezone
 
 from .models import QuestionOption
 from .models import Question
 from .models import Voting
+from .models import TallyError
 
 from .filters import StartedFilter
 
@@ -24,7 +25,10 @@ def stop(ModelAdmin, request, queryset):
 def tally(ModelAdmin, request, queryset):
     for v in queryset.filter(end_date__lt=timezone.now()):
         token = request.session.get('auth-token', '')
-        v.tally_votes(token)
+        try:
+            v.tally_votes(token)
+        except TallyError as e:
+            ModelAdmin.message_user(request, '{}: {}'.format(v, e), messages.ERROR)
 
 class QuestionOptionInline(admin.TabularInline):
     model = QuestionOption
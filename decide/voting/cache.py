@@ -0,0 +1,108 @@
+'''
+Compact state of the votings, for the views that only need to know if a
+voting accepts votes, instead of getting the whole voting with its
+question, key, auths and tally from the voting module:
+
+    { "id": int, "start_date": str, "end_date": str, "tallied": bool,
+      "options": int, "tally_mode": str, "pub_key": { "p", "g", "y" } }
+
+The states are kept for VOTING_STATE_TTL seconds in the django cache
+VOTING_STATE_CACHE (an alias of CACHES), shared by all the processes, and
+deleted when the voting is saved. If it's None they're kept in the
+default cache of each process, where clear_state only reaches the process
+that saved the voting, so only the closed or tallied votings are cached
+there: starting or stopping a voting must be seen by every process at
+once, and those states don't change anymore.
+'''
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from base import mods
+
+
+def state_key(voting_id):
+    return 'voting-state:{}'.format(voting_id)
+
+
+def state_cache():
+    return caches[settings.VOTING_STATE_CACHE or 'default']
+
+
+def voting_open(voting):
+    '''
+    True if the voting accepts votes now
+    '''
+    start_date = voting.get('start_date', None)
+    end_date = voting.get('end_date', None)
+    not_started = not start_date or timezone.now() < parse_datetime(start_date)
+    is_closed = end_date and parse_datetime(end_date) < timezone.now()
+    return not (not_started or is_closed)
+
+
+def voting_closed(voting):
+    '''
+    True if the voting is stopped or tallied, its state doesn't change
+    '''
+    end_date = voting.get('end_date', None)
+    return voting.get('tallied', False) or bool(
+        end_date and parse_datetime(end_date) < timezone.now())
+
+
+def compact(voting):
+    return {
+        "id": voting["id"],
+        "start_date": voting.get("start_date", None),
+        "end_date": voting.get("end_date", None),
+        "tallied": voting.get("tally", None) is not None,
+        "options": len(voting["question"]["options"]),
+        "tally_mode": voting.get("tally_mode", None),
+        "pub_key": voting.get("pub_key", None),
+    }
+
+
+def cached(voting_id):
+    '''
+    The key of the voting state and the state if it's cached. The key is
+    None if voting_id isn't a valid id.
+    '''
+    try:
+        key = state_key(int(voting_id))
+    except (TypeError, ValueError):
+        return None, None
+    return key, state_cache().get(key)
+
+
+def save_state(key, r):
+    if not r or not isinstance(r, list):
+        return None
+    state = compact(r[0])
+    if settings.VOTING_STATE_CACHE is not None or voting_closed(state):
+        state_cache().set(key, state, settings.VOTING_STATE_TTL)
+    return state
+
+
+def voting_state(voting_id):
+    '''
+    State of the voting, None if it doesn't exist
+    '''
+    key, state = cached(voting_id)
+    if key is None or state is not None:
+        return state
+    return save_state(key, mods.get('voting', params={'id': int(voting_id)}))
+
+
+async def avoting_state(voting_id):
+    '''
+    voting_state for async views
+    '''
+    key, state = cached(voting_id)
+    if key is None or state is not None:
+        return state
+    return save_state(key, await mods.aget('voting', params={'id': int(voting_id)}))
+
+
+def clear_state(voting_id):
+    state_cache().delete(state_key(voting_id))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from mixnet import dlog
+from voting.models import TallyMode, Voting
+
+
+class Command(BaseCommand):
+    help = 'Precompute the dlog tables of the homomorphic votings, sized for their census'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voting', type=int,
+                            help='only for this voting, by default all the votings not tallied')
+
+    def handle(self, *args, **options):
+        votings = Voting.objects.filter(tally_mode=TallyMode.HOMOMORPHIC, pub_key__isnull=False)
+        if options['voting']:
+            votings = votings.filter(id=options['voting'])
+        else:
+            votings = votings.filter(tally__isnull=True)
+
+        for v in votings:
+            size = v.census_size()
+            table = dlog.get_table(v.pub_key.p, v.pub_key.g, size)
+            self.stdout.write('Voting {}: {} voters, table of {} steps'.format(
+                v.id, size, table.m))
@@ -21,7 +21,7 @@ class Command(BaseCommand):
     def encrypt_msg(self, msg, v, bits=settings.KEYBITS):
         pk = v.pub_key
         p, g, y = (pk.p, pk.g, pk.y)
-        k = MixCrypt(bits=bits)
+        k = MixCrypt(k=pk, bits=bits, subgroup=settings.MIXNET_SUBGROUP)
         k.k = ElGamal.construct((p, g, y))
         return k.encrypt(msg)
 
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voting',
+            name='tally_mode',
+            field=models.CharField(choices=[('MIXNET', 'Mixnet'), ('HOMOMORPHIC', 'Homomorphic')], default='MIXNET', max_length=20),
+        ),
+    ]
@@ -1,15 +1,65 @@
+import logging
+import time
+import uuid
+
+import requests
+from django.conf import settings
 from django.db import models
 from django.db.models import JSONField
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from census.models import Census
 from base import mods
 from base.models import Auth, Key
+from mixnet import dlog
+from .cache import clear_state
+
+
+logger = logging.getLogger(__name__)
+
+
+class TallyError(Exception):
+    '''
+    A call to the mixnet failed, the key or the tally isn't saved
+    '''
+
+
+def wait_job(baseurl, job):
+    '''
+    Polls a mixnet job every MIXNET_JOB_POLL seconds until the chain has
+    finished and returns the result. Raises TallyError if the job failed
+    or it hasn't finished after MIXNET_JOB_TIMEOUT seconds.
+    '''
+    if not job:
+        raise TallyError('The mixnet started no job')
+
+    start = time.monotonic()
+    while True:
+        try:
+            response = mods.get('mixnet', entry_point='/job/{}/'.format(job), baseurl=baseurl,
+                                response=True)
+        except requests.RequestException as e:
+            raise TallyError('Job {}: {}'.format(job, e)) from e
+        status = mods.content(response) if response.status_code == 200 else {}
+        if status.get("status", None) == "done":
+            return status.get("result", None) or {}
+        if status.get("status", None) not in ("pending", "running", "forwarded"):
+            raise TallyError('Job {} failed: {}'.format(job, status.get("error", None) or
+                                                         response.status_code))
+        if time.monotonic() - start > settings.MIXNET_JOB_TIMEOUT:
+            raise TallyError('Job {} not finished after {}s'.format(job,
+                                                                   settings.MIXNET_JOB_TIMEOUT))
+        time.sleep(settings.MIXNET_JOB_POLL)
+
 
 class QuestionType(models.TextChoices):
     DEFAULT = "DEFAULT", "Default"
     YESNO = "YESNO", "Yes/No"
 
+class TallyMode(models.TextChoices):
+    MIXNET = "MIXNET", "Mixnet"
+    HOMOMORPHIC = "HOMOMORPHIC", "Homomorphic"
+
 class Question(models.Model):
     desc = models.TextField()
     question_type = models.CharField(max_length=20, choices=QuestionType.choices, default=QuestionType.DEFAULT)
@@ -41,6 +91,7 @@ class Voting(models.Model):
     pub_key = models.OneToOneField(Key, related_name='voting', blank=True, null=True, on_delete=models.SET_NULL)
     auths = models.ManyToManyField(Auth, related_name='votings')
 
+    tally_mode = models.CharField(max_length=20, choices=TallyMode.choices, default=TallyMode.MIXNET)
     tally = JSONField(blank=True, null=True)
     postproc = JSONField(blank=True, null=True)
 
@@ -53,15 +104,38 @@ class Voting(models.Model):
             "voting": self.id,
             "auths": [ {"name": a.name, "url": a.url} for a in self.auths.all() ],
         }
-        key = mods.post('mixnet', baseurl=auth.url, json=data)
+        key = self.mixnet_call(auth, '/', data)
         pk = Key(p=key["p"], g=key["g"], y=key["y"])
         pk.save()
         self.pub_key = pk
         self.save()
 
+    def mixnet_call(self, auth, entry_point, data):
+        '''
+        Calls the mixnet of the first auth. With MIXNET_ASYNC the mixnet
+        starts a job and this waits for its result.
+        '''
+        if not settings.MIXNET_ASYNC:
+            response = mods.post('mixnet', entry_point=entry_point, baseurl=auth.url, json=data,
+                                 response=True)
+            if response.status_code != 200:
+                raise TallyError('{} failed: {}'.format(entry_point, response.status_code))
+            return mods.content(response)
+
+        data = dict(data, **{"async": True})
+        response = mods.post('mixnet', entry_point=entry_point, baseurl=auth.url, json=data,
+                             response=True)
+        if response.status_code != 202:
+            raise TallyError('{} failed: {}'.format(entry_point, response.status_code))
+        return wait_job(auth.url, mods.content(response).get("job", None))
+
     def get_votes(self, token=''):
         # gettings votes from store
-        votes = mods.get('store', params={'voting_id': self.id}, HTTP_AUTHORIZATION='Token ' + token)
+        votes = mods.get('store', params={'voting_id': self.id}, binary=True,
+                         HTTP_AUTHORIZATION='Token ' + token)
+        # the binary format only has the anon votes, [ [a, b] ]
+        if isinstance(votes, list) and votes and isinstance(votes[0], list):
+            return votes
         # anon votes
         votes_format = []
         vote_list = []
@@ -77,34 +151,114 @@ class Voting(models.Model):
 
     def tally_votes(self, token=''):
         '''
-        The tally is a shuffle and then a decrypt
+        The tally is a shuffle and then a decrypt, or a homomorphic tally,
+        see tally_homomorphic
         '''
 
+        if self.tally_mode == TallyMode.HOMOMORPHIC:
+            return self.tally_homomorphic(token)
+
         votes = self.get_votes(token)
 
         auth = self.auths.first()
         shuffle_url = "/shuffle/{}/".format(self.id)
         decrypt_url = "/decrypt/{}/".format(self.id)
+        chunk_url = "/chunk/{}/".format(self.id)
         auths = [{"name": a.name, "url": a.url} for a in self.auths.all()]
 
-        # first, we do the shuffle
-        data = { "msgs": votes }
-        response = mods.post('mixnet', entry_point=shuffle_url, baseurl=auth.url, json=data,
-                response=True)
-        if response.status_code != 200:
-            # TODO: manage error
-            pass
+        # the votes are sent in chunks, so no request holds the whole tally.
+        # With the pipeline the auths start to reencrypt the first chunks
+        # while the rest are sent
+        transfer = uuid.uuid4().hex
+        transfers = [transfer]
+        pipeline = None
+        if settings.MIXNET_PIPELINE:
+            pk = {"p": self.pub_key.p, "g": self.pub_key.g, "y": self.pub_key.y}
+            pipeline = {"size": len(votes), "pk": pk}
+        try:
+            mods.post_chunks('mixnet', chunk_url, votes, transfer, baseurl=auth.url,
+                             fields={"pipeline": pipeline})
+
+            # first, we do the shuffle
+            data = { "transfer": transfer, "size": len(votes), "pipeline": bool(pipeline) }
+            response = self.mixnet_call(auth, shuffle_url, data)
+            if not isinstance(response, dict) or not response.get("transfer", None):
+                raise TallyError('The shuffle returned no transfer')
+            transfers.append(response["transfer"])
+
+            # then, we can decrypt that, it's already shuffled
+            data = {"transfer": response["transfer"], "size": len(votes), "shuffled": True,
+                    "parallel": settings.MIXNET_PARALLEL_DECRYPT}
+            response = self.mixnet_call(auth, decrypt_url, data)
+            if not isinstance(response, dict) or not response.get("transfer", None):
+                raise TallyError('The decrypt returned no transfer')
+            transfers.append(response["transfer"])
+
+            tally = []
+            for chunk in mods.get_chunks('mixnet', chunk_url, response["transfer"], len(votes),
+                                         baseurl=auth.url):
+                tally.extend(chunk)
+        except requests.RequestException as e:
+            raise TallyError(str(e)) from e
+        finally:
+            # the mixnet drops the transfers it reads, unless it failed. A
+            # failed cleanup is only logged, it doesn't hide the error
+            for t in transfers:
+                try:
+                    mods.query('mixnet', entry_point=chunk_url, method='delete',
+                               baseurl=auth.url, params={"transfer": t})
+                except requests.RequestException:
+                    logger.exception('The transfer %s of the voting %s was not dropped',
+                                     t, self.id)
+
+        self.tally = tally
+        self.save()
+
+        self.do_postproc()
+
+    def census_size(self):
+        return Census.objects.filter(voting_id=self.id).count()
 
-        # then, we can decrypt that
-        data = {"msgs": response.json()}
-        response = mods.post('mixnet', entry_point=decrypt_url, baseurl=auth.url, json=data,
-                response=True)
+    def tally_homomorphic(self, token=''):
+        '''
+        Each vote has a cipher of g^1 or g^0 for each option, in the order
+        of the option numbers, checked by the store with its proofs. The
+        store multiplies the ciphers of each option, so the mixnet only
+        decrypts one cipher per option, g^votes. The tally is
+        { number: votes }, decoded with a dlog table sized for the census.
+        '''
 
+        p, g = self.pub_key.p, self.pub_key.g
+        options = list(self.question.options.order_by('number'))
+        response = mods.get('store', entry_point='/aggregate/',
+                            params={'voting_id': self.id, 'p': p}, response=True,
+                            HTTP_AUTHORIZATION='Token ' + token)
         if response.status_code != 200:
-            # TODO: manage error
-            pass
+            raise TallyError('/aggregate/ failed: {}'.format(response.status_code))
+        agg = mods.content(response)
 
-        self.tally = response.json()
+        tally = { str(opt.number): 0 for opt in options }
+        if agg.get("options", None):
+            auth = self.auths.first()
+            decrypt_url = "/decrypt/{}/".format(self.id)
+            data = {"msgs": agg["options"], "shuffled": True,
+                    "parallel": settings.MIXNET_PARALLEL_DECRYPT}
+            clears = self.mixnet_call(auth, decrypt_url, data)
+            if isinstance(clears, dict):
+                clears = clears.get("msgs", [])
+            if len(clears) != len(options):
+                raise TallyError('The decrypt returned {} options'.format(len(clears)))
+            table = dlog.get_table(p, g, max(self.census_size(), agg["votes"]))
+            for opt, m in zip(options, clears):
+                votes = table.dlog(m, agg["votes"])
+                if votes is None:
+                    raise TallyError('No dlog for the option {}'.format(opt.number))
+                tally[str(opt.number)] = votes
+            if sum(tally.values()) != agg["votes"]:
+                raise TallyError('The options add up to {} of {} votes'.format(
+                    sum(tally.values()), agg["votes"]))
+
+        self.tally = tally
         self.save()
 
         self.do_postproc()
@@ -117,6 +271,8 @@ class Voting(models.Model):
         for opt in options:
             if isinstance(tally, list):
                 votes = tally.count(opt.number)
+            elif isinstance(tally, dict):
+                votes = tally.get(str(opt.number), None) or 0
             else:
                 votes = 0
             opts.append({
@@ -145,3 +301,10 @@ class Voting(models.Model):
 
     def __str__(self):
         return self.name
+
+
+@receiver(post_save, sender=Voting)
+@receiver(post_delete, sender=Voting)
+def clear_voting_state(sender, instance, **kwargs):
+    # start, stop and tally save the voting, see voting.cache
+    clear_state(instance.id)
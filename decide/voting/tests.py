@@ -1,10 +1,13 @@
+import os
 import random
+import tempfile
 import itertools
+import requests
 from django.utils import timezone
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.staticfiles.testing import StaticLiveServerTestCase
-from django.test import TestCase, RequestFactory
+from django.test import TestCase, RequestFactory, override_settings
 from rest_framework.test import force_authenticate
 from rest_framework.test import APITestCase
 from django.urls import reverse
@@ -22,10 +25,13 @@ from census.models import Census
 from voting.forms import ReuseCensusForm
 from mixnet.mixcrypt import ElGamal
 from mixnet.mixcrypt import MixCrypt
-from mixnet.models import Auth
-from voting.models import Voting, Question, QuestionOption
+from mixnet.proofs import encrypt_ballot
+from mixnet.models import Auth, Job, PipelineStage, TransferMsg
+from voting.models import Voting, Question, QuestionOption, TallyError, TallyMode, wait_job
 from voting.views import QuestionDelete
+from voting.cache import voting_state
 from datetime import datetime
+from unittest import mock
 
 
 class VotingTestCase(BaseTestCase):
@@ -118,6 +124,114 @@ class VotingTestCase(BaseTestCase):
         for q in v.postproc:
             self.assertEqual(tally.get(q["number"], 0), q["votes"])
 
+    def test_tally_failed(self):
+        v = self.create_voting()
+        self.create_voters(v)
+
+        v.create_pubkey()
+        v.start_date = timezone.now()
+        v.save()
+
+        self.store_votes(v)
+
+        self.login()  # set token
+        # the decrypt result is lost, the chunks can't be read
+        with mock.patch('mixnet.models.Mixnet.decrypt_transfer', return_value='lost'):
+            with self.assertRaises(TallyError):
+                v.tally_votes(self.token)
+
+        v.refresh_from_db()
+        self.assertIsNone(v.tally)
+        self.assertFalse(TransferMsg.objects.exists())
+
+        # the mixnet is down for the cleanup too, the error is still the
+        # one of the tally
+        query = mods.query
+        def down(*args, **kwargs):
+            if kwargs.get('method') == 'delete':
+                raise requests.ConnectionError('down')
+            return query(*args, **kwargs)
+        with mock.patch('mixnet.models.Mixnet.decrypt_transfer', return_value='lost'), \
+             mock.patch.object(mods, 'query', side_effect=down), \
+             self.assertLogs('voting.models', 'ERROR'):
+            with self.assertRaises(TallyError):
+                v.tally_votes(self.token)
+
+    @override_settings(MIXNET_ASYNC=True, MIXNET_JOB_WORKERS=0, MIXNET_JOB_POLL=0)
+    def test_complete_voting_async(self):
+        self.test_complete_voting()
+
+    @override_settings(MIXNET_JOB_POLL=0, MIXNET_JOB_TIMEOUT=0)
+    def test_wait_job(self):
+        job = Job(voting_id=1, kind='shuffle', status='error', error='no key')
+        job.save()
+        with self.assertRaisesRegex(TallyError, 'no key'):
+            wait_job(settings.BASEURL, job.id)
+
+        Job.objects.filter(pk=job.pk).update(status='running')
+        with self.assertRaisesRegex(TallyError, 'not finished'):
+            wait_job(settings.BASEURL, job.id)
+
+        with self.assertRaises(TallyError):
+            wait_job(settings.BASEURL, 'missing')
+
+        Job.objects.filter(pk=job.pk).update(status='done', result={ "msgs": [] })
+        self.assertEqual(wait_job(settings.BASEURL, job.id), { "msgs": [] })
+
+    @override_settings(MIXNET_PIPELINE=True, MIXNET_PIPELINE_SENDERS=0, CHUNK_SIZE=2)
+    def test_complete_voting_pipeline(self):
+        self.test_complete_voting()
+        self.assertFalse(PipelineStage.objects.exists())
+
+    @override_settings(MIXNET_PARALLEL_DECRYPT=True, MIXNET_FANOUT_THREADS=0)
+    def test_complete_voting_parallel_decrypt(self):
+        self.test_complete_voting()
+
+    @override_settings(MIXNET_DLOG_DIR=os.path.join(tempfile.gettempdir(), 'decide-dlog'))
+    def test_complete_voting_homomorphic(self):
+        v = self.create_voting()
+        v.tally_mode = TallyMode.HOMOMORPHIC
+        v.save()
+        self.create_voters(v)
+
+        v.create_pubkey()
+        v.start_date = timezone.now()
+        v.save()
+
+        pk = v.pub_key
+        options = list(v.question.options.order_by('number'))
+        voters = list(Census.objects.filter(voting_id=v.id))
+        clear = {}
+        for i, opt in enumerate(options):
+            clear[opt.number] = random.randint(0, 5)
+            for _ in range(clear[opt.number]):
+                voter = voters.pop()
+                data = {
+                    'voting': v.id,
+                    'voter': voter.voter_id,
+                    'vote': encrypt_ballot(i, len(options), pk.p, pk.g, pk.y),
+                }
+                user = self.get_or_create_user(voter.voter_id)
+                self.login(user=user.username)
+                mods.post('store', json=data)
+
+        # a ballot with two votes has no valid proof, and it isn't counted
+        voter = voters.pop()
+        ballot = encrypt_ballot(0, len(options), pk.p, pk.g, pk.y)
+        ballot["options"][1] = encrypt_ballot(0, len(options), pk.p, pk.g, pk.y)["options"][0]
+        user = self.get_or_create_user(voter.voter_id)
+        self.login(user=user.username)
+        data = { 'voting': v.id, 'voter': voter.voter_id, 'vote': ballot }
+        response = mods.post('store', json=data, response=True)
+        self.assertEqual(response.status_code, 400)
+
+        self.login()  # set token
+        v.tally_votes(self.token)
+
+        self.assertEqual(v.tally, { str(n): c for n, c in clear.items() })
+        for q in v.postproc:
+            self.assertEqual(clear[q["number"]], q["votes"])
+
     def test_create_voting_from_api(self):
         data = {'name': 'Example'}
         response = self.client.post('/voting/', data, format='json')
@@ -144,8 +258,63 @@ class VotingTestCase(BaseTestCase):
         response = self.client.post('/voting/', data, format='json')
         self.assertEqual(response.status_code, 201)
 
+    def test_voting_state(self):
+        voting = self.create_voting()
+        with mock.patch.object(mods, 'get', wraps=mods.get) as get:
+            state = voting_state(voting.pk)
+            self.assertEqual(state, {'id': voting.pk, 'start_date': None, 'end_date': None,
+                                     'tallied': False, 'options': 5,
+                                     'tally_mode': TallyMode.MIXNET, 'pub_key': None})
+            # not started, it's only cached in a shared cache
+            self.assertEqual(voting_state(voting.pk), state)
+            self.assertEqual(get.call_count, 2)
+            self.assertIsNone(voting_state('bad'))
+            self.assertEqual(get.call_count, 2)
+            with self.settings(VOTING_STATE_CACHE='default'):
+                self.assertEqual(voting_state(voting.pk), state)
+                self.assertEqual(get.call_count, 3)
+
+        # start and stop save the voting, the state is read again
+        self.login()
+        for action in ['start', 'stop']:
+            response = self.client.put('/voting/{}/'.format(voting.pk), {'action': action},
+                                       format='json')
+            self.assertEqual(response.status_code, 200)
+        voting.refresh_from_db()
+        with mock.patch.object(mods, 'get', wraps=mods.get) as get:
+            state = voting_state(voting.pk)
+            self.assertEqual(state['start_date'],
+                             voting.start_date.isoformat().replace('+00:00', 'Z'))
+            self.assertIsNotNone(state['end_date'])
+            # stopped, it's cached
+            self.assertEqual(voting_state(voting.pk), state)
+            self.assertEqual(get.call_count, 1)
+
+        voting.delete()
+        self.assertIsNone(voting_state(voting.pk))
+
+    def test_voting_state_open(self):
+        voting = self.create_voting()
+        voting.start_date = timezone.now()
+        voting.save()
+        with mock.patch.object(mods, 'get', wraps=mods.get) as get:
+            # the open votings are only cached in a shared cache
+            self.assertIsNone(voting_state(voting.pk)['end_date'])
+            self.assertIsNone(voting_state(voting.pk)['end_date'])
+            self.assertEqual(get.call_count, 2)
+            with self.settings(VOTING_STATE_CACHE='default'):
+                voting_state(voting.pk)
+                voting_state(voting.pk)
+                self.assertEqual(get.call_count, 3)
+                voting.end_date = timezone.now()
+                voting.save()
+                self.assertIsNotNone(voting_state(voting.pk)['end_date'])
+                self.assertEqual(get.call_count, 4)
+
     def test_update_voting(self):
         voting = self.create_voting()
+        # the tally fails without the mixnet of the voting
+        voting.create_pubkey()
 
         data = {'action': 'start'}
         response = self.client.post('/voting/{}/'.format(voting.pk), data, format='json')
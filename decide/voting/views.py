@@ -9,7 +9,7 @@ from django.views.generic import TemplateView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAdminUser
 
-from .models import Question, QuestionOption, Voting
+from .models import Question, QuestionOption, TallyError, TallyMode, Voting
 from .serializers import SimpleVotingSerializer, VotingSerializer, QuestionSerializer
 from base.perms import UserIsStaff
 from base.models import Auth
@@ -120,6 +120,9 @@ class VotingView(generics.ListCreateAPIView):
         for data in ['name', 'desc', 'question', 'question_type', 'question_opt']:
             if not data in request.data:
                 return Response({}, status=status.HTTP_400_BAD_REQUEST)
+        tally_mode = request.data.get('tally_mode', TallyMode.MIXNET)
+        if tally_mode not in TallyMode.values:
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
 
         question = Question(desc=request.data.get('question'), question_type=request.data.get('question_type'))
         question.save()
@@ -127,7 +130,7 @@ class VotingView(generics.ListCreateAPIView):
             opt = QuestionOption(question=question, option=q_opt, number=idx)
             opt.save()
         voting = Voting(name=request.data.get('name'), desc=request.data.get('desc'),
-                question=question)
+                question=question, tally_mode=tally_mode)
         voting.save()
 
         auth, _ = Auth.objects.get_or_create(url=settings.BASEURL,
@@ -177,12 +180,16 @@ class VotingUpdate(generics.RetrieveUpdateDestroyAPIView):
             elif not voting.end_date:
                 msg = 'Voting is not stopped'
                 st = status.HTTP_400_BAD_REQUEST
-            elif voting.tally:
+            elif voting.tally is not None:
                 msg = 'Voting already tallied'
                 st = status.HTTP_400_BAD_REQUEST
             else:
-                voting.tally_votes(request.auth.key)
-                msg = 'Voting tallied'
+                try:
+                    voting.tally_votes(request.auth.key)
+                    msg = 'Voting tallied'
+                except TallyError as e:
+                    msg = 'Voting not tallied: {}'.format(e)
+                    st = status.HTTP_502_BAD_GATEWAY
 
         return Response(msg, status=st)
 